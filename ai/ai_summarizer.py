@@ -1,50 +1,57 @@
 # /ai/ai_summarizer.py
 
 import os
-from openai import OpenAI
+import time
+import asyncio
 from dotenv import load_dotenv
 # 引入剛剛寫好的模板服務
-from db.template_service import get_all_templates
+from db.template_service import get_all_templates, get_template
+from ai.summary_cache import get_summary_cache, make_cache_key
+from ai.llm_client import get_llm_client, get_async_llm_client, aclose_llm_client
+from ai.context_builder import DEFAULT_CONTEXT_BUDGET, build_context, format_dropped_note
+from ai.prompt_encoding import DEFAULT_PROMPT_ENCODING, encode_patient_data, item_costs
+from ai.vitals_trend import DEFAULT_TREND_POINTS, build_vitals_digest
+from ai.hierarchical_summarizer import (DEFAULT_CHUNK_TOKENS, DEFAULT_CHUNK_CONCURRENCY, split_timeline,
+                                        summarize_chunks, build_reduce_text)
+from ai.token_utils import estimate_tokens
 
 load_dotenv()
 
-def generate_nursing_summary(patient_id, patient_data, template_name, custom_system_prompt=None, focus_areas=None):
-    """
-    接收病患結構化資料，發送給 AI 生成摘要。
-    
-    Args:
-        patient_id: 病歷號
-        patient_data: 資料字典
-        template_name: 模板名稱 (對應資料庫中的 template_name)
-        custom_system_prompt: (選用) 自定義 Prompt (優先權最高)
-        focus_areas: list of str，使用者指定的重點關注項目
-    """
-    if not patient_data:
-        return "錯誤：無資料可分析。"
+MODEL_NAME = "llama-3.3-70b-versatile"
+TEMPERATURE = 0.3
+# 病患資料區段的 token 預算 (取代固定的最新 25 / 40 / 25 筆)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", str(DEFAULT_CONTEXT_BUDGET)))
+# 病患資料的編碼方式 (lines / compact / timeline，見 ai/prompt_encoding.py)
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", DEFAULT_PROMPT_ENCODING)
+# 生理徵象筆數超過此數時，另附整段監測的趨勢摘要 (降採樣點數；0 = 不附)
+VITALS_TREND_POINTS = int(os.getenv("VITALS_TREND_POINTS", str(DEFAULT_TREND_POINTS)))
+VITALS_TREND_METHOD = os.getenv("VITALS_TREND_METHOD", "minmax")
+# 摘要方式 (見 ai/hierarchical_summarizer.py)
+#   budget       : 依 token 預算挑選資料，單次呼叫
+#   hierarchical : 全部紀錄分段摘要後再整合 (map-reduce)，資料只有一段時與 budget 相同
+SUMMARY_MODES = ("budget", "hierarchical")
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "budget")
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", str(DEFAULT_CHUNK_TOKENS)))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", str(DEFAULT_CHUNK_CONCURRENCY)))
 
-    # === 1. 從資料庫獲取所有模板 ===
-    # 這取代了原本寫死的 SYSTEM_PROMPTS 字典
-    db_templates = get_all_templates()
-    
-    # 確保有模板可用 (若資料庫連線失敗或無資料，使用備用預設值)
-    if not db_templates:
-        base_system_prompt = "你是專業醫療人員，請撰寫病程摘要。"
-        print("⚠️ 警告：無法從資料庫讀取模板，使用預設值。")
-    else:
-        # 嘗試根據名稱獲取內容，若找不到則預設用第一個抓到的
-        base_system_prompt = db_templates.get(template_name)
-        if not base_system_prompt:
-            # 如果指定的名稱找不到，就隨便抓一個當備用
-            base_system_prompt = next(iter(db_templates.values()))
-
-    # === 2. 決定最終使用的 System Prompt ===
-    # 優先順序：使用者手動編輯 > 資料庫模板
+def resolve_system_prompt(template_name, custom_system_prompt=None, focus_areas=None):
+    """決定 System Prompt (自訂 Prompt > 資料庫模板 > 預設值)，並附加關注項目指令"""
+    # 優先順序：使用者手動編輯 > 資料庫模板 (有自訂 Prompt 時完全不讀模板)
     if custom_system_prompt:
         selected_system_prompt = custom_system_prompt
     else:
-        selected_system_prompt = base_system_prompt
+        # 模板來自記憶體快取 (見 db/template_service.py)，不會每次生成都查資料庫
+        selected_system_prompt = get_template(template_name)
+        if not selected_system_prompt:
+            db_templates = get_all_templates()
+            if db_templates:
+                # 如果指定的名稱找不到，就隨便抓一個當備用
+                selected_system_prompt = next(iter(db_templates.values()))
+            else:
+                # 資料庫連線失敗或無資料，使用備用預設值
+                selected_system_prompt = "你是專業醫療人員，請撰寫病程摘要。"
+                print("⚠️ 警告：無法從資料庫讀取模板，使用預設值。")
 
-    # === 3. 加入關注項目 (Focus Areas) ===
     if focus_areas and len(focus_areas) > 0:
         focus_instruction = f"""
         
@@ -53,58 +60,318 @@ def generate_nursing_summary(patient_id, patient_data, template_name, custom_sys
 - {", ".join(focus_areas)}
         """
         selected_system_prompt += focus_instruction
+    return selected_system_prompt
 
-    # === 4. 資料截斷 (避免 Token 爆量) ===
-    LIMIT_NURSING = 25
-    LIMIT_LABS = 40
-    LIMIT_VITALS = 25
+def _vitals_digest(patient_data):
+    """生理徵象筆數超過 VITALS_TREND_POINTS 時的趨勢摘要 (見 ai/vitals_trend.py)，否則為空字串"""
+    if VITALS_TREND_POINTS and len(patient_data.get('vitals') or []) > VITALS_TREND_POINTS:
+        return build_vitals_digest(patient_data['vitals'], VITALS_TREND_POINTS, VITALS_TREND_METHOD)
+    return ""
 
-    nursing_list = patient_data.get('nursing', [])
-    labs_list = patient_data.get('labs', [])
-    vitals_list = patient_data.get('vitals', [])
+def build_summary_messages(patient_id, patient_data, template_name, custom_system_prompt=None, focus_areas=None,
+                           context_budget=None, report=None, encoding=None):
+    """
+    依模板、關注項目與病患資料組出送給模型的 messages (system + user)。
+    generate_nursing_summary / stream_nursing_summary 共用，兩者送出的內容完全一致 (快取 Key 也相同)。
 
-    if len(nursing_list) > LIMIT_NURSING: nursing_list = nursing_list[-LIMIT_NURSING:]
-    if len(labs_list) > LIMIT_LABS: labs_list = labs_list[-LIMIT_LABS:]
-    if len(vitals_list) > LIMIT_VITALS: vitals_list = vitals_list[-LIMIT_VITALS:]
+    context_budget: 病患資料區段的 token 預算 (預設 CONTEXT_TOKEN_BUDGET)
+    report: (選用) dict，會填入資料挑選報告 (選入 / 省略筆數等，見 build_context)
+    encoding: 病患資料的編碼方式 (預設 PROMPT_ENCODING，見 ai/prompt_encoding.py)
+    """
+    # === 1. System Prompt (模板 + 關注項目) ===
+    selected_system_prompt = resolve_system_prompt(template_name, custom_system_prompt, focus_areas)
 
-    # === 5. 建構 User Prompt (資料內容) ===
-    data_text = f"=== 病患 ID: {patient_id} 急診病程資料 (部分摘錄) ===\n\n"
+    # === 2. 生理徵象趨勢摘要 (見 ai/vitals_trend.py)：涵蓋全部監測，不受下方預算截斷影響 ===
+    budget = context_budget if context_budget is not None else CONTEXT_TOKEN_BUDGET
+    vitals_digest = _vitals_digest(patient_data)
+    digest_tokens = estimate_tokens(vitals_digest)
 
-    data_text += f"【護理紀錄】(最新 {len(nursing_list)} 筆)\n"
-    for item in nursing_list:
-        data_text += f"- {item.get('PROCDTTM', '')} | {item.get('SUBJECT', '')} | {item.get('DIAGNOSIS', '')}\n"
-    
-    data_text += f"\n【生理徵象】(最新 {len(vitals_list)} 筆)\n"
-    for item in vitals_list:
-        data_text += f"- {item.get('PROCDTTM')} | T:{item.get('ETEMPUTER')} | P:{item.get('EPLUSE')} | R:{item.get('EBREATHE')} | BP:{item.get('EPRESSURE')}/{item.get('EDIASTOLIC')} | SpO2:{item.get('ESAO2')} | GCS:{item.get('GCS')}\n"
+    # === 3. 依剩餘 token 預算挑選資料 (見 ai/context_builder.py)，成本依實際編碼估算 ===
+    encoding = encoding or PROMPT_ENCODING
+    selected, context_report = build_context(patient_data, max(budget - digest_tokens, 0), focus_areas,
+                                             costs=item_costs(patient_data, encoding))
+    context_report["vitals_digest_tokens"] = digest_tokens
+    if report is not None:
+        report.update(context_report)
 
-    data_text += f"\n【檢驗報告】(最新 {len(labs_list)} 筆)\n"
-    for item in labs_list:
-        data_text += f"- {item.get('CHRCPDTM')} | {item.get('CHHEAD')} : {item.get('CHVAL')} {item.get('CHUNIT')} (Ref: {item.get('REF_RANGE')})\n"
+    # === 4. 建構 User Prompt (資料內容) ===
+    data_text = "".join([
+        f"=== 病患 ID: {patient_id} 急診病程資料 ===\n\n",
+        vitals_digest + "\n" if vitals_digest else "",
+        encode_patient_data(selected, context_report['total'], encoding),
+        format_dropped_note(context_report),
+    ])
 
     # === Debug 輸出 ===
     print("\n" + "="*50)
-    print(f"🚀 [DEBUG] Template: {template_name} | Custom: {bool(custom_system_prompt)}")
+    print(f"🚀 [DEBUG] Template: {template_name} | Custom: {bool(custom_system_prompt)} | Encoding: {encoding}")
+    print(f"   資料 {context_report['tokens']}+趨勢 {digest_tokens}/{budget} tokens | 選入 {context_report['kept']} | "
+          f"省略 {context_report['dropped']} | 必留 {context_report['pinned']}")
     print("-" * 50)
     print(selected_system_prompt[-500:]) 
     print("="*50 + "\n")
 
-    # === 6. 呼叫 AI API (Groq) ===
-    client = OpenAI(
-        api_key=os.getenv("GROQ_API_KEY"), 
-        base_url="https://api.groq.com/openai/v1"
-    )
+    return [
+        {"role": "system", "content": selected_system_prompt},
+        {"role": "user", "content": data_text}
+    ]
+
+async def abuild_hierarchical_messages(patient_id, patient_data, template_name, custom_system_prompt=None,
+                                       focus_areas=None, report=None, encoding=None, use_cache=True,
+                                       complete=None):
+    """
+    階層式摘要的 reduce messages：全部紀錄分段、各段同時摘要 (見 ai/hierarchical_summarizer.py)，
+    再以模板整合各段摘要。資料只有一段時直接回傳 build_summary_messages 的結果。
+    需在 coroutine 內呼叫；任一區段摘要失敗時回傳 None。
+
+    report: (選用) dict，除資料筆數外另填入 chunks (段數)、chunks_cached (快取命中段數)、map_seconds
+    complete: (選用) 區段摘要的呼叫方式，見 summarize_chunks
+    """
+    encoding = encoding or PROMPT_ENCODING
+    chunks = split_timeline(patient_data, CHUNK_TOKENS, costs=item_costs(patient_data, encoding))
+    if len(chunks) <= 1:
+        return await asyncio.to_thread(build_summary_messages, patient_id, patient_data, template_name,
+                                       custom_system_prompt, focus_areas, report=report, encoding=encoding)
+
+    map_report = {}
+    summaries = await summarize_chunks(patient_id, chunks, MODEL_NAME, TEMPERATURE, focus_areas, encoding,
+                                       use_cache=use_cache, concurrency=CHUNK_CONCURRENCY, report=map_report,
+                                       complete=complete)
+    if summaries is None:
+        return None
+    selected_system_prompt = await asyncio.to_thread(resolve_system_prompt, template_name, custom_system_prompt,
+                                                     focus_areas)
+    data_text = build_reduce_text(patient_id, chunks, summaries, _vitals_digest(patient_data))
+
+    if report is not None:
+        total = {source: len(patient_data.get(source) or []) for source in ("nursing", "vitals", "labs")}
+        report.update(total=total, kept=dict(total), dropped={source: 0 for source in total},
+                      chunks=map_report["chunks"], chunks_cached=map_report["cached"],
+                      map_seconds=map_report["seconds"])
+    print(f"🚀 [DEBUG] Template: {template_name} | 分段摘要 {len(chunks)} 段 | reduce 資料 {estimate_tokens(data_text)} tokens")
+    return [
+        {"role": "system", "content": selected_system_prompt},
+        {"role": "user", "content": data_text}
+    ]
+
+def build_hierarchical_messages(*args, **kwargs):
+    """abuild_hierarchical_messages 的同步版本 (以獨立的 event loop 執行，結束時關閉該 loop 的連線)"""
+    async def run():
+        try:
+            return await abuild_hierarchical_messages(*args, **kwargs)
+        finally:
+            await aclose_llm_client()
+    return asyncio.run(run())
+
+def check_summary_mode(mode):
+    """mode 為 None 時取 SUMMARY_MODE；不支援的值丟出 ValueError"""
+    mode = mode or SUMMARY_MODE
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"不支援的摘要方式: {mode} (可用: {', '.join(SUMMARY_MODES)})")
+    return mode
+
+def complete_messages(messages, use_cache=True):
+    """
+    送出組好的 messages (先查摘要快取)。
+    回傳 (摘要, 錯誤訊息)；成功時錯誤訊息為 None，只有成功的結果會寫入快取。
+    """
+    # === 查快取：送出的內容完全相同時直接回傳上次的摘要 ===
+    cache = get_summary_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(MODEL_NAME, messages, TEMPERATURE)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"♻️ 摘要快取命中 ({cache_key[:12]})")
+            return cached, None
+
+    # === 呼叫 AI API (Groq)：共用用戶端，連線保持 keep-alive ===
+    client = get_llm_client()
     
     try:
         response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": selected_system_prompt},
-                {"role": "user", "content": data_text}
-            ],
-            temperature=0.3, 
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=TEMPERATURE, 
+        )
+        summary = response.choices[0].message.content
+    except Exception as e:
+        print(f"❌ API Error: {e}")
+        return None, str(e)
+
+    # 只快取成功的結果
+    if cache is not None and summary:
+        cache.put(cache_key, MODEL_NAME, summary)
+    return summary, None
+
+def generate_nursing_summary(patient_id, patient_data, template_name, custom_system_prompt=None, focus_areas=None,
+                             use_cache=True, encoding=None, mode=None):
+    """
+    接收病患結構化資料，發送給 AI 生成摘要。
+    
+    Args:
+        patient_id: 病歷號
+        patient_data: 資料字典
+        template_name: 模板名稱 (對應資料庫中的 template_name)
+        custom_system_prompt: (選用) 自定義 Prompt (優先權最高)
+        focus_areas: list of str，使用者指定的重點關注項目
+        use_cache: 是否使用摘要快取 (見 ai/summary_cache.py)；False 時一定重新呼叫 API
+        encoding: 病患資料的編碼方式 (lines / compact / timeline，預設 PROMPT_ENCODING)
+        mode: 摘要方式 (budget / hierarchical，預設 SUMMARY_MODE)
+    """
+    mode = check_summary_mode(mode)
+    if not patient_data:
+        return "錯誤：無資料可分析。"
+
+    if mode == "hierarchical":
+        messages = build_hierarchical_messages(patient_id, patient_data, template_name, custom_system_prompt,
+                                               focus_areas, encoding=encoding, use_cache=use_cache)
+        if messages is None:
+            return "AI 生成失敗: 分段摘要未完成"
+    else:
+        messages = build_summary_messages(patient_id, patient_data, template_name, custom_system_prompt,
+                                          focus_areas, encoding=encoding)
+
+    summary, error = complete_messages(messages, use_cache)
+    return summary if error is None else f"AI 生成失敗: {error}"
+
+async def agenerate_nursing_summary(patient_id, patient_data, template_name, custom_system_prompt=None,
+                                    focus_areas=None, use_cache=True, encoding=None, mode=None):
+    """
+    generate_nursing_summary 的 coroutine 版本：同一個 event loop 上可同時有多份摘要在等待模型回應。
+    參數與回傳值與 generate_nursing_summary 相同。
+    """
+    mode = check_summary_mode(mode)
+    if not patient_data:
+        return "錯誤：無資料可分析。"
+
+    if mode == "hierarchical":
+        messages = await abuild_hierarchical_messages(patient_id, patient_data, template_name, custom_system_prompt,
+                                                      focus_areas, encoding=encoding, use_cache=use_cache)
+        if messages is None:
+            return "AI 生成失敗: 分段摘要未完成"
+    else:
+        # 組 Prompt (模板快取未命中時會查資料庫) 與快取讀寫是同步 I/O，移到執行緒避免卡住 event loop
+        messages = await asyncio.to_thread(
+            build_summary_messages, patient_id, patient_data, template_name, custom_system_prompt, focus_areas,
+            encoding=encoding,
+        )
+
+    cache = get_summary_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(MODEL_NAME, messages, TEMPERATURE)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            print(f"♻️ 摘要快取命中 ({cache_key[:12]})")
+            return cached
+
+    client = get_async_llm_client()
+    try:
+        response = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=TEMPERATURE,
         )
-        return response.choices[0].message.content
+        summary = response.choices[0].message.content
     except Exception as e:
         print(f"❌ API Error: {e}")
-        return f"AI 生成失敗: {e}"
\ No newline at end of file
+        return f"AI 生成失敗: {e}"
+
+    if cache is not None and summary:
+        await asyncio.to_thread(cache.put, cache_key, MODEL_NAME, summary)
+    return summary
+
+def stream_nursing_summary(patient_id, patient_data, template_name, custom_system_prompt=None, focus_areas=None,
+                           use_cache=True, timings=None, encoding=None, mode=None):
+    """
+    串流版的 generate_nursing_summary：模型每產生一段文字就 yield 一段，前端可邊收邊顯示。
+
+    參數與 generate_nursing_summary 相同；另可傳入 timings (dict)，結束後會填入：
+        cached: 是否為快取結果
+        ttft: 送出請求到收到第一段文字的秒數 (time to first token)
+        total: 送出請求到全部完成的秒數
+        chunks: 收到的片段數
+        failed: 是否失敗 (失敗時 yield 的是錯誤訊息)
+        context: 資料挑選報告 (選入 / 省略筆數，見 ai/context_builder.build_context；
+                 hierarchical 另有分段數，見 abuild_hierarchical_messages)
+    hierarchical 時先完成各區段摘要，只串流最後的整合；ttft 包含區段摘要的時間。
+    快取命中時整份摘要一次 yield；發生錯誤時 yield 錯誤訊息後結束，且不寫入快取。
+    """
+    mode = check_summary_mode(mode)
+    timings = timings if timings is not None else {}
+    timings.update(cached=False, ttft=None, total=None, chunks=0, context=None, failed=False)
+
+    if not patient_data:
+        timings["failed"] = True
+        yield "錯誤：無資料可分析。"
+        return
+
+    t0 = time.perf_counter()
+    timings["context"] = {}
+    if mode == "hierarchical":
+        messages = build_hierarchical_messages(patient_id, patient_data, template_name, custom_system_prompt,
+                                               focus_areas, report=timings["context"], encoding=encoding,
+                                               use_cache=use_cache)
+        if messages is None:
+            timings.update(failed=True, total=time.perf_counter() - t0)
+            yield "AI 生成失敗: 分段摘要未完成"
+            return
+    else:
+        messages = build_summary_messages(patient_id, patient_data, template_name, custom_system_prompt,
+                                          focus_areas, report=timings["context"], encoding=encoding)
+
+    yield from stream_messages(messages, use_cache, timings, t0)
+
+def stream_messages(messages, use_cache=True, timings=None, t0=None):
+    """
+    串流送出組好的 messages (先查摘要快取)；timings 的欄位同 stream_nursing_summary，
+    另有 failed (是否失敗)。t0 為計時起點 (預設為呼叫當下)。
+    """
+    timings = timings if timings is not None else {}
+    timings.setdefault("ttft", None)
+    timings.setdefault("chunks", 0)
+    timings["failed"] = False
+    t0 = t0 if t0 is not None else time.perf_counter()
+
+    cache = get_summary_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(MODEL_NAME, messages, TEMPERATURE)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"♻️ 摘要快取命中 ({cache_key[:12]})")
+            timings.update(cached=True, ttft=time.perf_counter() - t0, total=time.perf_counter() - t0, chunks=1)
+            yield cached
+            return
+
+    client = get_llm_client()
+    parts = []
+    try:
+        stream = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=TEMPERATURE,
+            stream=True,
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if not text:
+                continue
+            if timings["ttft"] is None:
+                timings["ttft"] = time.perf_counter() - t0
+            timings["chunks"] += 1
+            parts.append(text)
+            yield text
+    except Exception as e:
+        print(f"❌ API Error: {e}")
+        timings.update(failed=True, total=time.perf_counter() - t0)
+        yield f"\n\nAI 生成失敗: {e}"
+        return
+
+    timings["total"] = time.perf_counter() - t0
+    summary = "".join(parts)
+    if cache is not None and summary:
+        cache.put(cache_key, MODEL_NAME, summary)
@@ -0,0 +1,358 @@
+# /ai/batch_summarizer.py
+#
+# 批次生成摘要 (例如交班時整個急診的病患一次產出)。
+#   - 病患資料每 BATCH_FETCH_SIZE 位批次撈取一次 (見 db/patient_service.get_patients_full_history)，
+#     摘要當前這批時先撈下一批；記憶體只跟批次大小有關，與總人數無關
+#   - 多份摘要同時在途 (asyncio + 共用 AsyncOpenAI 連線池)
+#   - token bucket 同時限制 RPM / TPM，避免一開跑就吃 429
+#   - 429 / 5xx / 連線錯誤以指數退避 + 隨機抖動重試 (有 Retry-After 時依其指示)
+#   - 每完成一位就寫入 checkpoint (含模板、時間區間、就診等設定)，中斷後以相同設定重跑會跳過已完成的病患
+#
+# 用法：
+#   python -m ai.batch_summarizer --template 交班報告 --output-dir output/handoff --patients 0002452972 0001217175
+#   python -m ai.batch_summarizer --template 交班報告 --output-dir output/handoff --all --start-time 20251121000000
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+
+import openai
+
+from db.patient_service import LAB_MODES, LATEST_ENCOUNTER, get_patients_full_history, get_patients_overview_page
+from db.template_service import get_template
+from ai.ai_summarizer import (MODEL_NAME, TEMPERATURE, PROMPT_ENCODING, SUMMARY_MODES, build_summary_messages,
+                              abuild_hierarchical_messages, check_summary_mode)
+from ai.prompt_encoding import PROMPT_ENCODINGS
+from ai.llm_client import get_async_llm_client, aclose_llm_client
+from ai.rate_limiter import RateLimiter
+from ai.summary_cache import get_summary_cache, make_cache_key
+from ai.token_utils import estimate_message_tokens
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+# 預估每份摘要的輸出 token 數 (送出前先向 TPM 水桶預扣，完成後再依實際用量修正)
+OUTPUT_TOKEN_ESTIMATE = int(os.getenv("BATCH_OUTPUT_TOKENS", "800"))
+# 每次撈取幾位病患的資料
+FETCH_BATCH_SIZE = int(os.getenv("BATCH_FETCH_SIZE", "50"))
+# 重試退避：第 n 次等待 min(上限, 基準 * 2^n) 內的隨機秒數
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _retry_delay(error, attempt):
+    """指數退避 + 完整抖動；供應商有回 Retry-After 時至少等那麼久"""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+def checkpoint_settings(template_name, start_time=None, end_time=None, encounter=None, focus_areas=None,
+                        encoding=None, lab_mode="all", mode=None):
+    """
+    影響摘要內容的設定，與每位病患的 checkpoint 紀錄一起保存；
+    重跑時只有設定完全相同的紀錄才算已完成 (換了模板、時間區間或就診就重新生成)。
+    """
+    return {
+        "template": template_name,
+        "start_time": start_time,
+        "end_time": end_time,
+        "encounter": encounter,
+        "focus": sorted(focus_areas or []),
+        "encoding": encoding or PROMPT_ENCODING,
+        "lab_mode": lab_mode,
+        "mode": check_summary_mode(mode),
+    }
+
+def load_checkpoint(output_dir):
+    """讀取 checkpoint：{病歷號: 最後一筆紀錄}"""
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # 中斷時寫到一半的最後一行
+            done[record["patient_id"]] = record
+    return done
+
+def _append_checkpoint(output_dir, record):
+    with open(os.path.join(output_dir, CHECKPOINT_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _write_summary(output_dir, patient_id, summary):
+    path = os.path.join(output_dir, f"{patient_id}.md")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(summary)
+    os.replace(tmp_path, path)
+    return path
+
+def list_overview_patients(start_time=None, end_time=None, page_size=500):
+    """列出病患總覽中，就診期間與時間區間重疊的所有病歷號 (逐頁讀取)"""
+    patient_ids = []
+    after = None
+    while True:
+        page = get_patients_overview_page(page_size, after=after, start_time=start_time, end_time=end_time)
+        if page is None:
+            return None
+        patient_ids.extend(p["病歷號"] for p in page["patients"])
+        after = page["next_cursor"]
+        if after is None:
+            return patient_ids
+
+async def _complete_with_retry(client, messages, limiter, estimated, max_retries, stats):
+    """送出一個請求；可重試的錯誤依退避重試，超過次數或不可重試時丟出例外"""
+    attempt = 0
+    while True:
+        await limiter.acquire(estimated)
+        try:
+            response = await client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                temperature=TEMPERATURE,
+            )
+        except Exception as e:
+            # 已送出的請求仍算在供應商的額度內，預扣的 token 不退回
+            if not _is_retryable(e) or attempt >= max_retries:
+                raise
+            delay = _retry_delay(e, attempt)
+            stats["retries"] += 1
+            print(f"⚠️ {type(e).__name__}，{delay:.1f} 秒後重試 (第 {attempt + 1} 次)")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        usage = getattr(response, "usage", None)
+        actual = usage.total_tokens if usage is not None else None
+        limiter.record_usage(estimated, actual)
+        return response.choices[0].message.content, (actual if actual is not None else estimated)
+
+async def summarize_batch(patient_ids, template_name, output_dir, start_time=None, end_time=None,
+                          concurrency=8, rpm=None, tpm=None, max_retries=5,
+                          focus_areas=None, use_cache=True, resume=True, encoding=None,
+                          lab_mode="all", mode=None, encounters=None, fetch_batch_size=None):
+    """
+    為多位病患生成摘要，每位存成 output_dir/<病歷號>.md，並回傳執行統計。
+
+    Args:
+        patient_ids: 病歷號清單
+        template_name: 模板名稱 (必須存在於資料庫)
+        output_dir: 輸出資料夾 (同時存放 checkpoint.jsonl)
+        start_time / end_time: 病患資料的時間區間
+        concurrency: 同時在途的請求數上限
+        rpm / tpm: 每分鐘請求數 / token 數上限 (None 表示不限制)
+        max_retries: 429 / 5xx / 連線錯誤的最大重試次數
+        resume: True 時跳過 checkpoint 中已成功、且設定 (checkpoint_settings) 與這次相同的病患
+        encoding: 病患資料的編碼方式 (lines / compact / timeline，預設 PROMPT_ENCODING)；compact 約可省一半輸入 token
+        lab_mode: 檢驗資料範圍 (見 db/patient_service.LAB_MODES)，在資料庫端篩選
+        mode: 摘要方式 (budget / hierarchical，預設 SUMMARY_MODE)；hierarchical 的區段摘要同樣經過速率限制與重試
+        encounters: 每位病患要摘要的就診 (LATEST_ENCOUNTER 或 {病歷號: 急診號}，見 get_patients_full_history)；
+            None 為所有就診
+        fetch_batch_size: 每次撈取的病患數 (預設 BATCH_FETCH_SIZE)
+    Returns:
+        統計 dict；模板不存在時回傳 None
+    """
+    mode = check_summary_mode(mode)
+    t0 = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    if await asyncio.to_thread(get_template, template_name) is None:
+        print(f"❌ 找不到模板「{template_name}」")
+        return None
+
+    def settings_for(patient_id):
+        encounter = encounters.get(patient_id) if isinstance(encounters, dict) else encounters
+        return checkpoint_settings(template_name, start_time, end_time, encounter, focus_areas,
+                                   encoding, lab_mode, mode)
+
+    done = load_checkpoint(output_dir) if resume else {}
+    # 去除重複並保留順序
+    patient_ids = list(dict.fromkeys(patient_ids))
+    finished = {pid for pid in patient_ids if done.get(pid, {}).get("status") == "ok"}
+    current = {pid for pid in finished if done[pid].get("settings") == settings_for(pid)}
+    todo = [pid for pid in patient_ids if pid not in current]
+    stats = {"total": len(patient_ids), "skipped": len(current), "ok": 0, "cached": 0,
+             "empty": 0, "failed": 0, "retries": 0, "tokens": 0}
+    print(f"--- 共 {len(patient_ids)} 位病患，已完成 {stats['skipped']} 位，本次處理 {len(todo)} 位 ---")
+    if len(finished) > len(current):
+        print(f"⚠️  checkpoint 中有 {len(finished) - len(current)} 位是以不同設定 (模板 / 時間區間 / 就診等) 生成，重新生成")
+
+    limiter = RateLimiter(rpm, tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    client = get_async_llm_client().with_options(max_retries=0)   # 重試由這裡統一處理，避免雙重重試
+    cache = get_summary_cache() if use_cache else None
+
+    async def summarize_patient(patient_id, data, record):
+        """單一病患的摘要流程，結果寫入 record；組 Prompt、快取讀寫與寫檔都在 thread 中執行，不阻塞其他請求"""
+        chunk_tokens = 0
+
+        async def complete_chunk(chunk_messages):
+            nonlocal chunk_tokens
+            estimated = estimate_message_tokens(chunk_messages) + OUTPUT_TOKEN_ESTIMATE
+            async with semaphore:
+                content, tokens = await _complete_with_retry(client, chunk_messages, limiter, estimated,
+                                                             max_retries, stats)
+            chunk_tokens += tokens
+            return content
+
+        if mode == "hierarchical":
+            messages = await abuild_hierarchical_messages(patient_id, data, template_name, focus_areas=focus_areas,
+                                                          encoding=encoding, use_cache=use_cache,
+                                                          complete=complete_chunk)
+        else:
+            messages = await asyncio.to_thread(build_summary_messages, patient_id, data, template_name,
+                                               focus_areas=focus_areas, encoding=encoding)
+        if messages is None:
+            record.update(status="failed", error="分段摘要失敗", tokens=chunk_tokens)
+            return
+        cache_key = make_cache_key(MODEL_NAME, messages, TEMPERATURE) if cache is not None else None
+        summary = await asyncio.to_thread(cache.get, cache_key) if cache_key is not None else None
+        if summary is not None:
+            record.update(status="ok", cached=True, tokens=chunk_tokens)
+        else:
+            estimated = estimate_message_tokens(messages) + OUTPUT_TOKEN_ESTIMATE
+            async with semaphore:
+                summary, tokens = await _complete_with_retry(client, messages, limiter, estimated,
+                                                             max_retries, stats)
+            if not summary:
+                raise ValueError("模型回傳空白內容")
+            if cache is not None:
+                await asyncio.to_thread(cache.put, cache_key, MODEL_NAME, summary)
+            record.update(status="ok", cached=False, tokens=tokens + chunk_tokens)
+        record["file"] = await asyncio.to_thread(_write_summary, output_dir, patient_id, summary)
+
+    async def summarize_one(patient_id, data):
+        started = time.perf_counter()
+        record = {"patient_id": patient_id, "settings": settings_for(patient_id)}
+        if data is None:
+            record.update(status="failed", error="資料撈取失敗")
+        elif not any(data.values()):
+            record.update(status="empty")
+        else:
+            try:
+                await summarize_patient(patient_id, data, record)
+            except Exception as e:
+                # 任何例外都只算這位病患失敗，不中斷整批 (其他病患的請求仍在進行)
+                print(f"❌ 病患 {patient_id} 摘要失敗: {e}")
+                record.pop("file", None)
+                record.update(status="failed", cached=False, error=str(e))
+
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        stats[record["status"]] += 1
+        stats["cached"] += bool(record.get("cached"))
+        stats["tokens"] += record.get("tokens", 0)
+        _append_checkpoint(output_dir, record)
+        finished = stats["ok"] + stats["empty"] + stats["failed"]
+        print(f"[{finished}/{len(todo)}] {patient_id} {record['status']} ({record['seconds']:.1f}s)")
+
+    fetch_seconds = 0.0
+
+    async def fetch(batch):
+        nonlocal fetch_seconds
+        started = time.perf_counter()
+        histories = await asyncio.to_thread(get_patients_full_history, batch, start_time, end_time,
+                                            lab_mode=lab_mode, encounters=encounters)
+        fetch_seconds += time.perf_counter() - started
+        return histories
+
+    size = max(fetch_batch_size or FETCH_BATCH_SIZE, 1)
+    batches = [todo[i:i + size] for i in range(0, len(todo), size)]
+    try:
+        # 摘要這一批的同時撈下一批，同一時間最多只有兩批病患的資料在記憶體中
+        pending = asyncio.create_task(fetch(batches[0])) if batches else None
+        for n, batch in enumerate(batches):
+            histories = await pending
+            pending = asyncio.create_task(fetch(batches[n + 1])) if n + 1 < len(batches) else None
+            await asyncio.gather(*(summarize_one(pid, histories.get(pid)) for pid in batch))
+            del histories
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+        await aclose_llm_client()
+
+    elapsed = time.perf_counter() - t0
+    stats["fetch_seconds"] = round(fetch_seconds, 3)
+    stats["seconds"] = round(elapsed, 3)
+    stats["rate_limit_wait"] = round(limiter.waited, 3)
+    stats["summaries_per_min"] = round(stats["ok"] / elapsed * 60, 2) if elapsed else 0.0
+    stats["tokens_per_sec"] = round(stats["tokens"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批次生成病患摘要")
+    parser.add_argument('--template', required=True, help="模板名稱")
+    parser.add_argument('--output-dir', required=True, help="輸出資料夾 (每位病患一個 .md，另有 checkpoint.jsonl)")
+    parser.add_argument('--patients', nargs='*', default=[], help="病歷號清單")
+    parser.add_argument('--patients-file', help="病歷號清單檔 (一行一個)")
+    parser.add_argument('--all', action='store_true', help="病患總覽中，就診期間與 --start-time ~ --end-time 重疊的所有病患")
+    parser.add_argument('--start-time', help="資料起始時間 YYYYMMDDHHMMSS")
+    parser.add_argument('--end-time', help="資料結束時間 YYYYMMDDHHMMSS")
+    parser.add_argument('--focus', nargs='*', default=None, help="重點關注項目")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv("BATCH_CONCURRENCY", "8")), help="同時在途的請求數")
+    parser.add_argument('--rpm', type=int, default=int(os.getenv("LLM_RPM", "30")), help="每分鐘請求數上限 (0 = 不限制)")
+    parser.add_argument('--tpm', type=int, default=int(os.getenv("LLM_TPM", "12000")), help="每分鐘 token 數上限 (0 = 不限制)")
+    parser.add_argument('--max-retries', type=int, default=5, help="429 / 5xx 最大重試次數")
+    parser.add_argument('--fetch-batch-size', type=int, default=FETCH_BATCH_SIZE, help="每次撈取幾位病患的資料")
+    parser.add_argument('--no-resume', action='store_true', help="忽略 checkpoint，全部重新生成")
+    parser.add_argument('--no-cache', action='store_true', help="不使用摘要快取")
+    parser.add_argument('--encoding', choices=PROMPT_ENCODINGS, default=None,
+                        help="病患資料編碼 (預設取環境變數 PROMPT_ENCODING)")
+    parser.add_argument('--mode', choices=SUMMARY_MODES, default=None,
+                        help="摘要方式：budget (依預算挑資料) / hierarchical (分段摘要再整合；預設取環境變數 SUMMARY_MODE)")
+    parser.add_argument('--lab-mode', choices=LAB_MODES, default="all",
+                        help="檢驗資料範圍：全部 / 異常 / 每項最新 / 每項首末 / 只送有變化的值")
+    parser.add_argument('--encounter', choices=(LATEST_ENCOUNTER, "all"), default=LATEST_ENCOUNTER,
+                        help="就診範圍：latest 只摘要每位病患最近一次就診 (預設) / all 合併歷次就診")
+    args = parser.parse_args()
+
+    patient_ids = list(args.patients)
+    if args.patients_file:
+        with open(args.patients_file, 'r', encoding='utf-8') as f:
+            patient_ids.extend(line.strip() for line in f if line.strip())
+    if args.all:
+        overview_ids = list_overview_patients(args.start_time, args.end_time)
+        if overview_ids is None:
+            print("❌ 無法讀取病患總覽")
+            sys.exit(1)
+        patient_ids.extend(overview_ids)
+    if not patient_ids:
+        parser.error("請以 --patients、--patients-file 或 --all 指定病患")
+
+    stats = asyncio.run(summarize_batch(
+        patient_ids, args.template, args.output_dir,
+        start_time=args.start_time, end_time=args.end_time,
+        concurrency=args.concurrency, rpm=args.rpm or None, tpm=args.tpm or None,
+        max_retries=args.max_retries, focus_areas=args.focus,
+        use_cache=not args.no_cache, resume=not args.no_resume, encoding=args.encoding,
+        lab_mode=args.lab_mode, mode=args.mode,
+        encounters=LATEST_ENCOUNTER if args.encounter == LATEST_ENCOUNTER else None,
+        fetch_batch_size=args.fetch_batch_size,
+    ))
+    if stats is None:
+        sys.exit(1)
+
+    print("\n" + "=" * 60)
+    print(f"完成 {stats['ok']} 位 (快取 {stats['cached']} 位) | 無資料 {stats['empty']} | 失敗 {stats['failed']} | "
+          f"先前已完成 {stats['skipped']}")
+    print(f"總耗時 {stats['seconds']:.1f} 秒 (撈資料 {stats['fetch_seconds']:.1f} 秒) | "
+          f"{stats['summaries_per_min']:.1f} 份/分鐘 | {stats['tokens_per_sec']:.0f} tokens/秒")
+    print(f"重試 {stats['retries']} 次 | 速率限制等待合計 {stats['rate_limit_wait']:.1f} 秒")
+    print("=" * 60)
+    sys.exit(1 if stats['failed'] else 0)
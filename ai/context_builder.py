@@ -0,0 +1,231 @@
+# /ai/context_builder.py
+
+# 依 token 預算挑選要送給模型的病患資料 (取代固定的「最新 25 / 40 / 25 筆」截斷)
+#
+# 挑選順序：
+#   1. 必留項目 (依序，最多用到預算的 PINNED_SHARE，超過時後面的先放棄)
+#      - 到院第一筆護理紀錄 (檢傷 / 入院評估)
+#      - 異常檢驗值
+#      - 生命徵象極值 (最高 / 最低體溫、脈搏、血壓、呼吸，最低血氧、最低 GCS)
+#      - 內容符合使用者勾選關注項目的護理紀錄
+#   2. 剩餘預算依時間由新到舊補入其餘紀錄
+# 每筆資料的成本以實際要送出的那一行文字估算 token 數，最後依時間排序輸出，並回報被省略的內容。
+
+import re
+
+from ai.token_utils import estimate_tokens
+
+# 病患資料 (User Prompt 的資料區段) 預設 token 預算
+DEFAULT_CONTEXT_BUDGET = 6000
+# 必留項目最多佔預算的比例，其餘保留給最新的紀錄 (避免大量異常檢驗把近況擠掉)
+PINNED_SHARE = 0.6
+
+SOURCES = ("nursing", "vitals", "labs")
+TIME_KEYS = {"nursing": "PROCDTTM", "vitals": "PROCDTTM", "labs": "CHRCPDTM"}
+
+# ==========================================
+# 每筆資料轉成一行文字 (與 Prompt 中的格式一致)
+# ==========================================
+def format_nursing_line(item):
+    return f"- {item.get('PROCDTTM', '')} | {item.get('SUBJECT', '')} | {item.get('DIAGNOSIS', '')}\n"
+
+def format_vitals_line(item):
+    return (f"- {item.get('PROCDTTM')} | T:{item.get('ETEMPUTER')} | P:{item.get('EPLUSE')} | R:{item.get('EBREATHE')} | "
+            f"BP:{item.get('EPRESSURE')}/{item.get('EDIASTOLIC')} | SpO2:{item.get('ESAO2')} | GCS:{item.get('GCS')}\n")
+
+# 檢驗異常註記 (LAB_FLAG，見 sql/migrations/006_lab_flags.sql) 在 Prompt 中的寫法；N / 無註記不顯示
+FLAG_MARKS = {"H": "↑", "L": "↓", "HH": "↑↑危急", "LL": "↓↓危急", "A": "異常"}
+CRITICAL_FLAGS = ("HH", "LL")
+
+def flag_mark(item):
+    mark = FLAG_MARKS.get(item.get("FLAG"))
+    return f" {mark}" if mark else ""
+
+def format_labs_line(item):
+    return (f"- {item.get('CHRCPDTM')} | {item.get('CHHEAD')} : {item.get('CHVAL')} {item.get('CHUNIT')} "
+            f"(Ref: {item.get('REF_RANGE')}){flag_mark(item)}\n")
+
+LINE_FORMATTERS = {
+    "nursing": format_nursing_line,
+    "vitals": format_vitals_line,
+    "labs": format_labs_line,
+}
+
+# ==========================================
+# 必留項目判斷
+# ==========================================
+# 使用者勾選的關注項目 -> 護理紀錄關鍵字
+FOCUS_KEYWORDS = {
+    "護理處置經過": ["給予", "給藥", "注射", "執行", "處置", "協助", "予", "IV", "on "],
+    "病患主訴": ["主訴", "訴", "自述", "抱怨", "c/o", "complain"],
+    "管路狀況": ["管路", "導管", "尿管", "鼻胃管", "Foley", "NG", "CVC", "A-line", "endo", "留置", "點滴", "IV"],
+    "意識狀態(GCS)": ["GCS", "意識", "清醒", "嗜睡", "昏迷", "躁動", "混亂", "瞳孔", "E4", "E3", "E2", "E1"],
+    "生命徵象趨勢": ["發燒", "血壓", "心跳", "脈搏", "呼吸", "血氧", "SpO2", "BT", "BP"],
+    "檢驗報告異常值": ["檢驗", "報告", "抽血", "culture", "Lab"],
+}
+
+_NUMBER = re.compile(r'^[<>≦≧=]*\s*(-?\d+(?:\.\d+)?)')
+_POSITIVE = {"positive", "陽性", "reactive", "1+", "2+", "3+", "4+"}
+
+def _to_float(value):
+    if value is None:
+        return None
+    match = _NUMBER.match(str(value).strip())
+    return float(match.group(1)) if match else None
+
+def lab_is_abnormal(item):
+    """檢驗值是否異常：有 FLAG 欄位時直接採用，否則以 REF_RANGE (下限~上限) 判斷"""
+    flag = item.get("FLAG")
+    if flag is not None:
+        return flag != "N"
+    value = str(item.get("CHVAL") or "").strip()
+    low_text, _, high_text = str(item.get("REF_RANGE") or "").partition("~")
+    low, high = _to_float(low_text), _to_float(high_text)
+    number = _to_float(value)
+    if number is None or (low is None and high is None):
+        return value.lower() in _POSITIVE
+    return (low is not None and number < low) or (high is not None and number > high)
+
+def _gcs_total(text):
+    digits = re.findall(r'\d+', str(text or ""))
+    return sum(int(d) for d in digits) if len(digits) == 3 else None
+
+# 生命徵象極值：(欄位, 取值函數, 要最大還是最小)
+VITAL_EXTREMES = [
+    ("ETEMPUTER", _to_float, max), ("ETEMPUTER", _to_float, min),
+    ("EPLUSE", _to_float, max), ("EPLUSE", _to_float, min),
+    ("EBREATHE", _to_float, max),
+    ("EPRESSURE", _to_float, max), ("EPRESSURE", _to_float, min),
+    ("ESAO2", _to_float, min),
+    ("GCS", _gcs_total, min),
+]
+
+def _vital_extreme_indexes(vitals):
+    indexes = []
+    for key, parse, pick in VITAL_EXTREMES:
+        values = [(parse(item.get(key)), i) for i, item in enumerate(vitals)]
+        values = [(v, i) for v, i in values if v is not None]
+        if values:
+            # 同值時取較新的一筆
+            best = pick(v for v, _ in values)
+            indexes.append(max(i for v, i in values if v == best))
+    return indexes
+
+def _matches_focus(item, keywords):
+    text = f"{item.get('SUBJECT') or ''} {item.get('DIAGNOSIS') or ''}"
+    return any(k in text for k in keywords)
+
+def normalize_time(value):
+    """時間統一成 14 碼 YYYYMMDDHHMMSS (檢驗時間只有 12 碼，補秒數)；沒有時間時為空字串"""
+    return str(value or "").strip().ljust(14, "0") if value else ""
+
+def _time_of(source, item):
+    return normalize_time(item.get(TIME_KEYS[source]))
+
+# ==========================================
+# 主函數
+# ==========================================
+def build_context(patient_data, budget=DEFAULT_CONTEXT_BUDGET, focus_areas=None, formatters=None, costs=None):
+    """
+    在 token 預算內挑選病患資料。
+
+    Args:
+        patient_data: {"nursing": [...], "vitals": [...], "labs": [...]} (各自依時間排序)
+        budget: 資料區段可用的 token 數
+        focus_areas: 使用者勾選的重點關注項目
+        formatters: {來源: 單筆轉文字函數}，用來估算成本 (預設 LINE_FORMATTERS)
+        costs: (選用) {來源: [每筆 token 數]}，已依實際編碼算好的成本 (見 prompt_encoding.item_costs)，給了就不用 formatters
+    Returns:
+        (selected, report)
+        selected: 與 patient_data 相同結構，只含選入的資料，維持時間順序
+        report: {"budget", "tokens", "kept": {來源: 筆數}, "total": {來源: 筆數},
+                 "dropped": {來源: 筆數}, "dropped_range": {來源: (最早, 最晚)},
+                 "pinned": {類別: 筆數}, "pinned_dropped": 預算不足而放棄的必留筆數}
+    """
+    formatters = formatters or LINE_FORMATTERS
+    data = {source: list(patient_data.get(source) or []) for source in SOURCES}
+
+    if costs is None:
+        costs = {source: [estimate_tokens(formatters[source](item)) for item in items] for source, items in data.items()}
+    chosen = {source: set() for source in SOURCES}
+    used = 0
+
+    def take(source, index, limit):
+        nonlocal used
+        if index in chosen[source]:
+            return True
+        cost = costs[source][index]
+        if used + cost > limit:
+            return False
+        chosen[source].add(index)
+        used += cost
+        return True
+
+    # --- 1. 必留項目 ---
+    pinned = []
+    if data["nursing"]:
+        pinned.append(("到院紀錄", "nursing", 0))
+    # 異常檢驗：危急值優先，其次新的優先
+    abnormal = [i for i in reversed(range(len(data["labs"]))) if lab_is_abnormal(data["labs"][i])]
+    abnormal.sort(key=lambda i: data["labs"][i].get("FLAG") not in CRITICAL_FLAGS)
+    pinned.extend(("異常檢驗", "labs", i) for i in abnormal)
+    for i in _vital_extreme_indexes(data["vitals"]):
+        pinned.append(("生命徵象極值", "vitals", i))
+    keywords = [k for area in (focus_areas or []) for k in FOCUS_KEYWORDS.get(area, [])]
+    if keywords:
+        for i in reversed(range(len(data["nursing"]))):
+            if _matches_focus(data["nursing"][i], keywords):
+                pinned.append(("關注項目", "nursing", i))
+
+    pinned_counts = {}
+    pinned_dropped = 0
+    for n, (category, source, index) in enumerate(pinned):
+        if index in chosen[source]:
+            continue
+        # 到院紀錄不受比例限制
+        limit = budget if n == 0 and category == "到院紀錄" else budget * PINNED_SHARE
+        if take(source, index, limit):
+            pinned_counts[category] = pinned_counts.get(category, 0) + 1
+        else:
+            pinned_dropped += 1
+
+    # --- 2. 依時間由新到舊補滿剩餘預算 ---
+    rest = [(_time_of(source, item), source, i)
+            for source, items in data.items() for i, item in enumerate(items) if i not in chosen[source]]
+    rest.sort(reverse=True)
+    for _, source, index in rest:
+        if used >= budget:
+            break
+        take(source, index, budget)
+
+    # --- 3. 輸出 (維持原本的時間順序) 與報告 ---
+    selected = {source: [item for i, item in enumerate(data[source]) if i in chosen[source]] for source in SOURCES}
+    report = {
+        "budget": budget,
+        "tokens": used,
+        "total": {source: len(data[source]) for source in SOURCES},
+        "kept": {source: len(selected[source]) for source in SOURCES},
+        "dropped": {},
+        "dropped_range": {},
+        "pinned": pinned_counts,
+        "pinned_dropped": pinned_dropped,
+    }
+    for source in SOURCES:
+        dropped_times = [_time_of(source, item)[:12] for i, item in enumerate(data[source]) if i not in chosen[source]]
+        report["dropped"][source] = len(dropped_times)
+        if dropped_times:
+            report["dropped_range"][source] = (min(dropped_times), max(dropped_times))
+    return selected, report
+
+def format_dropped_note(report):
+    """把省略內容寫成一段說明，附在 Prompt 最後，讓模型知道資料並不完整"""
+    labels = {"nursing": "護理紀錄", "vitals": "生理徵象", "labs": "檢驗報告"}
+    parts = []
+    for source in SOURCES:
+        n = report["dropped"].get(source, 0)
+        if n:
+            first, last = report["dropped_range"][source]
+            parts.append(f"{labels[source]} {n} 筆 ({first}~{last})")
+    if not parts:
+        return ""
+    return "\n【未納入的資料】(因篇幅省略，請勿臆測其內容)\n- " + "\n- ".join(parts) + "\n"
@@ -0,0 +1,168 @@
+# /ai/hierarchical_summarizer.py
+
+# 階層式 (map-reduce) 摘要：滯留急診數天的病患，紀錄量遠超過單次 Prompt 的預算，
+# 只挑最新的紀錄會漏掉早期病程。這裡改為：
+#   1. 把全部紀錄依時間切成固定 token 上限的區段 (split_timeline)
+#   2. 各區段同時摘要 (map，summarize_chunks)；以送出內容的 SHA-256 存入摘要快取，內容沒變的區段不會重送
+#   3. 各區段摘要依時間串起來 (build_reduce_text)，再用使用者選的模板做最後一次整合 (reduce，見 ai/ai_summarizer.py)
+# 區段從最早的紀錄開始切，新紀錄只會落在最後一段，一小時後重新整理只需重做最新一段與 reduce。
+
+import asyncio
+import time
+
+from ai.context_builder import SOURCES, TIME_KEYS, LINE_FORMATTERS, normalize_time
+from ai.llm_client import get_async_llm_client
+from ai.prompt_encoding import DEFAULT_PROMPT_ENCODING, encode_patient_data
+from ai.timeline import iter_timeline
+from ai.summary_cache import get_summary_cache, make_cache_key
+from ai.token_utils import estimate_tokens
+
+# 每個區段的資料 token 上限
+DEFAULT_CHUNK_TOKENS = 3000
+# 同時在途的區段摘要請求數
+DEFAULT_CHUNK_CONCURRENCY = 4
+
+# 區段摘要固定使用這段指令 (不含模板)，換模板時區段摘要仍可沿用快取
+CHUNK_SYSTEM_PROMPT = """你是急診護理紀錄的整理助手。以下是同一位病患某一時段的護理紀錄、生理徵象與檢驗報告。
+請依時間順序，以條列方式摘要這個時段內的重要事件：
+- 主訴與症狀變化、意識狀態 (GCS) 變化
+- 生命徵象異常與趨勢 (保留數值與時間)
+- 檢驗異常值 (保留數值，危急值需標明)
+- 護理處置、給藥、管路與會診
+只根據資料撰寫，不推論診斷、不寫建議；沒有發生的事不要提。300 字以內。"""
+
+# ==========================================
+# 1. 切分區段
+# ==========================================
+def split_timeline(patient_data, chunk_tokens=DEFAULT_CHUNK_TOKENS, formatters=None, costs=None):
+    """
+    把三種紀錄合併成一條時間軸，依序裝入區段，每段估算 token 數不超過 chunk_tokens (單筆超過時自成一段)。
+
+    Args:
+        patient_data: {"nursing": [...], "vitals": [...], "labs": [...]}
+        formatters: 每種來源單筆資料的文字 (估算成本用，見 ai/prompt_encoding.FORMATTERS)
+        costs: (選用) {來源: [每筆 token 數]} (見 ai/prompt_encoding.item_costs)，給了就不用 formatters
+    Returns:
+        list of {"nursing": [...], "vitals": [...], "labs": [...]}，依時間排序
+    """
+    formatters = formatters or LINE_FORMATTERS
+    # 合併時同來源保留原本順序，成本依序取出即可對應
+    cost_iters = {source: iter(values) for source, values in costs.items()} if costs is not None else None
+    chunks = []
+    current, used = None, 0
+    # 各來源已依時間排序，k 路合併逐筆取出 (同一時間點依來源順序，同來源保留原本順序)
+    for _, source, item in iter_timeline(patient_data):
+        cost = next(cost_iters[source]) if cost_iters else estimate_tokens(formatters[source](item))
+        if current is None or (used and used + cost > chunk_tokens):
+            current, used = {source: [] for source in SOURCES}, 0
+            chunks.append(current)
+        current[source].append(item)
+        used += cost
+    return chunks
+
+def chunk_time_range(chunk):
+    """區段的 (最早, 最晚) 時間字串"""
+    times = [normalize_time(item.get(TIME_KEYS[source])) for source in SOURCES for item in chunk[source]]
+    times = [t for t in times if t]
+    return (min(times), max(times)) if times else ("", "")
+
+def _fmt_time(text):
+    """YYYYMMDDHHMM[SS] -> YYYY-MM-DD HH:MM (格式不符時原樣輸出)"""
+    if len(text) < 12 or not text[:12].isdigit():
+        return text or "-"
+    return f"{text[0:4]}-{text[4:6]}-{text[6:8]} {text[8:10]}:{text[10:12]}"
+
+# ==========================================
+# 2. map：各區段摘要
+# ==========================================
+def build_chunk_messages(patient_id, chunk, focus_areas=None, encoding=DEFAULT_PROMPT_ENCODING):
+    """
+    單一區段送給模型的 messages。內容只取決於區段本身 (不含段數、總筆數)，
+    其他區段增減時，這一段的快取 Key 不會改變。
+    """
+    system_prompt = CHUNK_SYSTEM_PROMPT
+    if focus_areas:
+        system_prompt += f"\n請特別保留以下面向的細節：{', '.join(focus_areas)}"
+    start, end = chunk_time_range(chunk)
+    counts = {source: len(chunk[source]) for source in SOURCES}
+    data_text = "".join([
+        f"=== 病患 ID: {patient_id} | {_fmt_time(start)} ~ {_fmt_time(end)} ===\n\n",
+        encode_patient_data(chunk, counts, encoding),
+    ])
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": data_text},
+    ]
+
+async def summarize_chunks(patient_id, chunks, model, temperature, focus_areas=None, encoding=DEFAULT_PROMPT_ENCODING,
+                           use_cache=True, concurrency=DEFAULT_CHUNK_CONCURRENCY, report=None, complete=None):
+    """
+    同時摘要所有區段 (最多 concurrency 個請求在途)，已有快取的區段不呼叫 API。
+    需在 coroutine 內呼叫 (預設使用目前 event loop 的非同步用戶端)。
+
+    report: (選用) dict，會填入 chunks (段數)、cached (快取命中段數)、seconds (map 耗時)
+    complete: (選用) async 函數 messages -> 摘要文字，取代直接呼叫 API (例如批次摘要要經過速率限制與重試)
+    Returns:
+        各區段摘要 (依時間排序)；任一區段失敗時回傳 None
+    """
+    t0 = time.perf_counter()
+    cache = get_summary_cache() if use_cache else None
+    if complete is None:
+        client = get_async_llm_client()
+
+        async def complete(messages):
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+            )
+            return response.choices[0].message.content
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    cached_count = 0
+
+    async def summarize_one(index, chunk):
+        nonlocal cached_count
+        messages = build_chunk_messages(patient_id, chunk, focus_areas, encoding)
+        cache_key = make_cache_key(model, messages, temperature) if cache is not None else None
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                cached_count += 1
+                return cached
+        async with semaphore:
+            summary = await complete(messages)
+        if not summary:
+            raise ValueError(f"第 {index + 1} 段模型回傳空白內容")
+        if cache is not None:
+            await asyncio.to_thread(cache.put, cache_key, model, summary)
+        return summary
+
+    try:
+        summaries = await asyncio.gather(*(summarize_one(i, chunk) for i, chunk in enumerate(chunks)))
+    except Exception as e:
+        print(f"❌ 區段摘要失敗: {e}")
+        return None
+    finally:
+        if report is not None:
+            report.update(chunks=len(chunks), cached=cached_count, seconds=round(time.perf_counter() - t0, 3))
+    print(f"🧩 區段摘要完成：{len(chunks)} 段 (快取 {cached_count} 段)，{time.perf_counter() - t0:.2f} 秒")
+    return list(summaries)
+
+# ==========================================
+# 3. reduce：組出整合用的資料區段
+# ==========================================
+def build_reduce_text(patient_id, chunks, summaries, vitals_digest=""):
+    """各區段摘要依時間串成 reduce 的 User Prompt"""
+    total = sum(len(chunk[source]) for chunk in chunks for source in SOURCES)
+    parts = [
+        f"=== 病患 ID: {patient_id} 急診病程資料 (分段摘要) ===\n\n",
+        f"(全部 {total} 筆紀錄依時間分為 {len(chunks)} 段，以下為各段重點，依時間排列)\n\n",
+        vitals_digest + "\n" if vitals_digest else "",
+    ]
+    for n, (chunk, summary) in enumerate(zip(chunks, summaries), start=1):
+        start, end = chunk_time_range(chunk)
+        parts.append(f"【第 {n} 段】{_fmt_time(start)} ~ {_fmt_time(end)} "
+                     f"(護理 {len(chunk['nursing'])} / 生理 {len(chunk['vitals'])} / 檢驗 {len(chunk['labs'])} 筆)\n")
+        parts.append(summary.strip() + "\n\n")
+    return "".join(parts)
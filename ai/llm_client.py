@@ -0,0 +1,87 @@
+# /ai/llm_client.py
+
+# 共用的 LLM 用戶端 (OpenAI 相容端點，預設 Groq)
+# 每次呼叫都 new 一個 OpenAI(...) 會重新建立 HTTP 連線池，每份摘要都要再做一次 TCP + TLS 交握。
+# 這裡改為整個行程共用一個用戶端 (執行緒安全)，連線保持 keep-alive 重複使用；
+# 非同步版本則每個 event loop 各一個 AsyncOpenAI (httpx 的非同步連線池不可跨 loop 使用)。
+
+import os
+import asyncio
+import threading
+import weakref
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# OpenAI 相容端點 (預設 Groq；測試時可指向本機假伺服器，見 benchmarks/fake_openai_server.py)
+LLM_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+
+# openai 套件依版本使用 httpx 或其後繼套件，Limits 類別直接取自套件預設值的型別
+_Limits = type(openai.DEFAULT_CONNECTION_LIMITS)
+
+def _client_options():
+    """從 .env 讀取用戶端設定 (逾時、重試、連線池大小、keep-alive)"""
+    return {
+        "api_key": os.getenv("GROQ_API_KEY"),
+        "base_url": LLM_BASE_URL,
+        "timeout": openai.Timeout(
+            float(os.getenv("LLM_TIMEOUT", "120")),
+            connect=float(os.getenv("LLM_CONNECT_TIMEOUT", "10")),
+        ),
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", "2")),
+        "limits": _Limits(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE", "60")),
+        ),
+    }
+
+def _build_client(client_cls, http_client_cls):
+    options = _client_options()
+    limits = options.pop("limits")
+    return client_cls(http_client=http_client_cls(limits=limits, timeout=options["timeout"]), **options)
+
+# 全域同步用戶端 (同一個行程內所有執行緒共用)
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """取得全域共用的 OpenAI 用戶端 (第一次呼叫時依 .env 設定建立)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client(OpenAI, openai.DefaultHttpxClient)
+    return _client
+
+# 每個 event loop 一個非同步用戶端；loop 結束被回收時自動移除
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_llm_client():
+    """
+    取得目前 event loop 專用的 AsyncOpenAI 用戶端 (需在 coroutine 內呼叫)。
+    同一個 loop 內的所有請求共用連線池，可同時有多個請求在途。
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _build_client(AsyncOpenAI, openai.DefaultAsyncHttpxClient)
+        _async_clients[loop] = client
+    return client
+
+async def aclose_llm_client():
+    """關閉目前 event loop 的非同步用戶端 (asyncio.run 結束前呼叫，避免遺留未關閉的連線)"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+def close_llm_clients():
+    """關閉全域同步用戶端 (測試或行程結束時使用)"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
@@ -0,0 +1,214 @@
+# /ai/prompt_encoding.py
+
+# 病患資料轉成 Prompt 文字的編碼方式
+#   lines   : 每筆一行，欄位都帶標籤 (T: P: BP: ... Ref:)，最直觀，也是原本的格式
+#   compact : 表格式，欄位名稱只寫一次；時間改寫成距基準時間的「+時:分」；
+#             與上一列相同的值留空；檢驗依項目分組，單位與參考範圍每個項目只寫一次
+#   timeline: 三種紀錄合併成一條時間軸 (ai/timeline.py 的 k 路合併)，日期變更時才寫一次日期，
+#             模型不必再自己比對三份清單的時間重排事件順序
+# 兩種編碼都先把片段收進 list 再一次 join，不在迴圈中反覆 += 字串。
+
+from datetime import datetime
+from functools import lru_cache
+
+from ai.context_builder import SOURCES, TIME_KEYS, LINE_FORMATTERS, flag_mark
+from ai.timeline import iter_timeline, format_event_time
+from ai.token_utils import estimate_tokens
+
+PROMPT_ENCODINGS = ("lines", "compact", "timeline")
+DEFAULT_PROMPT_ENCODING = "lines"
+
+SECTION_TITLES = {"nursing": "護理紀錄", "vitals": "生理徵象", "labs": "檢驗報告"}
+VITAL_COLUMNS = [
+    ("T", "ETEMPUTER"), ("P", "EPLUSE"), ("R", "EBREATHE"),
+    ("SBP", "EPRESSURE"), ("DBP", "EDIASTOLIC"), ("SpO2", "ESAO2"), ("GCS", "GCS"),
+]
+
+def _section_header(source, total, kept):
+    return f"【{SECTION_TITLES[source]}】(共 {total} 筆，選入 {kept} 筆)\n"
+
+# ==========================================
+# lines：每筆一行、欄位帶標籤
+# ==========================================
+def encode_lines(selected, total):
+    parts = []
+    for n, source in enumerate(SOURCES):
+        if n:
+            parts.append("\n")
+        parts.append(_section_header(source, total[source], len(selected[source])))
+        parts.extend(LINE_FORMATTERS[source](item) for item in selected[source])
+    return "".join(parts)
+
+# ==========================================
+# compact：表頭一次、相對時間、省略未變動的值
+# ==========================================
+@lru_cache(maxsize=4096)
+def _parse_time(text):
+    # 同一時間點常有多筆紀錄，結果快取起來；固定格式 YYYYMMDDHHMM[SS]，直接切字串比 strptime 快一個數量級
+    try:
+        return datetime(int(text[0:4]), int(text[4:6]), int(text[6:8]), int(text[8:10]), int(text[10:12]))
+    except ValueError:
+        return None
+
+def _offset(value, base):
+    """距基準時間的經過時間，例如 +2:05；無法解析時原樣輸出"""
+    t = _parse_time(str(value or ""))
+    if t is None or base is None:
+        return str(value or "-")
+    minutes = int((t - base).total_seconds() // 60)
+    sign = "+" if minutes >= 0 else "-"
+    hours, minutes = divmod(abs(minutes), 60)
+    return f"{sign}{hours}:{minutes:02d}"
+
+def _clean(value):
+    text = str(value).strip() if value is not None else ""
+    return "-" if text in ("", "None") else text.replace("|", "/").replace("\n", " ")
+
+def _base_time(selected):
+    times = [_parse_time(str(item.get(TIME_KEYS[source]) or "")) for source in SOURCES for item in selected[source]]
+    times = [t for t in times if t is not None]
+    return min(times) if times else None
+
+def _table_rows(items, columns, base, time_key):
+    """每列：相對時間 + 各欄位值；與上一列相同的值留空"""
+    rows = []
+    previous = None
+    for item in items:
+        values = [_clean(item.get(key)) for key in columns]
+        shown = values if previous is None else ["" if v == p else v for v, p in zip(values, previous)]
+        previous = values
+        rows.append(_offset(item.get(time_key), base) + "|" + "|".join(shown) + "\n")
+    return rows
+
+def _lab_groups(labs):
+    """檢驗依 (項目, 單位, 參考範圍) 分組，保留第一次出現的順序；值為該組各筆在 labs 中的位置"""
+    groups = {}
+    for i, item in enumerate(labs):
+        key = (_clean(item.get("CHHEAD")), item.get("CHUNIT"), item.get("REF_RANGE"))
+        groups.setdefault(key, []).append(i)
+    return groups
+
+def _lab_value(item, base):
+    return f"{_offset(item.get('CHRCPDTM'), base)} {_clean(item.get('CHVAL'))}{flag_mark(item)}"
+
+def _lab_label(name, unit, ref_range):
+    label = name
+    if unit not in (None, "", "None"):
+        label += f" {unit}"
+    if ref_range and ref_range.replace("None", "").strip("~ "):
+        label += f" [{ref_range.replace('None', '')}]"
+    return label
+
+def encode_compact(selected, total):
+    base = _base_time(selected)
+    parts = []
+    if base is not None:
+        parts.append(f"(時間=距 {base:%Y-%m-%d %H:%M} 的時:分；空白=同上一列)\n\n")
+
+    parts.append(_section_header("nursing", total["nursing"], len(selected["nursing"])))
+    if selected["nursing"]:
+        parts.append("時間|主題|內容\n")
+        parts.extend(_table_rows(selected["nursing"], ["SUBJECT", "DIAGNOSIS"], base, "PROCDTTM"))
+
+    parts.append("\n" + _section_header("vitals", total["vitals"], len(selected["vitals"])))
+    if selected["vitals"]:
+        parts.append("時間|" + "|".join(label for label, _ in VITAL_COLUMNS) + "\n")
+        parts.extend(_table_rows(selected["vitals"], [key for _, key in VITAL_COLUMNS], base, "PROCDTTM"))
+
+    parts.append("\n" + _section_header("labs", total["labs"], len(selected["labs"])))
+    if selected["labs"]:
+        parts.append("項目 單位 [參考範圍]: 時間 值, ...\n")
+        labs = selected["labs"]
+        for (name, unit, ref_range), indexes in _lab_groups(labs).items():
+            values = ", ".join(_lab_value(labs[i], base) for i in indexes)
+            parts.append(f"- {_lab_label(name, unit, ref_range)}: {values}\n")
+    return "".join(parts)
+
+def compact_item_costs(patient_data):
+    """
+    compact 編碼下每筆資料的 token 成本 {來源: [token 數]}，以 encode_compact 實際寫出的文字估算：
+    相對時間、與上一列相同而留空的值都照實計入；檢驗項目的標題 (名稱 單位 [參考範圍]) 算在該組第一筆。
+    以全部資料的排列計算，只選入部分資料時留空的值可能變少，個別列會略為低估。
+    """
+    data = {source: patient_data.get(source) or [] for source in SOURCES}
+    base = _base_time(data)
+    costs = {
+        "nursing": [estimate_tokens(row) for row in _table_rows(data["nursing"], ["SUBJECT", "DIAGNOSIS"],
+                                                                 base, "PROCDTTM")],
+        "vitals": [estimate_tokens(row) for row in _table_rows(data["vitals"], [key for _, key in VITAL_COLUMNS],
+                                                                base, "PROCDTTM")],
+        "labs": [0] * len(data["labs"]),
+    }
+    for key, indexes in _lab_groups(data["labs"]).items():
+        for n, i in enumerate(indexes):
+            text = _lab_value(data["labs"][i], base) + ", "
+            if n == 0:
+                text = f"- {_lab_label(*key)}: " + text
+            costs["labs"][i] = estimate_tokens(text)
+    return costs
+
+# ==========================================
+# timeline：合併成單一時間軸
+# ==========================================
+SOURCE_TAGS = {"nursing": "護", "vitals": "生", "labs": "驗"}
+SAME_SUBJECT = "〃"
+
+def _timeline_body(source, item, subject=None):
+    if source == "nursing":
+        return f"{subject or _clean(item.get('SUBJECT'))} | {_clean(item.get('DIAGNOSIS'))}"
+    if source == "vitals":
+        return " ".join(f"{label}:{_clean(item.get(key))}" for label, key in VITAL_COLUMNS)
+    return (f"{_clean(item.get('CHHEAD'))}: {_clean(item.get('CHVAL'))} {_clean(item.get('CHUNIT'))} "
+            f"(Ref: {item.get('REF_RANGE')}){flag_mark(item)}")
+
+def encode_timeline(selected, total):
+    counts = "、".join(f"{SECTION_TITLES[source]} 共 {total[source]} 筆，選入 {len(selected[source])} 筆"
+                      for source in SOURCES)
+    tags = "、".join(f"{tag}={SECTION_TITLES[source]}" for source, tag in SOURCE_TAGS.items())
+    parts = [
+        f"【時間軸】({counts})\n",
+        f"(已依時間排序；{tags}；{SAME_SUBJECT}=主題同上一筆護理紀錄)\n",
+    ]
+    current_date = None
+    last_subject = None
+    # 逐筆取出合併後的事件直接寫入，不先組出排序好的 list
+    for time, source, item in iter_timeline(selected):
+        date, clock = format_event_time(time)
+        if date != current_date:
+            current_date = date
+            parts.append(f"[{date or '時間不明'}]\n")
+        subject = None
+        if source == "nursing":
+            subject = _clean(item.get("SUBJECT"))
+            subject, last_subject = (SAME_SUBJECT if subject == last_subject else subject), subject
+        parts.append(f"{clock} {SOURCE_TAGS[source]} {_timeline_body(source, item, subject)}\n")
+    return "".join(parts)
+
+# timeline 編碼下單筆資料的估算文字 (未計入主題省略與日期列，估算偏保守)
+TIMELINE_FORMATTERS = {
+    source: (lambda item, source=source: f"00:00 {SOURCE_TAGS[source]} {_timeline_body(source, item)}\n")
+    for source in SOURCES
+}
+
+ENCODERS = {"lines": encode_lines, "compact": encode_compact, "timeline": encode_timeline}
+# 單筆轉文字即可估算成本的編碼；compact 的成本與前後列有關，改由 compact_item_costs 計算
+FORMATTERS = {"lines": LINE_FORMATTERS, "timeline": TIMELINE_FORMATTERS}
+
+def item_costs(patient_data, encoding=DEFAULT_PROMPT_ENCODING):
+    """build_context 用的每筆 token 成本 {來源: [token 數]}，依實際使用的編碼估算"""
+    if encoding == "compact":
+        return compact_item_costs(patient_data)
+    formatters = FORMATTERS.get(encoding, LINE_FORMATTERS)
+    return {source: [estimate_tokens(formatters[source](item)) for item in patient_data.get(source) or []]
+            for source in SOURCES}
+
+def encode_patient_data(selected, total, encoding=DEFAULT_PROMPT_ENCODING):
+    """
+    把 build_context 選出的資料轉成 Prompt 的資料區段文字。
+
+    Args:
+        selected: {"nursing": [...], "vitals": [...], "labs": [...]}
+        total: 各來源原始筆數 (顯示「共 N 筆」)
+        encoding: PROMPT_ENCODINGS 之一；不認得的值退回 lines
+    """
+    return ENCODERS.get(encoding, encode_lines)(selected, total)
@@ -0,0 +1,66 @@
+# /ai/rate_limiter.py
+
+# 非同步 token bucket 速率限制 (對應 LLM 供應商的 RPM / TPM 上限)
+# 每次請求先向兩個水桶各取用：請求數 1、預估 token 數；不足時等待水桶回補，而不是打出去再吃 429。
+
+import time
+import asyncio
+
+class TokenBucket:
+    """
+    容量為 capacity、每秒回補 rate 的水桶 (asyncio 版本，同一個 event loop 內共用)。
+    一次要求超過容量時，等到水桶全滿就放行 (避免單一大請求永遠等不到)。
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        """取用 amount；回傳實際等待的秒數"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        # 持鎖等待，讓請求依到達順序放行 (先到先服務，大請求不會被小請求一直插隊)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._level >= amount:
+                    self._level -= amount
+                    return waited
+                delay = (amount - self._level) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def adjust(self, delta):
+        """請求完成後依實際用量修正 (delta > 0 表示多用了，< 0 表示退回)"""
+        self._refill()
+        self._level = min(self.capacity, self._level - delta)
+
+class RateLimiter:
+    """
+    同時限制每分鐘請求數 (rpm) 與每分鐘 token 數 (tpm)；任一設為 None / 0 代表不限制。
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.waited = 0.0
+
+    async def acquire(self, tokens):
+        if self.requests is not None:
+            self.waited += await self.requests.acquire(1)
+        if self.tokens is not None:
+            self.waited += await self.tokens.acquire(tokens)
+
+    def record_usage(self, estimated, actual):
+        """以 API 回報的實際 token 數修正預估值"""
+        if self.tokens is not None and actual is not None:
+            self.tokens.adjust(actual - estimated)
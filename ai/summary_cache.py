@@ -0,0 +1,281 @@
+# /ai/summary_cache.py
+
+# 摘要結果快取 (SQLite)
+# 以「實際送給模型的內容」做 SHA-256 當作 Key：模型、溫度、System Prompt (含模板 / 風格 / 關注項目)、
+# User Prompt (病患資料) 完全相同時，直接回傳上次的摘要，不再呼叫 API。
+# 資料一有新增，User Prompt 就不同，自然會重新生成，不需要另外判斷過期。
+#
+# - 存在單一 SQLite 檔 (WAL 模式)，多個 Streamlit / 批次行程可同時讀寫
+# - 超過 TTL 的項目視為不存在；總大小超過上限時，依最後使用時間 (LRU) 淘汰
+# - 命中 / 未命中 / 淘汰次數存在同一個檔案中，跨行程累計
+# - 讀取只用一般 SELECT (WAL 下讀者互不阻擋)；最後使用時間與命中次數先記在記憶體，
+#   批次寫回 (寫入摘要時一併寫入，或累積一段時間後另開短交易，遇到其他行程正在寫入就下次再寫)
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+DEFAULT_CACHE_PATH = os.path.join(parent_dir, 'data', 'cache', 'summaries.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    summary     TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_summaries_last_access ON summaries (last_access);
+CREATE TABLE IF NOT EXISTS metrics (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+METRIC_NAMES = ("hits", "misses", "stores", "evictions", "expired")
+
+# 讀取統計 (最後使用時間 / 命中次數) 累積這麼多秒或這麼多筆才寫回一次
+ACCESS_FLUSH_SECONDS = 5.0
+ACCESS_FLUSH_ENTRIES = 64
+# 寫回讀取統計時最多等其他寫入者多久 (毫秒)；等不到就留到下次
+ACCESS_FLUSH_BUSY_MS = 50
+
+def make_cache_key(model, messages, temperature):
+    """
+    依送給模型的內容產生快取 Key。
+    messages 先正規化 (去除每行行尾空白、統一換行)，避免只差排版就快取不到。
+    """
+    normalized = [
+        {"role": m["role"], "content": "\n".join(line.rstrip() for line in m["content"].strip().splitlines())}
+        for m in messages
+    ]
+    payload = json.dumps({"model": model, "temperature": temperature, "messages": normalized},
+                         ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SummaryCache:
+    """
+    以 SQLite 為後端的摘要快取，可在多個行程間共用。
+
+    Args:
+        path: SQLite 檔案路徑
+        ttl: 項目有效秒數 (None 或 0 表示不過期)
+        max_bytes: 摘要內容總大小上限 (位元組)，超過時淘汰最久沒用到的項目
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=7 * 24 * 3600, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        # 尚未寫回的讀取統計：{key: (最後使用時間, 命中次數)}、{統計名稱: 次數}
+        self._pending_lock = threading.Lock()
+        self._pending_access = {}
+        self._pending_metrics = {}
+        self._last_flush = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """每個執行緒各自一條連線 (sqlite3 連線不可跨執行緒共用)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _connect(self, mode="IMMEDIATE"):
+        return _Transaction(self._conn(), mode)
+
+    def _bump(self, conn, name, n=1):
+        conn.execute("INSERT INTO metrics (name, value) VALUES (?, ?) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def get(self, key):
+        """回傳快取的摘要；沒有、已過期或快取檔無法讀取時回傳 None"""
+        try:
+            return self._get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️ 讀取摘要快取失敗: {e}")
+            return None
+
+    def _get(self, key):
+        now = time.time()
+        # autocommit 的單一 SELECT：不取得寫入鎖，多個行程可同時查詢
+        row = self._conn().execute("SELECT summary, created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+        # 過期項目不在讀取時刪除，由下次寫入時的 _evict 清掉 (並計入 expired)
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            self._record("misses")
+            return None
+        self._record("hits", key, now)
+        return row[0]
+
+    def _record(self, metric, key=None, now=None):
+        """記下一次查詢結果；累積夠多或夠久時嘗試寫回"""
+        with self._pending_lock:
+            self._pending_metrics[metric] = self._pending_metrics.get(metric, 0) + 1
+            if key is not None:
+                _, hits = self._pending_access.get(key, (now, 0))
+                self._pending_access[key] = (now, hits + 1)
+            due = (len(self._pending_access) >= ACCESS_FLUSH_ENTRIES
+                   or time.monotonic() - self._last_flush >= ACCESS_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def _take_pending(self):
+        with self._pending_lock:
+            access, metrics = self._pending_access, self._pending_metrics
+            self._pending_access, self._pending_metrics = {}, {}
+            self._last_flush = time.monotonic()
+        return access, metrics
+
+    def _restore_pending(self, access, metrics):
+        """寫回失敗時放回去，下次再寫 (期間又有新的查詢時合併)"""
+        with self._pending_lock:
+            for key, (last_access, hits) in access.items():
+                newer, more = self._pending_access.get(key, (last_access, 0))
+                self._pending_access[key] = (max(last_access, newer), hits + more)
+            for name, n in metrics.items():
+                self._pending_metrics[name] = self._pending_metrics.get(name, 0) + n
+
+    def _apply_pending(self, conn, access, metrics):
+        conn.executemany("UPDATE summaries SET last_access = MAX(last_access, ?), hits = hits + ? WHERE key = ?",
+                         [(last_access, hits, key) for key, (last_access, hits) in access.items()])
+        for name, n in metrics.items():
+            self._bump(conn, name, n)
+
+    def flush(self):
+        """
+        把累積的讀取統計寫回 (best-effort)：只等其他寫入者 ACCESS_FLUSH_BUSY_MS 毫秒，
+        資料庫忙碌或寫入失敗時保留到下次，不影響查詢本身。
+        """
+        access, metrics = self._take_pending()
+        if not access and not metrics:
+            return
+        conn = self._conn()
+        try:
+            conn.execute(f"PRAGMA busy_timeout = {ACCESS_FLUSH_BUSY_MS}")
+            with self._connect() as tx:
+                self._apply_pending(tx, access, metrics)
+        except sqlite3.Error:
+            self._restore_pending(access, metrics)
+        finally:
+            conn.execute("PRAGMA busy_timeout = 30000")
+
+    def put(self, key, model, summary):
+        """寫入一筆摘要，並在超過大小上限時依 LRU 淘汰 (寫入失敗只印出警告)"""
+        try:
+            self._put(key, model, summary)
+        except sqlite3.Error as e:
+            print(f"⚠️ 寫入摘要快取失敗: {e}")
+
+    def _put(self, key, model, summary):
+        now = time.time()
+        size = len(summary.encode("utf-8"))
+        # 已經要取得寫入鎖，順便寫回累積的讀取統計 (LRU 淘汰前先更新最後使用時間)
+        access, metrics = self._take_pending()
+        try:
+            with self._connect() as conn:
+                self._apply_pending(conn, access, metrics)
+                conn.execute("""
+                    INSERT INTO summaries (key, model, summary, size, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        model = excluded.model, summary = excluded.summary, size = excluded.size,
+                        created_at = excluded.created_at, last_access = excluded.last_access
+                """, (key, model, summary, size, now, now))
+                self._bump(conn, "stores")
+                self._evict(conn, now)
+        except sqlite3.Error:
+            self._restore_pending(access, metrics)
+            raise
+
+    def _evict(self, conn, now):
+        if self.ttl:
+            removed = conn.execute("DELETE FROM summaries WHERE created_at < ?", (now - self.ttl,)).rowcount
+            if removed:
+                self._bump(conn, "expired", removed)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 從最久沒用到的開始刪，直到總大小回到上限以內
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM summaries ORDER BY last_access ASC"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM summaries WHERE key = ?", victims)
+        self._bump(conn, "evictions", len(victims))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM summaries")
+        with self._pending_lock:
+            self._pending_access.clear()
+
+    def stats(self):
+        """回傳命中統計與目前快取大小 (先嘗試寫回本行程累積的讀取統計)"""
+        self.flush()
+        with self._connect("DEFERRED") as conn:
+            metrics = dict(conn.execute("SELECT name, value FROM metrics").fetchall())
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+        result = {name: metrics.get(name, 0) for name in METRIC_NAMES}
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+        result["entries"] = entries
+        result["bytes"] = total
+        return result
+
+class _Transaction:
+    """with 區塊包成一個交易 (預設 IMMEDIATE：一開始就取得寫入鎖；只讀時用 DEFERRED)"""
+
+    def __init__(self, conn, mode="IMMEDIATE"):
+        self.conn = conn
+        self.mode = mode
+
+    def __enter__(self):
+        self.conn.execute(f"BEGIN {self.mode}")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+# 全域快取 (同一個行程內共用)
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_summary_cache():
+    """取得全域摘要快取；SUMMARY_CACHE_ENABLED=0 時回傳 None"""
+    global _cache
+    if os.getenv("SUMMARY_CACHE_ENABLED", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SummaryCache(
+                    path=os.getenv("SUMMARY_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    ttl=float(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600))),
+                    max_bytes=int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+                )
+                # 行程結束前寫回尚未寫入的讀取統計
+                atexit.register(_cache.flush)
+    return _cache
+
+def get_summary_cache_stats():
+    """回傳全域摘要快取統計 (停用時回傳 None)"""
+    cache = get_summary_cache()
+    return cache.stats() if cache is not None else None
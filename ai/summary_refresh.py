@@ -0,0 +1,205 @@
+# /ai/summary_refresh.py
+
+# 增量更新摘要
+# 同一位病患一班內常重新生成好幾次交班摘要，每次都重撈、重送整段病史。這裡把摘要連同它涵蓋到的
+# 資料時間 (各來源的高水位) 保存起來 (db/summary_service.py)，下次更新時：
+#   - 只撈不早於高水位、且不在上一版涵蓋範圍內的紀錄 (db/patient_service.get_patient_history_since，
+#     病歷號 + 時間索引的範圍掃描；水位時間上已涵蓋的紀錄以指紋記下，同一分鐘晚到的紀錄不會漏掉)
+#   - 沒有新紀錄：直接回傳上一版，不呼叫模型
+#   - 有新紀錄：上一版摘要 + 新紀錄一起送給模型修訂
+# 資料庫讀取量與輸入 token 都只與新增的內容成正比。
+#
+# 限制：水位以紀錄時間為準，補登 (時間早於水位) 的紀錄要到下次完整生成才會納入；
+# 增量更新累積 MAX_REFRESHES 次後自動改為完整重新生成，也避免多次修訂後內容漂移。
+
+import os
+import json
+import time
+import hashlib
+
+from db.patient_service import (LATEST_ENCOUNTER, get_patient_full_history, get_patient_history_since,
+                                list_patient_encounters, row_fingerprint)
+from db.summary_service import HWM_SOURCES, get_saved_summary, save_summary
+from ai.ai_summarizer import (MODEL_NAME, CONTEXT_TOKEN_BUDGET, PROMPT_ENCODING, resolve_system_prompt,
+                              stream_messages, stream_nursing_summary)
+from ai.context_builder import TIME_KEYS, build_context, format_dropped_note
+from ai.prompt_encoding import encode_patient_data, item_costs
+
+# 連續增量更新幾次後改為完整重新生成
+MAX_REFRESHES = int(os.getenv("SUMMARY_MAX_REFRESHES", "6"))
+
+REFRESH_INSTRUCTION = """
+
+**【增量更新】**
+使用者訊息包含「上一版摘要」與其後新增的紀錄。請依新紀錄修訂上一版摘要，輸出完整的新版摘要 (格式要求同上)：
+保留仍然成立的內容，更新病況、數值與處置；已緩解或被新資料取代的內容直接改寫，不要只附加在文末。"""
+
+def make_summary_key(system_prompt, start_time=None, lab_mode="all", encounter_id=None):
+    """保存摘要的 Key：System Prompt、資料起始時間、檢驗模式、就診或模型不同，就是不同的摘要"""
+    payload = {"model": MODEL_NAME, "system": system_prompt, "start_time": start_time or "", "lab_mode": lab_mode}
+    if encounter_id:
+        # 不指定就診時不放入，原本保存的摘要 Key 不變
+        payload["encounter"] = encounter_id
+    payload = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def high_water_mark(patient_data, previous=None):
+    """各來源最晚的紀錄時間；該來源沒有資料時沿用 previous 的值"""
+    previous = previous or {}
+    mark = {}
+    for source in HWM_SOURCES:
+        times = [item.get(TIME_KEYS[source]) for item in patient_data.get(source) or []]
+        times = [t for t in times if t]
+        mark[source] = max(times + ([previous[source]] if previous.get(source) else []), default=None)
+    return mark
+
+def covered_at_mark(patient_data, mark, previous=None, previous_seen=None):
+    """
+    各來源在水位時間上已涵蓋的紀錄指紋 (下次增量撈取時扣除)；
+    水位沒有前進時，連同上一版在同一時間已涵蓋的一起保留。
+    """
+    previous = previous or {}
+    previous_seen = previous_seen or {}
+    seen = {}
+    for source in HWM_SOURCES:
+        if not mark.get(source):
+            continue
+        fingerprints = [row_fingerprint(item) for item in patient_data.get(source) or []
+                        if item.get(TIME_KEYS[source]) == mark[source]]
+        if previous.get(source) == mark[source]:
+            fingerprints = list(previous_seen.get(source) or []) + fingerprints
+        seen[source] = fingerprints
+    return seen
+
+def build_refresh_messages(patient_id, system_prompt, saved, delta, focus_areas=None, encoding=None, report=None):
+    """上一版摘要 + 新增紀錄 (依 CONTEXT_TOKEN_BUDGET 挑選) 的修訂 messages"""
+    encoding = encoding or PROMPT_ENCODING
+    selected, context_report = build_context(delta, CONTEXT_TOKEN_BUDGET, focus_areas,
+                                             costs=item_costs(delta, encoding))
+    if report is not None:
+        report.update(context_report)
+    covered = "、".join(f"{source} {saved['high_water'][source]}" for source in HWM_SOURCES
+                       if saved["high_water"].get(source))
+    data_text = "".join([
+        f"=== 病患 ID: {patient_id} 急診病程資料 (增量更新) ===\n\n",
+        f"【上一版摘要】(資料涵蓋至 {covered or '-'})\n",
+        saved["summary"].strip() + "\n\n",
+        "【新增紀錄】\n",
+        encode_patient_data(selected, context_report['total'], encoding),
+        format_dropped_note(context_report),
+    ])
+    return [
+        {"role": "system", "content": system_prompt + REFRESH_INSTRUCTION},
+        {"role": "user", "content": data_text}
+    ]
+
+def resolve_encounter(patient_id, encounter_id):
+    """LATEST_ENCOUNTER 換成實際的急診號 (摘要要綁定在某次就診上，下次就診不能沿用)；查不到時回傳 None"""
+    if encounter_id != LATEST_ENCOUNTER:
+        return encounter_id
+    encounters = list_patient_encounters(patient_id)
+    return encounters[0]["急診號"] if encounters else None
+
+def prepare_refresh(patient_id, template_name, custom_system_prompt=None, focus_areas=None, start_time=None,
+                    end_time=None, lab_mode="all", encoding=None, force_full=False, report=None, encounter_id=None):
+    """
+    決定這次要怎麼更新，並撈好需要的資料。
+    encounter_id: 只看某次就診 (急診號；LATEST_ENCOUNTER 為最近一次)，None 為所有就診
+
+    Returns:
+        dict，kind 為下列之一；資料庫查詢失敗時回傳 None
+        - "unchanged"：沒有新紀錄，summary 為上一版
+        - "refresh"：messages 為修訂用的 messages，delta 為新紀錄
+        - "full"：沒有可沿用的摘要 (或已達增量上限 / force_full)，patient_data 為完整資料
+        另有 key、high_water (本次完成後的水位)、seen (水位時間上已涵蓋的紀錄)、refresh_count (本次完成後的增量次數)
+    report: (選用) dict，會填入 refresh (kind)、new_rows (各來源新紀錄筆數) 與資料挑選報告
+    """
+    system_prompt = resolve_system_prompt(template_name, custom_system_prompt, focus_areas)
+    if encounter_id is not None:
+        encounter_id = resolve_encounter(patient_id, encounter_id)
+        if encounter_id is None:
+            return None
+    key = make_summary_key(system_prompt, start_time, lab_mode, encounter_id)
+    saved = None if force_full else get_saved_summary(patient_id, key)
+
+    if saved is not None and saved["refresh_count"] < MAX_REFRESHES:
+        delta = get_patient_history_since(patient_id, saved["high_water"], start_time, end_time, lab_mode,
+                                          encounter_id=encounter_id, seen=saved["seen"])
+        if delta is None:
+            return None
+        new_rows = {source: len(rows) for source, rows in delta.items()}
+        if report is not None:
+            report.update(new_rows=new_rows)
+        high_water = high_water_mark(delta, saved["high_water"])
+        plan = {"key": key, "high_water": high_water,
+                "seen": covered_at_mark(delta, high_water, saved["high_water"], saved["seen"])}
+        if not any(new_rows.values()):
+            if report is not None:
+                report["refresh"] = "unchanged"
+            return dict(plan, kind="unchanged", summary=saved["summary"], refresh_count=saved["refresh_count"])
+        if report is not None:
+            report["refresh"] = "refresh"
+        messages = build_refresh_messages(patient_id, system_prompt, saved, delta, focus_areas, encoding, report)
+        return dict(plan, kind="refresh", messages=messages, delta=delta, refresh_count=saved["refresh_count"] + 1)
+
+    patient_data = get_patient_full_history(patient_id, start_time, end_time, lab_mode=lab_mode,
+                                            encounter_id=encounter_id)
+    if patient_data is None:
+        return None
+    if report is not None:
+        report.update(refresh="full", new_rows={source: len(rows) for source, rows in patient_data.items()})
+    high_water = high_water_mark(patient_data)
+    return {"kind": "full", "key": key, "patient_data": patient_data, "high_water": high_water,
+            "seen": covered_at_mark(patient_data, high_water), "refresh_count": 0}
+
+def stream_refreshed_summary(patient_id, template_name, custom_system_prompt=None, focus_areas=None,
+                             start_time=None, end_time=None, lab_mode="all", use_cache=True, timings=None,
+                             encoding=None, mode=None, force_full=False, encounter_id=None):
+    """
+    增量更新摘要並保存 (串流)：有上一版時只送新紀錄請模型修訂，沒有時完整生成 (mode 同 stream_nursing_summary)；
+    沒有新紀錄時直接回傳上一版。失敗時 yield 錯誤訊息且不保存。encounter_id 同 prepare_refresh。
+    timings 的欄位同 stream_nursing_summary，其中 context 另有 refresh (unchanged / refresh / full) 與 new_rows。
+    """
+    timings = timings if timings is not None else {}
+    timings.update(cached=False, ttft=None, total=None, chunks=0, context={}, failed=False)
+    t0 = time.perf_counter()
+    plan = prepare_refresh(patient_id, template_name, custom_system_prompt, focus_areas, start_time, end_time,
+                           lab_mode, encoding, force_full, timings["context"], encounter_id)
+    if plan is None:
+        timings["failed"] = True
+        yield "錯誤：無法讀取病患資料。"
+        return
+    if plan["kind"] == "unchanged":
+        timings.update(cached=True, ttft=time.perf_counter() - t0, total=time.perf_counter() - t0, chunks=1)
+        yield plan["summary"]
+        return
+
+    parts = []
+    if plan["kind"] == "refresh":
+        pieces = stream_messages(plan["messages"], use_cache, timings, t0)
+    else:
+        context = timings["context"]
+        pieces = stream_nursing_summary(patient_id, plan["patient_data"], template_name, custom_system_prompt,
+                                        focus_areas, use_cache=use_cache, timings=timings, encoding=encoding,
+                                        mode=mode)
+    for piece in pieces:
+        parts.append(piece)
+        yield piece
+    if plan["kind"] == "full":
+        # stream_nursing_summary 會重設 context，補回更新方式
+        timings["context"].update(refresh=context["refresh"], new_rows=context["new_rows"])
+
+    if not timings["failed"]:
+        save_summary(patient_id, plan["key"], template_name, "".join(parts), plan["high_water"],
+                     plan["refresh_count"], plan["seen"])
+
+def refresh_nursing_summary(patient_id, template_name, custom_system_prompt=None, focus_areas=None,
+                            start_time=None, end_time=None, lab_mode="all", use_cache=True, encoding=None,
+                            mode=None, force_full=False, timings=None, encounter_id=None):
+    """
+    增量更新摘要並保存：有上一版時只送新紀錄請模型修訂，沒有時完整生成 (mode 同 generate_nursing_summary)。
+    回傳摘要文字；失敗時回傳錯誤訊息 (不保存)。timings 同 stream_refreshed_summary。
+    """
+    return "".join(stream_refreshed_summary(patient_id, template_name, custom_system_prompt, focus_areas,
+                                            start_time, end_time, lab_mode, use_cache, timings, encoding, mode,
+                                            force_full, encounter_id))
@@ -0,0 +1,40 @@
+# /ai/timeline.py
+
+# 統一時間軸
+# 護理紀錄、生理徵象、檢驗報告從資料庫取出時各自已依時間排序 (ORDER BY 時間)，但時間格式不同
+# (PROCDTTM 14 碼、CHRCPDTM 12 碼)。這裡把時間正規化成 14 碼，以 heap 做 k 路合併 (heapq.merge)：
+#   - 逐筆產生單一的時間序事件流，O(n log k) (k = 來源數)，不建立中間 list、不重新排序整批資料
+#   - 同一時間點依 SOURCES 的順序 (護理 -> 生理 -> 檢驗)，同來源維持原本順序
+#   - 沒有時間的紀錄排在最後 (與 PostgreSQL ORDER BY ... ASC 的 NULLS LAST 一致)
+# 使用者：Prompt 的 timeline 編碼 (ai/prompt_encoding.py)、分段摘要的切段 (ai/hierarchical_summarizer.py)。
+
+import heapq
+
+from ai.context_builder import SOURCES, TIME_KEYS, normalize_time
+
+def _events(source, items):
+    time_key = TIME_KEYS[source]
+    for item in items:
+        yield normalize_time(item.get(time_key)), source, item
+
+def _merge_key(event):
+    return (not event[0], event[0])
+
+def iter_timeline(patient_data, sources=SOURCES):
+    """
+    把各來源合併成一條時間軸 (generator，邊合併邊產生)。
+
+    Args:
+        patient_data: {"nursing": [...], "vitals": [...], "labs": [...]}，各來源須已依時間排序
+            (get_patient_full_history 的結果即是；list 以外的 iterable 也可以，會逐筆讀取)
+        sources: 要合併的來源 (順序即同一時間點的先後)
+    Yields:
+        (time, source, item)；time 為 14 碼時間字串，沒有時間時為空字串
+    """
+    return heapq.merge(*(_events(source, patient_data.get(source) or ()) for source in sources), key=_merge_key)
+
+def format_event_time(time):
+    """14 碼時間 -> (日期 YYYY-MM-DD, 時分 HH:MM)；格式不符時回傳 ("", 原字串)"""
+    if len(time) < 12 or not time[:12].isdigit():
+        return "", time or "-"
+    return f"{time[0:4]}-{time[4:6]}-{time[6:8]}", f"{time[8:10]}:{time[10:12]}"
@@ -0,0 +1,33 @@
+# /ai/token_utils.py
+
+# 離線 token 估算 (不需要下載 tokenizer，也不呼叫 API)
+# Llama 3 系列 tokenizer 對英數約 4 個字元一個 token，中日韓文字大多 1 個字一個 token 以上；
+# 這裡以保守 (略為高估) 的方式估算，用於速率限制與 Prompt 預算，不求精確到個位數。
+
+import re
+
+_CJK = re.compile(r'[⺀-鿿가-힯豈-﫿＀-￯]')
+_WORD = re.compile(r'[A-Za-z]+|\d+|[^\sA-Za-z\d]')
+
+# 每則訊息 (role、分隔符號) 的固定開銷
+MESSAGE_OVERHEAD = 4
+
+def estimate_tokens(text):
+    """估算一段文字的 token 數"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    tokens = cjk
+    # 其餘部分：英文單字約 4 字元一個 token，數字約 3 位一個 token，標點符號各算一個
+    for piece in _WORD.findall(_CJK.sub(' ', text)):
+        if piece[0].isalpha():
+            tokens += (len(piece) + 3) // 4
+        elif piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        else:
+            tokens += 1
+    return tokens
+
+def estimate_message_tokens(messages):
+    """估算 chat messages 的輸入 token 數"""
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
@@ -0,0 +1,281 @@
+# /ai/vitals_trend.py
+
+# 生命徵象趨勢摘要 (NumPy 向量化)
+# 原始生理監測可能有上千筆，只送最新幾筆時模型看不到早期變化；這裡把整段監測濃縮成：
+#   - 每個參數的首末值、範圍、極值發生時間、每小時斜率 (最小平方法)
+#   - 保留形狀的降採樣序列 (每個時間窗取最小 / 最大 / 最後一點，或 LTTB)
+#   - GCS 各分項 (E/V/M) 的變化時間點
+# 再組成一段精簡文字 (build_vitals_digest) 交給摘要模型。
+
+import re
+
+import numpy as np
+
+# (顯示名稱, 欄位, 小數位數)
+TREND_PARAMS = [
+    ("T", "ETEMPUTER", 1),
+    ("P", "EPLUSE", 0),
+    ("R", "EBREATHE", 0),
+    ("SBP", "EPRESSURE", 0),
+    ("DBP", "EDIASTOLIC", 0),
+    ("SpO2", "ESAO2", 0),
+]
+DOWNSAMPLE_METHODS = ("minmax", "lttb")
+DEFAULT_TREND_POINTS = 12
+
+_GCS = re.compile(r'E\s*:?\s*(\d)\s*V\s*:?\s*(\d|T)\s*M\s*:?\s*(\d)', re.IGNORECASE)
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+# ==========================================
+# 1. 轉成陣列
+# ==========================================
+def _parse_times(values):
+    """
+    YYYYMMDDHHMM[SS] 字串 -> (datetime64[m] 陣列, 有效遮罩) (整批以字元碼運算，不逐筆解析)。
+    缺值、含非數字或日期時間超出範圍的列遮罩為 False (其時間值無意義，需由呼叫端剔除)。
+    """
+    # 缺值保持空字串 (全為 \0，不會被當成 0000 年)，其餘補到 12 碼
+    text = np.array([str(v).strip().ljust(12, "0")[:12] if v else "" for v in values], dtype="U12")
+    digits = text.view(np.uint32).reshape(-1, 12).astype(np.int64) - ord("0")
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    digits = np.where(valid[:, None], digits, 0)
+    year = digits[:, 0:4] @ np.array([1000, 100, 10, 1])
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+    valid &= (year >= 1900) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour < 24) & (minute < 60)
+    months = ((year - 1970) * 12 + (month - 1)).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+    # 該月沒有這一天 (例如 0230、0431) 時日期會進位到下個月，換算回月份比對即可剔除
+    valid &= dates.astype("datetime64[M]") == months
+    return dates.astype("datetime64[m]") + (hour * 60 + minute).astype("timedelta64[m]"), valid
+
+def _to_float(value):
+    match = _NUMBER.search(str(value)) if value is not None else None
+    return float(match.group()) if match else np.nan
+
+_MISSING = frozenset(("", "None", "(null)"))
+
+def _parse_column(values):
+    """數值字串 -> float 陣列，缺值為 NaN；整欄都是合法數字時一次轉換"""
+    raw = ["nan" if v is None or v in _MISSING else v for v in values]
+    try:
+        return np.array(raw, dtype=float)
+    except ValueError:
+        return np.array([_to_float(v) for v in values], dtype=float)
+
+def _parse_gcs(text):
+    match = _GCS.search(str(text or ""))
+    if not match:
+        return (-1, -1, -1)
+    e, v, m = match.groups()
+    # 插管 (VT) 以 1 分計
+    return (int(e), 1 if v.upper() == "T" else int(v), int(m))
+
+# 趨勢計算用到的欄位
+VITAL_FIELDS = ("PROCDTTM",) + tuple(key for _, key, _ in TREND_PARAMS) + ("GCS",)
+# 每累積這麼多筆就轉成陣列，原始字串不會整段留在記憶體
+COLLECT_BLOCK = 4096
+
+def _column_blocks(vitals, block=COLLECT_BLOCK):
+    """逐筆讀取 (vitals 可為 generator)，每 block 筆產出一次 {欄位: 值 list}；至少產出一次 (可能是空的)"""
+    columns = {key: [] for key in VITAL_FIELDS}
+    appends = [(key, columns[key].append) for key in VITAL_FIELDS]
+    n = 0
+    emitted = False
+    for item in vitals:
+        for key, append in appends:
+            append(item.get(key))
+        n += 1
+        if n == block:
+            yield columns
+            emitted = True
+            for values in columns.values():
+                values.clear()
+            n = 0
+    if n or not emitted:
+        yield columns
+
+def _block_arrays(columns):
+    """一段原始值 -> (times, values, gcs)；時間無法解析的列直接剔除"""
+    times, valid = _parse_times(columns["PROCDTTM"])
+    values = {name: _parse_column(columns[key])[valid] for name, key, _ in TREND_PARAMS}
+    # GCS 字串重複度很高，只解析不重複的值
+    gcs_text, inverse = np.unique(np.array(columns["GCS"], dtype=str), return_inverse=True)
+    gcs_table = np.array([_parse_gcs(text) for text in gcs_text], dtype=int).reshape(-1, 3)
+    return times[valid], values, gcs_table[inverse.reshape(-1)][valid]
+
+def vitals_to_arrays(vitals):
+    """
+    把 vitals (list of dict，或 db/patient_service.stream_patient_history 的 generator) 轉成陣列。
+    逐段 (COLLECT_BLOCK 筆) 轉換後串接，串流讀取時記憶體只有數值陣列與一段原始值。
+
+    Returns:
+        (times, values, gcs)
+        times: datetime64[m]，依時間排序
+        values: {參數名稱: float 陣列 (缺值 NaN)}
+        gcs: (n, 3) int 陣列，E/V/M；無法解析為 -1
+        時間缺值或無法解析的紀錄不列入 (無法排進時間序列)；全部無法解析時為空陣列
+    """
+    blocks = [_block_arrays(columns) for columns in _column_blocks(vitals)]
+    times = np.concatenate([b[0] for b in blocks])
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    values = {name: np.concatenate([b[1][name] for b in blocks])[order] for name, _, _ in TREND_PARAMS}
+    gcs = np.concatenate([b[2] for b in blocks])[order]
+    return times, values, gcs
+
+# ==========================================
+# 2. 降採樣 (回傳要保留的索引，遞增排序)
+# ==========================================
+def downsample_minmax(t, y, n_points):
+    """
+    依時間切成等寬窗格，每格保留最小、最大與最後一點 (峰值與近況不會被平均掉)。
+    t: 分鐘數 (float 陣列，遞增)；y: 數值 (可含 NaN)
+    """
+    valid = np.flatnonzero(~np.isnan(y))
+    if valid.size <= n_points:
+        return valid
+    tv, yv = t[valid], y[valid]
+    windows = max(1, n_points // 3)
+    span = tv[-1] - tv[0]
+    group = np.minimum(((tv - tv[0]) / span * windows).astype(int), windows - 1) if span > 0 \
+        else np.zeros(tv.size, dtype=int)
+    # 依 (窗格, 數值) 排序後，每個窗格的第一個就是最小值；對 -y 排序則是最大值
+    by_min = np.lexsort((yv, group))
+    by_max = np.lexsort((-yv, group))
+    starts = np.r_[0, np.flatnonzero(np.diff(group[by_min])) + 1]
+    last = np.r_[np.flatnonzero(np.diff(group)), group.size - 1]
+    keep = np.concatenate([by_min[starts], by_max[starts], last])
+    return valid[np.unique(keep)]
+
+def downsample_lttb(t, y, n_points):
+    """Largest-Triangle-Three-Buckets：保留視覺形狀的降採樣 (首尾兩點必留)"""
+    valid = np.flatnonzero(~np.isnan(y))
+    if valid.size <= n_points or n_points < 3:
+        return valid
+    tv, yv = t[valid], y[valid]
+    # 首尾之間的點分成 n_points - 2 個桶，每桶挑一點
+    edges = np.linspace(1, tv.size - 1, n_points - 1).astype(int)
+    keep = [0]
+    for b in range(n_points - 2):
+        start, end = edges[b], max(edges[b + 1], edges[b] + 1)
+        # 下一個桶的平均點 (最後一桶的下一個是終點)
+        if b + 2 < len(edges):
+            nxt = slice(end, max(edges[b + 2], end + 1))
+        else:
+            nxt = slice(tv.size - 1, tv.size)
+        nxt_t, nxt_y = tv[nxt].mean(), yv[nxt].mean()
+        a = keep[-1]
+        # 與前一個選中點、下一桶平均點構成的三角形面積最大者
+        area = np.abs((tv[a] - nxt_t) * (yv[start:end] - yv[a]) - (tv[a] - tv[start:end]) * (nxt_y - yv[a]))
+        keep.append(start + int(np.argmax(area)))
+    keep.append(tv.size - 1)
+    return valid[np.unique(keep)]
+
+DOWNSAMPLERS = {"minmax": downsample_minmax, "lttb": downsample_lttb}
+
+# ==========================================
+# 3. 趨勢統計
+# ==========================================
+def trend_stats(t, y):
+    """
+    單一參數的趨勢統計；有效值不足時回傳 None。
+    t: 分鐘數；回傳的索引對應原陣列。
+    """
+    valid = np.flatnonzero(~np.isnan(y))
+    if valid.size == 0:
+        return None
+    tv, yv = t[valid], y[valid]
+    slope = None
+    if valid.size >= 2 and tv[-1] > tv[0]:
+        tc = tv - tv.mean()
+        slope = float((tc * (yv - yv.mean())).sum() / (tc * tc).sum() * 60)   # 每小時
+    i_min, i_max = int(np.argmin(yv)), int(np.argmax(yv))
+    return {
+        "n": int(valid.size),
+        "first": float(yv[0]), "last": float(yv[-1]),
+        "min": float(yv[i_min]), "min_index": int(valid[i_min]),
+        "max": float(yv[i_max]), "max_index": int(valid[i_max]),
+        "range": float(yv[i_max] - yv[i_min]),
+        "slope_per_hour": slope,
+    }
+
+def gcs_changes(gcs):
+    """GCS 任一分項與前一次不同的位置 (忽略無法解析的紀錄)；回傳 [(索引, (E,V,M) 前, 後)]"""
+    valid = np.flatnonzero(gcs[:, 0] >= 0)
+    if valid.size < 2:
+        return []
+    g = gcs[valid]
+    changed = np.flatnonzero((g[1:] != g[:-1]).any(axis=1)) + 1
+    return [(int(valid[i]), tuple(int(x) for x in g[i - 1]), tuple(int(x) for x in g[i])) for i in changed]
+
+def analyze_vitals(vitals, n_points=DEFAULT_TREND_POINTS, method="minmax"):
+    """
+    計算整段生理監測的趨勢。
+
+    Returns:
+        {"times": datetime64[m] 陣列, "values": {名稱: float 陣列},
+         "params": {名稱: 統計 (見 trend_stats) + "points": 降採樣索引},
+         "gcs": (n, 3) 陣列, "gcs_changes": [...]}；無資料或時間全部無法解析時回傳 None
+    """
+    if not vitals:
+        return None
+    parsed = vitals_to_arrays(vitals)
+    if not parsed[0].size:
+        return None
+    times, values, gcs = parsed
+    t = (times - times[0]).astype(float)
+    downsample = DOWNSAMPLERS.get(method, downsample_minmax)
+    params = {}
+    for name, _, _ in TREND_PARAMS:
+        stats = trend_stats(t, values[name])
+        if stats is not None:
+            stats["points"] = downsample(t, values[name], n_points)
+            params[name] = stats
+    return {"times": times, "values": values, "params": params, "gcs": gcs, "gcs_changes": gcs_changes(gcs)}
+
+# ==========================================
+# 4. 精簡文字摘要
+# ==========================================
+def _fmt_time(value):
+    return str(value.astype("datetime64[m]"))[5:16].replace("T", " ")
+
+def _fmt(value, digits):
+    return f"{value:.{digits}f}"
+
+def _fmt_gcs(g):
+    return f"E{g[0]}V{g[1]}M{g[2]}"
+
+def build_vitals_digest(vitals, n_points=DEFAULT_TREND_POINTS, method="minmax"):
+    """
+    整段生理監測的趨勢摘要文字 (放在 Prompt 中，補足被預算省略的早期紀錄)；無資料時回傳空字串。
+    """
+    trend = analyze_vitals(vitals, n_points, method)
+    if not trend or not trend["params"]:
+        return ""
+    times = trend["times"]
+    hours = (times[-1] - times[0]).astype(float) / 60
+    lines = [f"【生命徵象趨勢】(全部 {len(times)} 筆，{_fmt_time(times[0])} ~ {_fmt_time(times[-1])}，"
+             f"{hours:.1f} 小時；斜率為每小時變化)\n"]
+    for name, _, digits in TREND_PARAMS:
+        stats = trend["params"].get(name)
+        if stats is None:
+            continue
+        slope = "" if stats["slope_per_hour"] is None else f"，斜率 {stats['slope_per_hour']:+.{digits + 1}f}"
+        series = " ".join(f"{_fmt(trend['values'][name][i], digits)}@{_fmt_time(times[i])[6:]}"
+                          for i in stats["points"])
+        lines.append(
+            f"- {name}: {_fmt(stats['first'], digits)}→{_fmt(stats['last'], digits)}"
+            f"，最高 {_fmt(stats['max'], digits)} ({_fmt_time(times[stats['max_index']])})"
+            f"，最低 {_fmt(stats['min'], digits)} ({_fmt_time(times[stats['min_index']])}){slope}"
+            f"\n  {series}\n"
+        )
+    gcs = trend["gcs"]
+    valid = np.flatnonzero(gcs[:, 0] >= 0)
+    if valid.size:
+        steps = [_fmt_gcs(gcs[valid[0]])] + [f"{_fmt_gcs(after)} ({_fmt_time(times[i])})"
+                                             for i, _, after in trend["gcs_changes"]]
+        lines.append(f"- GCS: {' → '.join(steps)}\n")
+    return "".join(lines)
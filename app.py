@@ -8,13 +8,18 @@ from dotenv import load_dotenv
 from datetime import datetime, time
 
 # 引入後端模組
-from db.patient_service import get_patient_full_history, get_all_patients_overview
-from db.template_service import get_all_templates, create_template, update_template
-from ai.ai_summarizer import generate_nursing_summary
+from db.patient_service import (get_patient_full_history, get_patients_overview_page, list_patient_encounters,
+                                OVERVIEW_PAGE_SIZE)
+from db.template_service import get_all_templates, create_template, update_template, start_template_listener
+from ai.ai_summarizer import stream_nursing_summary
+from ai.summary_refresh import stream_refreshed_summary
 
 # --- 設定網頁 ---
 st.set_page_config(page_title="AI 醫療模板系統", layout="wide", page_icon="")
 
+# 監聽模板異動通知，讓多個 app 行程的模板快取保持一致 (重複呼叫不會重複啟動)
+start_template_listener()
+
 # ==========================================
 # 輔助函數
 # ==========================================
@@ -23,16 +28,36 @@ def format_time_str(raw_time):
     s = str(raw_time)
     return f"{s[:4]}-{s[4:6]}-{s[6:8]} {s[8:10]}:{s[10:12]}"
 
+def to_db_time(d, end_of_day=False):
+    if not d: return None
+    return f"{d.year}{d.month:02d}{d.day:02d}" + ("235959" if end_of_day else "000000")
+
 @st.cache_data(ttl=60)
-def load_patient_list():
-    raw_list = get_all_patients_overview()
+def load_patient_page(after, patient_prefix, start_time, end_time):
+    page = get_patients_overview_page(OVERVIEW_PAGE_SIZE, after=after, patient_prefix=patient_prefix,
+                                      start_time=start_time, end_time=end_time)
+    if page is None:
+        return [], None
+    raw_list = page["patients"]
     for p in raw_list:
         p['最早紀錄_顯示'] = format_time_str(p['最早紀錄'])
         p['最晚紀錄_顯示'] = format_time_str(p['最晚紀錄'])
-        p['label'] = f"{p['病歷號']} (共 {p['資料筆數']} 筆資料)"
-    return raw_list
+        p['label'] = f"{p['病歷號']} ({p['最早紀錄_顯示']}，共 {p['資料筆數']} 筆資料)"
+    return raw_list, page["next_cursor"]
+
+@st.cache_data(ttl=60)
+def load_patient_encounters(patient_id):
+    encounters = list_patient_encounters(patient_id) or []
+    for e in encounters:
+        e['label'] = f"{e['急診號']} ({format_time_str(e['最早紀錄'])} ~ {format_time_str(e['最晚紀錄'])}，共 {e['資料筆數']} 筆資料)"
+    return encounters
+
+# 分頁游標堆疊：第 N 頁的起點 = page_cursors[N]，第一頁為 None
+if "page_cursors" not in st.session_state:
+    st.session_state.page_cursors = [None]
 
-patients_list = load_patient_list()
+def reset_patient_pages():
+    st.session_state.page_cursors = [None]
 
 # ==========================================
 # 側邊欄：全域導航
@@ -50,6 +75,26 @@ if app_mode == " 摘要生成器":
     
     # 1. 選擇病患
     st.subheader("1. 選擇病患")
+    s1, s2, s3 = st.columns([2, 1, 1])
+    search_prefix = s1.text_input("搜尋病歷號 (前綴)：", on_change=reset_patient_pages).strip()
+    date_from = s2.date_input("就診起日", value=None, on_change=reset_patient_pages)
+    date_to = s3.date_input("就診迄日", value=None, on_change=reset_patient_pages)
+
+    page_no = len(st.session_state.page_cursors) - 1
+    patients_list, next_cursor = load_patient_page(
+        st.session_state.page_cursors[-1], search_prefix or None,
+        to_db_time(date_from), to_db_time(date_to, end_of_day=True)
+    )
+
+    n1, n2, n3 = st.columns([1, 2, 1])
+    if n1.button("⬅ 上一頁", disabled=page_no == 0, use_container_width=True):
+        st.session_state.page_cursors.pop()
+        st.rerun()
+    n2.caption(f"第 {page_no + 1} 頁，本頁 {len(patients_list)} 位病患")
+    if n3.button("下一頁 ➡", disabled=next_cursor is None, use_container_width=True):
+        st.session_state.page_cursors.append(next_cursor)
+        st.rerun()
+
     options = ["請選擇..."] + [p['label'] for p in patients_list]
     selected_label = st.selectbox("病患清單：", options, index=0)
     
@@ -60,6 +105,17 @@ if app_mode == " 摘要生成器":
         target_patient_id = selected_info['病歷號']
         st.success(f"已選定：{target_patient_id}")
 
+    # 預設只看最近一次就診；常回診的病患不會把歷次急診混在同一份摘要裡
+    target_encounter_id = None
+    if target_patient_id:
+        encounters = load_patient_encounters(target_patient_id)
+        if encounters:
+            encounter_options = [e['急診號'] for e in encounters] + [None]
+            encounter_labels = {e['急診號']: e['label'] for e in encounters}
+            encounter_labels[None] = f"全部就診 (共 {len(encounters)} 次)"
+            target_encounter_id = st.selectbox("就診：", encounter_options, index=0,
+                                               format_func=encounter_labels.get)
+
     # 2. 選擇模板
     st.subheader("2. 選擇摘要模板")
     db_templates = get_all_templates() 
@@ -111,41 +167,96 @@ if app_mode == " 摘要生成器":
 
     # 6. 執行按鈕
     if target_patient_id:
+        force_regenerate = st.checkbox("強制重新生成 (不使用快取結果)", value=False)
+        encoding_labels = {
+            None: "預設",
+            "compact": "精簡表格 (減少約一半 token，長住院病患可納入更多紀錄)",
+            "timeline": "單一時間軸 (三種紀錄依時間合併，適合時間軸敘述)",
+        }
+        prompt_encoding = st.selectbox("資料格式", list(encoding_labels), format_func=encoding_labels.get)
+        incremental = st.checkbox("增量更新 (沿用上次的摘要，只送之後新增的紀錄)", value=True)
+        hierarchical = st.checkbox("分段摘要 (全部紀錄依時間分段摘要後再整合，適合滯留較久的病患)", value=False)
+        lab_mode_labels = {
+            "all": "全部",
+            "abnormal": "只送異常值 (H / L / 危急值 / 定性陽性)",
+            "latest": "每項最新一筆",
+            "first_latest": "每項第一筆與最新一筆",
+            "changed": "只送數值有變化的項目",
+        }
+        lab_mode = st.selectbox("檢驗資料範圍", list(lab_mode_labels), format_func=lab_mode_labels.get)
         if st.button(" 開始生成摘要", type="primary", use_container_width=True):
             load_dotenv()
             if not os.getenv("GROQ_API_KEY"):
                 st.error("未設定 API Key")
                 st.stop()
                 
-            with st.spinner("正在分析資料並撰寫摘要..."):
-                # 撈資料
-                p_data = get_patient_full_history(target_patient_id, start_time=start_dt_str)
+            # 增量更新時由 stream_refreshed_summary 自行撈取 (只撈上次摘要之後的新紀錄)
+            if not incremental:
+                with st.spinner("正在撈取病患資料..."):
+                    # 撈資料
+                    p_data = get_patient_full_history(target_patient_id, start_time=start_dt_str,
+                                                      lab_mode=lab_mode, encounter_id=target_encounter_id)
                 
-                # 準備 Prompt 附加指令
-                style_instruction = ""
-                if style_option == "短文式 (Narrative)":
-                    style_instruction = "\n\n**【格式要求】**：請整合為一篇流暢的短文，禁止使用列點。"
-                else:
-                    style_instruction = "\n\n**【格式要求】**：請務必使用列點方式呈現，保持條理。"
-                
-                # 從資料庫取出原始模板內容
-                base_prompt = db_templates[selected_template_name]
-                
-                # 組合最終 Prompt
-                final_system_prompt = base_prompt + style_instruction
-
-                # 呼叫 AI
-                summary = generate_nursing_summary(
-                    target_patient_id, 
-                    p_data, 
-                    selected_template_name,
-                    custom_system_prompt=final_system_prompt,
-                    focus_areas=selected_focus_areas
-                )
-                
-                st.markdown("###  生成結果")
-                st.markdown("---")
-                st.markdown(summary)
+            # 準備 Prompt 附加指令
+            style_instruction = ""
+            if style_option == "短文式 (Narrative)":
+                style_instruction = "\n\n**【格式要求】**：請整合為一篇流暢的短文，禁止使用列點。"
+            else:
+                style_instruction = "\n\n**【格式要求】**：請務必使用列點方式呈現，保持條理。"
+            
+            # 從資料庫取出原始模板內容
+            base_prompt = db_templates[selected_template_name]
+            
+            # 組合最終 Prompt
+            final_system_prompt = base_prompt + style_instruction
+
+            st.markdown("###  生成結果")
+            st.markdown("---")
+            summary_area = st.empty()
+            summary_area.caption("正在撰寫摘要...")
+
+            # 呼叫 AI (串流：模型每產生一段就更新畫面，不必等整份完成)
+            timings = {}
+            summary = ""
+            options = dict(
+                custom_system_prompt=final_system_prompt,
+                focus_areas=selected_focus_areas,
+                use_cache=not force_regenerate,
+                timings=timings,
+                encoding=prompt_encoding,
+                mode="hierarchical" if hierarchical else None,
+            )
+            if incremental:
+                # 強制重新生成時不沿用上一版，完整生成後作為新的基準
+                pieces = stream_refreshed_summary(target_patient_id, selected_template_name,
+                                                  start_time=start_dt_str, lab_mode=lab_mode,
+                                                  encounter_id=target_encounter_id,
+                                                  force_full=force_regenerate, **options)
+            else:
+                pieces = stream_nursing_summary(target_patient_id, p_data, selected_template_name, **options)
+            for piece in pieces:
+                summary += piece
+                summary_area.markdown(summary + "▌")
+            summary_area.markdown(summary)
+
+            context = timings.get("context")
+            if context and context.get("refresh") == "unchanged":
+                st.caption("上次摘要後沒有新增紀錄，沿用上一版摘要")
+            elif context and context.get("refresh") == "refresh":
+                new_rows = context["new_rows"]
+                st.caption(f"增量更新：新增護理 {new_rows['nursing']}、生理 {new_rows['vitals']}、"
+                           f"檢驗 {new_rows['labs']} 筆，已併入上一版摘要")
+            if context and context.get("chunks"):
+                st.caption(f"分段摘要：共 {context['chunks']} 段 (沿用快取 {context['chunks_cached']} 段)，"
+                           f"分段耗時 {context['map_seconds']:.2f} 秒")
+            if context and any(context.get("dropped", {}).values()):
+                kept, total = context["kept"], context["total"]
+                st.caption(f"資料篇幅有限：護理 {kept['nursing']}/{total['nursing']}、生理 {kept['vitals']}/{total['vitals']}、"
+                           f"檢驗 {kept['labs']}/{total['labs']} 筆納入摘要 (已優先保留到院紀錄、異常檢驗與生命徵象極值)")
+            if timings.get("cached"):
+                st.caption("♻️ 使用快取結果")
+            elif timings.get("ttft") is not None:
+                st.caption(f"首字 {timings['ttft']:.2f} 秒 | 完成 {timings['total']:.2f} 秒")
 
 # ==============================================================================
 # 模式 B：模板設計師 (管理後台)
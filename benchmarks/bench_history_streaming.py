@@ -0,0 +1,78 @@
+# /benchmarks/bench_history_streaming.py
+#
+# 比較一次載入 (get_patient_full_history) 與伺服器端游標串流 (stream_patient_history) 的記憶體高峰與耗時。
+# 兩種方式都接著計算生命徵象趨勢 (ai/vitals_trend.py) 並走過整條合併時間軸 (ai/timeline.py)，
+# 記憶體以 tracemalloc 量測 Python 端配置的高峰 (不含資料庫驅動 C 層的緩衝)。
+#
+# 用法：
+#   python benchmarks/bench_history_streaming.py [病歷號] [itersize]
+
+import sys
+import os
+import time
+import tracemalloc
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from db.patient_service import HISTORY_ITERSIZE, get_patient_full_history, stream_patient_history
+from ai.timeline import iter_timeline
+from ai.vitals_trend import build_vitals_digest
+
+def load_all(patient_id, itersize):
+    data = get_patient_full_history(patient_id)
+    if data is None:
+        return None
+    digest = build_vitals_digest(data["vitals"])
+    events = sum(1 for _ in iter_timeline(data))
+    return events, digest
+
+def load_streaming(patient_id, itersize):
+    with stream_patient_history(patient_id, itersize=itersize) as streams:
+        if not streams:
+            return None
+        digest = build_vitals_digest(streams["vitals"])
+    # 串流只能讀一次，時間軸另開一次
+    with stream_patient_history(patient_id, itersize=itersize) as streams:
+        events = sum(1 for _ in iter_timeline(streams))
+    return events, digest
+
+def measure(fn, patient_id, itersize):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn(patient_id, itersize)
+    seconds = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def main():
+    patient_id = sys.argv[1] if len(sys.argv) > 1 else '0002452972'
+    itersize = int(sys.argv[2]) if len(sys.argv) > 2 else HISTORY_ITERSIZE
+
+    # 先暖機一次，讓連線池建立連線，避免連線交握算進結果
+    get_patient_full_history(patient_id)
+
+    results = {}
+    for label, fn in (("一次載入", load_all), ("串流", load_streaming)):
+        result, seconds, peak = measure(fn, patient_id, itersize)
+        if result is None:
+            print(f"❌ {label} 查詢失敗，請檢查資料庫連線。")
+            return
+        results[label] = (result, seconds, peak)
+
+    print("\n" + "=" * 60)
+    print(f"病歷號 {patient_id} | itersize {itersize}")
+    print("-" * 60)
+    print(f"{'方式':<8} | {'事件數':>8} | {'耗時(ms)':>10} | {'記憶體高峰(KB)':>14}")
+    for label, ((events, _), seconds, peak) in results.items():
+        print(f"{label:<8} | {events:>8} | {seconds * 1000:>10.1f} | {peak / 1024:>14.1f}")
+    print("-" * 60)
+    same = results["一次載入"][0][1] == results["串流"][0][1]
+    print(f"趨勢摘要一致: {'是' if same else '否'}")
+    print("=" * 60)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# /benchmarks/bench_llm_client.py
+#
+# 量測 LLM 用戶端本身的每次呼叫開銷：
+#   1. 舊版：每次呼叫都 new 一個 OpenAI(...) (每次重建 HTTP 連線池、重新建立 TCP 連線)
+#   2. 共用：ai.llm_client.get_llm_client() (keep-alive 重複使用連線)
+#   3. 非同步：agenerate_nursing_summary，同一個 event loop 上多份摘要同時在途
+# 以本機假 OpenAI 伺服器 (fake_openai_server.py) 回應，不耗用 API 額度；本機沒有 TLS，
+# 實際連到 Groq 時每次新連線還要多付 TLS 交握與跨網路往返，差距會比這裡更大。
+#
+# 用法：
+#   python benchmarks/bench_llm_client.py [循序呼叫次數] [非同步份數] [模擬模型延遲秒數]
+
+import sys
+import os
+import time
+import asyncio
+import statistics
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from fake_openai_server import start_fake_server, DEFAULT_REPLY
+
+MESSAGES = [{"role": "system", "content": "測試"}, {"role": "user", "content": "病患資料"}]
+SAMPLE_DATA = {"nursing": [{"PROCDTTM": "20251115152700", "SUBJECT": "胸悶", "DIAGNOSIS": "給予氧氣"}],
+               "vitals": [], "labs": []}
+
+def bench_sequential(make_client, n):
+    """循序呼叫 n 次，回傳每次耗時 (毫秒)"""
+    from ai.ai_summarizer import MODEL_NAME
+    timings = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        client = make_client()
+        reply = client.chat.completions.create(model=MODEL_NAME, messages=MESSAGES).choices[0].message.content
+        timings.append((time.perf_counter() - t0) * 1000)
+        if reply != DEFAULT_REPLY:
+            raise RuntimeError("回覆內容不符")
+    return timings
+
+async def bench_async(n):
+    from ai.ai_summarizer import agenerate_nursing_summary
+    from ai.llm_client import aclose_llm_client
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[
+        agenerate_nursing_summary(f"P{i}", SAMPLE_DATA, "", custom_system_prompt="測試", use_cache=False)
+        for i in range(n)
+    ])
+    elapsed = time.perf_counter() - t0
+    await aclose_llm_client()
+    if any(r != DEFAULT_REPLY for r in results):
+        raise RuntimeError("非同步回覆內容不符")
+    return elapsed
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_async = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    model_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    server, base_url = start_fake_server()
+    # 端點在匯入時決定，需先設定環境變數再匯入
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    from openai import OpenAI
+    from ai.llm_client import get_llm_client, LLM_BASE_URL
+
+    def legacy_client():
+        return OpenAI(api_key=os.getenv("GROQ_API_KEY"), base_url=LLM_BASE_URL)
+
+    # 暖機 (匯入、第一次建立連線)
+    bench_sequential(get_llm_client, 3)
+
+    results = {}
+    for name, factory in (("每次新建", legacy_client), ("共用用戶端", get_llm_client)):
+        before = server.stats["connections"]
+        timings = bench_sequential(factory, n)
+        results[name] = (timings, server.stats["connections"] - before)
+
+    # 非同步：模擬模型延遲，看多份摘要同時在途時的總耗時
+    server.first_token_delay = model_delay
+    before = server.stats["connections"]
+    async_elapsed = asyncio.run(bench_async(n_async))
+    async_connections = server.stats["connections"] - before
+    server.shutdown()
+
+    print("\n" + "=" * 64)
+    print(f"循序呼叫 {n} 次 (假伺服器無延遲，純量測用戶端開銷)")
+    print("-" * 64)
+    print(f"{'方式':<10} | {'中位數(ms)':>10} | {'平均(ms)':>10} | {'新建 TCP 連線數':>14}")
+    for name, (timings, connections) in results.items():
+        print(f"{name:<8} | {statistics.median(timings):>10.2f} | {statistics.mean(timings):>10.2f} | {connections:>14}")
+    legacy = statistics.median(results["每次新建"][0])
+    shared = statistics.median(results["共用用戶端"][0])
+    print(f"每次呼叫省下 {legacy - shared:.2f} ms ({legacy / shared:.1f}x)")
+    print("-" * 64)
+    print(f"非同步 {n_async} 份摘要同時在途 (每份模型延遲 {model_delay}s)：總耗時 {async_elapsed:.2f} 秒，"
+          f"新建連線 {async_connections} 條 (循序約需 {n_async * model_delay:.1f} 秒)")
+    print("=" * 64)
+
+if __name__ == '__main__':
+    main()
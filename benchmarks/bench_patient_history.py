@@ -0,0 +1,86 @@
+# /benchmarks/bench_patient_history.py
+#
+# 比較 get_patient_full_history 各種撈取模式的延遲，各檢驗模式 (LAB_MODES) 傳回的筆數與延遲，
+# 以及只撈最近一次就診與撈所有就診的差異。
+# 請先在 .env 指向本機 (或遠端) PostgreSQL，並已用 data/data_processor.py 匯入資料。
+#
+# 用法：
+#   python benchmarks/bench_patient_history.py [病歷號] [重複次數]
+
+import sys
+import os
+import time
+import statistics
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from db.patient_service import get_patient_full_history, FETCH_MODES, LAB_MODES, LATEST_ENCOUNTER
+from db.db_connector import get_pool_stats
+
+def bench_mode(patient_id, mode, repeat, lab_mode="all", encounter_id=None):
+    """回傳每次呼叫的耗時 (毫秒) 與最後一次的筆數統計"""
+    timings = []
+    counts = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        data = get_patient_full_history(patient_id, fetch_mode=mode, lab_mode=lab_mode, encounter_id=encounter_id)
+        timings.append((time.perf_counter() - t0) * 1000)
+        if data is None:
+            return None, None
+        counts = {k: len(v) for k, v in data.items()}
+    return timings, counts
+
+def main():
+    patient_id = sys.argv[1] if len(sys.argv) > 1 else '0002452972'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    # 先暖機一次，讓連線池建立連線，避免第一次的連線交握算進結果
+    get_patient_full_history(patient_id)
+
+    results = {}
+    for mode in FETCH_MODES:
+        timings, counts = bench_mode(patient_id, mode, repeat)
+        if timings is None:
+            print(f"❌ 模式 {mode} 查詢失敗，請檢查資料庫連線。")
+            return
+        results[mode] = (timings, counts)
+
+    lab_results = {}
+    for lab_mode in LAB_MODES:
+        timings, counts = bench_mode(patient_id, "single", repeat, lab_mode)
+        if timings is None:
+            print(f"❌ 檢驗模式 {lab_mode} 查詢失敗，請檢查資料庫連線。")
+            return
+        lab_results[lab_mode] = (timings, counts)
+
+    encounter_results = {}
+    for label, encounter_id in (("全部就診", None), ("最近一次", LATEST_ENCOUNTER)):
+        timings, counts = bench_mode(patient_id, "single", repeat, encounter_id=encounter_id)
+        if timings is None:
+            print(f"❌ 就診範圍 {label} 查詢失敗，請檢查資料庫連線。")
+            return
+        encounter_results[label] = (timings, counts)
+
+    print("\n" + "=" * 60)
+    print(f"病歷號 {patient_id} | 每種模式 {repeat} 次")
+    print("-" * 60)
+    print(f"{'模式':<12} | {'中位數(ms)':>10} | {'平均(ms)':>10} | {'最慢(ms)':>10} | 筆數")
+    for mode, (timings, counts) in results.items():
+        print(f"{mode:<12} | {statistics.median(timings):>10.2f} | {statistics.mean(timings):>10.2f} | "
+              f"{max(timings):>10.2f} | {counts}")
+    print("-" * 60)
+    print(f"{'檢驗模式':<12} | {'中位數(ms)':>10} | {'檢驗筆數':>8}")
+    for lab_mode, (timings, counts) in lab_results.items():
+        print(f"{lab_mode:<12} | {statistics.median(timings):>10.2f} | {counts['labs']:>8}")
+    print("-" * 60)
+    print(f"{'就診範圍':<12} | {'中位數(ms)':>10} | 筆數")
+    for label, (timings, counts) in encounter_results.items():
+        print(f"{label:<12} | {statistics.median(timings):>10.2f} | {counts}")
+    print("=" * 60)
+    print(f"連線池狀態: {get_pool_stats()}")
+
+if __name__ == '__main__':
+    main()
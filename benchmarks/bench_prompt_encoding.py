@@ -0,0 +1,95 @@
+# /benchmarks/bench_prompt_encoding.py
+#
+# 比較各種病患資料編碼 (ai/prompt_encoding.py) 的 Prompt 大小與組字串耗時：
+#   1. 全部資料 (不限預算) 編碼後的字元數與估算 token 數
+#   2. 固定預算下各編碼能放進幾筆資料
+# token 數以 ai/token_utils.estimate_tokens 離線估算，不呼叫 API。
+#
+# 用法：
+#   python benchmarks/bench_prompt_encoding.py [病歷號 ...]
+#   (未指定時取病患總覽第一頁的前 5 位)
+
+import sys
+import os
+import io
+import time
+import contextlib
+import statistics
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from db.patient_service import get_patient_full_history, get_all_patients_overview
+from ai.context_builder import LINE_FORMATTERS, SOURCES
+from ai.prompt_encoding import PROMPT_ENCODINGS, encode_patient_data
+from ai.ai_summarizer import build_summary_messages
+from ai.token_utils import estimate_tokens
+
+UNLIMITED = 10 ** 9
+BUDGET = 3000
+REPEAT = 50
+
+def legacy_concat(data):
+    """改版前以 += 逐行串接的寫法 (只用來比較耗時)"""
+    text = ""
+    for source in SOURCES:
+        text += f"【{source}】\n"
+        for item in data[source]:
+            text += LINE_FORMATTERS[source](item)
+    return text
+
+def timed_ms(fn, *args):
+    timings = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
+
+def main():
+    patient_ids = sys.argv[1:]
+    if not patient_ids:
+        patients = get_all_patients_overview() or []
+        patient_ids = [p["病歷號"] for p in patients[:5]]
+    if not patient_ids:
+        print("❌ 找不到病患資料，請檢查資料庫連線。")
+        return
+
+    print("\n" + "=" * 78)
+    print(f"{'病歷號':<12} | {'編碼':<8} | {'筆數':>5} | {'字元數':>7} | {'估算tokens':>10} | "
+          f"{'節省':>6} | {'組字串(ms)':>10} | {f'{BUDGET}預算內筆數':>12}")
+    print("-" * 78)
+    totals = {encoding: 0 for encoding in PROMPT_ENCODINGS}
+    for patient_id in patient_ids:
+        data = get_patient_full_history(patient_id)
+        if not data:
+            print(f"❌ {patient_id} 無資料")
+            continue
+        rows = sum(len(data[source]) for source in SOURCES)
+        counts = {source: len(data[source]) for source in SOURCES}
+        baseline = None
+        for encoding in PROMPT_ENCODINGS:
+            text = encode_patient_data(data, counts, encoding)
+            tokens = estimate_tokens(text)
+            totals[encoding] += tokens
+            baseline = baseline or tokens
+            build_ms = timed_ms(encode_patient_data, data, counts, encoding)
+
+            report = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_summary_messages(patient_id, data, "", custom_system_prompt="x",
+                                       context_budget=BUDGET, report=report, encoding=encoding)
+            fitted = sum(report["kept"].values())
+            print(f"{patient_id:<12} | {encoding:<8} | {rows:>5} | {len(text):>7} | {tokens:>10} | "
+                  f"{1 - tokens / baseline:>6.0%} | {build_ms:>10.3f} | {fitted:>12}")
+        print(f"{patient_id:<12} | {'+= 串接':<8} | {rows:>5} | {'':>7} | {'':>10} | {'':>6} | "
+              f"{timed_ms(legacy_concat, data):>10.3f} |")
+    print("=" * 78)
+    baseline = totals[PROMPT_ENCODINGS[0]]
+    for encoding, tokens in totals.items():
+        print(f"合計 {encoding:<8}: {tokens} tokens ({1 - tokens / baseline:.0%} 節省)")
+
+if __name__ == '__main__':
+    main()
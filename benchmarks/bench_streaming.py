@@ -0,0 +1,68 @@
+# /benchmarks/bench_streaming.py
+#
+# 比較「一次回傳」與「串流」兩種摘要生成方式，使用者要等多久才看到第一個字。
+# 以本機假 OpenAI 伺服器 (fake_openai_server.py) 模擬模型延遲，不連資料庫、不耗用 API 額度。
+#
+# 用法：
+#   python benchmarks/bench_streaming.py [首字延遲秒數] [每段延遲秒數] [重複次數]
+
+import sys
+import os
+import time
+import statistics
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from fake_openai_server import start_fake_server, DEFAULT_REPLY
+
+SAMPLE_DATA = {
+    "nursing": [{"PROCDTTM": "20251115152700", "SUBJECT": "胸悶", "DIAGNOSIS": "病患主訴胸悶，給予氧氣 2L/min"}],
+    "vitals": [{"PROCDTTM": "20251115153000", "ETEMPUTER": "36.8", "EPLUSE": "88", "EBREATHE": "18",
+                "EPRESSURE": "128", "EDIASTOLIC": "76", "ESAO2": "98", "GCS": "E4V5M6"}],
+    "labs": [{"CHRCPDTM": "202511151540", "CHHEAD": "Troponin-I", "CHVAL": "0.02", "CHUNIT": "ng/mL",
+              "REF_RANGE": "0~0.04"}],
+}
+
+def main():
+    first_token_delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    token_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    server, base_url = start_fake_server(first_token_delay=first_token_delay, token_delay=token_delay)
+    # 端點在匯入時決定，需先設定環境變數再匯入
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    from ai.ai_summarizer import generate_nursing_summary, stream_nursing_summary
+
+    blocking, ttfts, totals = [], [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        text = generate_nursing_summary("TEST", SAMPLE_DATA, "", custom_system_prompt="測試", use_cache=False)
+        blocking.append(time.perf_counter() - t0)
+        if text != DEFAULT_REPLY:
+            print(f"❌ 一次回傳的內容不符: {text[:50]}")
+            return
+
+        timings = {}
+        streamed = "".join(stream_nursing_summary("TEST", SAMPLE_DATA, "", custom_system_prompt="測試",
+                                                  use_cache=False, timings=timings))
+        if streamed != DEFAULT_REPLY:
+            print(f"❌ 串流組合後的內容不符: {streamed[:50]}")
+            return
+        ttfts.append(timings["ttft"])
+        totals.append(timings["total"])
+    server.shutdown()
+
+    print("\n" + "=" * 60)
+    print(f"首字延遲 {first_token_delay}s | 每段 {token_delay}s | 共 {timings['chunks']} 段 | 重複 {repeat} 次")
+    print("-" * 60)
+    print(f"{'方式':<10} | {'看到第一個字(ms)':>16} | {'全部完成(ms)':>14}")
+    print(f"{'一次回傳':<8} | {statistics.median(blocking) * 1000:>16.1f} | {statistics.median(blocking) * 1000:>14.1f}")
+    print(f"{'串流':<10} | {statistics.median(ttfts) * 1000:>16.1f} | {statistics.median(totals) * 1000:>14.1f}")
+    print("=" * 60)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# /benchmarks/bench_vitals_trend.py
+#
+# 量測生命徵象趨勢摘要 (ai/vitals_trend.py) 在大量監測資料上的耗時，並比較摘要與逐筆列出的 token 數。
+# 以合成的連續監測資料 (約每 10 秒一筆，含一段低血壓、後段心搏過速與 GCS 下降) 測試，不連資料庫。
+#
+# 用法：
+#   python benchmarks/bench_vitals_trend.py [筆數] [降採樣點數]
+
+import sys
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from ai.vitals_trend import DOWNSAMPLE_METHODS, build_vitals_digest
+from ai.context_builder import format_vitals_line
+from ai.token_utils import estimate_tokens
+
+REPEAT = 20
+
+def make_vitals(n, seed=0):
+    rnd = random.Random(seed)
+    start = datetime(2025, 11, 15, 8, 0)
+    step = timedelta(seconds=12 * 3600 / n)
+    vitals = []
+    for i in range(n):
+        progress = i / n
+        hypotension = 0.30 < progress < 0.32
+        vitals.append({
+            "PROCDTTM": (start + step * i).strftime("%Y%m%d%H%M%S"),
+            "ETEMPUTER": f"{36.6 + progress * 1.2 + rnd.uniform(-0.2, 0.2):.1f}",
+            "EPLUSE": str(int(82 + 35 * (progress > 0.6) + rnd.randint(-6, 6))),
+            "EBREATHE": str(rnd.randint(14, 22)),
+            "EPRESSURE": str(rnd.randint(105, 135) - (45 if hypotension else 0)),
+            "EDIASTOLIC": str(rnd.randint(60, 85) - (25 if hypotension else 0)),
+            "ESAO2": "" if i % 9 == 0 else str(rnd.randint(93, 100)),
+            "GCS": "E4V5M6" if progress < 0.8 else "E3V4M6",
+        })
+    return vitals
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    points = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    vitals = make_vitals(n)
+    raw_tokens = sum(estimate_tokens(format_vitals_line(item)) for item in vitals)
+
+    print("\n" + "=" * 60)
+    print(f"合成監測 {n} 筆 (12 小時) | 降採樣 {points} 點 | 重複 {REPEAT} 次")
+    print(f"逐筆列出約 {raw_tokens} tokens")
+    print("-" * 60)
+    digest = ""
+    for method in DOWNSAMPLE_METHODS:
+        timings = []
+        for _ in range(REPEAT):
+            t0 = time.perf_counter()
+            digest = build_vitals_digest(vitals, points, method)
+            timings.append((time.perf_counter() - t0) * 1000)
+        print(f"{method:<7}: 中位數 {statistics.median(timings):.2f} ms | 最慢 {max(timings):.2f} ms | "
+              f"摘要 {estimate_tokens(digest)} tokens")
+    print("=" * 60)
+    print(digest)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# /benchmarks/fake_openai_server.py
+#
+# 本機假的 OpenAI 相容伺服器 (只實作 POST /v1/chat/completions)，用來在不耗用 API 額度的情況下
+# 測試串流 (SSE) 與量測用戶端本身的開銷。回覆內容固定，延遲可調：
+#   first_token_delay : 收到請求後多久送出第一段文字 (模擬模型排隊 + prefill)
+#   token_delay       : 之後每段文字的間隔 (模擬逐字生成)
+#
+# 用法：
+#   python benchmarks/fake_openai_server.py [port] [first_token_delay] [token_delay]
+#   GROQ_BASE_URL=http://127.0.0.1:8765/v1 GROQ_API_KEY=fake streamlit run app.py
+
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "### **S (Subjective)**\n- 病患主訴胸悶，到院時意識清楚。\n\n"
+    "### **O (Objective)**\n- 生命徵象穩定，T:36.8 P:88 BP:128/76 SpO2:98%。\n\n"
+    "### **A (Assessment)**\n- 胸悶待排除心因性原因。\n\n"
+    "### **P (Plan)**\n- 持續監測生命徵象，追蹤心肌酵素。\n"
+)
+
+def _split_reply(text, size=4):
+    """把回覆切成小段，模擬模型逐 token 輸出"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # 支援 keep-alive，才能量測連線重用的效果
+    # 標頭與內容分兩次寫出；不關閉 Nagle 時，重用的連線會碰上 delayed ACK 而每次多等約 40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+            # 同一條 TCP 連線上的第幾個請求 (>1 代表連線被重用)
+            self.requests_on_connection = getattr(self, "requests_on_connection", 0) + 1
+            if self.requests_on_connection == 1:
+                server.stats["connections"] += 1
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        # 模擬供應商限流：接下來 fail_next 個請求回 429
+        with server.stats_lock:
+            rate_limited = server.fail_next > 0
+            if rate_limited:
+                server.fail_next -= 1
+                server.stats["rate_limited"] += 1
+        if rate_limited:
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "rate_limit_exceeded"}},
+                            headers={"Retry-After": "0"})
+            return
+
+        model = body.get("model", "fake-model")
+        chunks = _split_reply(server.reply)
+        created = int(time.time())
+        if server.first_token_delay:
+            time.sleep(server.first_token_delay)
+
+        if not body.get("stream"):
+            if server.token_delay:
+                time.sleep(server.token_delay * len(chunks))
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": server.reply}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(chunks), "total_tokens": len(chunks)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, text in enumerate(chunks):
+            if i and server.token_delay:
+                time.sleep(server.token_delay)
+            delta = {"content": text} if i else {"role": "assistant", "content": text}
+            self._send_event({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            })
+        self._send_event({
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, payload):
+        self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+def start_fake_server(port=0, first_token_delay=0.0, token_delay=0.0, reply=DEFAULT_REPLY, fail_next=0):
+    """
+    在背景執行緒啟動假伺服器，回傳 (server, base_url)。
+    結束時呼叫 server.shutdown()；server.stats 記錄請求數、TCP 連線數與回 429 的次數。
+    fail_next > 0 時，接下來的這麼多個請求回 429 (可隨時修改 server.fail_next)。
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.first_token_delay = first_token_delay
+    server.token_delay = token_delay
+    server.reply = reply
+    server.fail_next = fail_next
+    server.stats = {"requests": 0, "connections": 0, "rate_limited": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    first_token_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    token_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.03
+    server, base_url = start_fake_server(port, first_token_delay, token_delay)
+    print(f"假 OpenAI 伺服器啟動於 {base_url} (首字延遲 {first_token_delay}s, 每段 {token_delay}s)，Ctrl+C 結束")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
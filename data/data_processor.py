@@ -1,258 +1,668 @@
 import csv
+import hashlib
+import io
 import os
-import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
 from db.db_connector import get_db_connection
+from data.imputation import VITAL_IMPUTATION, impute_columns
 
 # =========================================================
-# 1. 匯入急診檢驗明細 (DB_ADM_LABDATA_ER)
+# 0. 共用：以 COPY FROM STDIN 串流匯入
 # =========================================================
-def import_lab_data_er():
-    """匯入急診檢驗明細 (22欄位)"""
-    csv_filename = 'DB_ADM_LABDATA_ER-急診檢驗明細.csv'
-    csv_filepath = os.path.join(os.path.dirname(__file__), csv_filename)
-    
-    print(f"--- [1/5] 開始匯入 {csv_filename} ---")
+# 每批筆數：每批各自 COPY 並 commit，記憶體用量只跟批次大小有關，與檔案大小無關
+DEFAULT_BATCH_ROWS = 50000
+# 視為 NULL 的原始值
+NULL_TOKENS = ('(null)', '')
+# 匯入失敗的資料列會寫到這個資料夾 (檔名: <CSV 檔名>.rejects.csv)
+REJECT_DIR = os.path.join(os.path.dirname(__file__), 'rejects')
+# 模擬數值填補的亂數種子 (固定種子 -> 同一筆紀錄重新匯入時填補值相同)
+IMPUTE_SEED = int(os.getenv("IMPUTE_SEED", "20251115"))
+# 平行匯入時與其他交易 deadlock / 序列化衝突 (總覽觸發程序會寫同一批列) 的重試次數
+LOCK_RETRIES = 5
+
+def clean_row(row, width):
+    """處理空字串和 (null)，並補齊 / 截斷至 width 欄"""
+    cleaned = [None if val.strip() in NULL_TOKENS else val for val in row]
+    while len(cleaned) < width: cleaned.append(None)
+    return cleaned[:width]
+
+def _copy_escape(val):
+    """轉成 COPY text 格式：None -> \\N，並跳脫反斜線 / Tab / 換行"""
+    if val is None:
+        return '\\N'
+    return (str(val).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def _copy_lines(rows):
+    return ''.join('\t'.join(_copy_escape(v) for v in row) + '\n' for row in rows)
+
+class _RejectWriter:
+    """壞資料列寫入 reject 檔 (第一次有壞資料時才建立檔案)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, line_no, raw_row, reason):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(['line_no', 'error', 'raw_row'])
+        self._writer.writerow([line_no, str(reason).strip(), '|'.join(raw_row)])
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+def _wait_lock_retry(attempt, error):
+    """deadlock / 序列化衝突後等待一下再重試；超過 LOCK_RETRIES 次就把例外往外丟"""
+    if attempt >= LOCK_RETRIES:
+        raise error
+    print(f"  ... 與其他匯入交易衝突，第 {attempt + 1} 次重試: {str(error).splitlines()[0]}")
+    time.sleep(0.1 * (attempt + 1))
+
+def _copy_batch(cur, copy_sql, batch, rejects):
+    """
+    COPY 一批資料；若整批失敗 (某幾列資料型別不符等)，以二分法拆開重試，
+    最終只把真正有問題的那幾列寫入 reject 檔，其餘照常匯入。
+    與平行匯入的其他交易 deadlock 時，回到 savepoint 後原封不動重試同一批。
+    batch 內每個元素為 (行號, 原始列, 清理後的值)。回傳成功匯入的那些元素 (list)。
+    """
+    cur.execute("SAVEPOINT copy_batch")
+    attempt = 0
+    while True:
+        try:
+            cur.copy_expert(copy_sql, io.StringIO(_copy_lines(values for _, _, values in batch)))
+            cur.execute("RELEASE SAVEPOINT copy_batch")
+            return batch
+        except psycopg2.extensions.TransactionRollbackError as e:
+            cur.execute("ROLLBACK TO SAVEPOINT copy_batch")
+            _wait_lock_retry(attempt, e)
+            attempt += 1
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT copy_batch")
+            if len(batch) == 1:
+                line_no, raw_row, _ = batch[0]
+                rejects.write(line_no, raw_row, e)
+                return []
+            mid = len(batch) // 2
+            return (_copy_batch(cur, copy_sql, batch[:mid], rejects) +
+                    _copy_batch(cur, copy_sql, batch[mid:], rejects))
+
+def _execute_lock_retry(cur, sql):
+    """執行一段 SQL；deadlock / 序列化衝突時回到 savepoint 重試 (staging 資料還在，可整段重來)"""
+    cur.execute("SAVEPOINT lock_retry")
+    attempt = 0
+    while True:
+        try:
+            cur.execute(sql)
+            cur.execute("RELEASE SAVEPOINT lock_retry")
+            return
+        except psycopg2.extensions.TransactionRollbackError as e:
+            cur.execute("ROLLBACK TO SAVEPOINT lock_retry")
+            _wait_lock_retry(attempt, e)
+            attempt += 1
+
+def _iter_lines(csv_filepath, byte_range=None, on_decode_error=None):
+    """
+    逐行讀取檔案 (可只讀 [start, end) 位元組範圍，供分片平行匯入)。
+    範圍起點必須對齊一筆資料的開頭 (見 shard_ranges)；檔頭的 BOM 會被移除。
+    無法以 UTF-8 解碼的行交給 on_decode_error(行號, 原始位元組, 例外)，並以空行代替，
+    讀取繼續進行，後面的行號也不會錯位。
+    """
+    start, end = byte_range if byte_range else (0, None)
+    with open(csv_filepath, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for line_no, raw in enumerate(f, start=1):
+            if end is not None and pos >= end:
+                break
+            try:
+                line = raw.decode('utf-8')
+            except UnicodeDecodeError as e:
+                if on_decode_error is None:
+                    raise
+                on_decode_error(line_no, raw, e)
+                line = '\n'
+            if pos == 0 and line.startswith('\ufeff'):
+                line = line[1:]
+            pos += len(raw)
+            yield line
+
+def shard_ranges(csv_filepath, shards):
+    """
+    將檔案切成約 shards 個位元組範圍，每個切點都落在「一筆資料」的開頭。
+    護理紀錄等欄位內可能有換行 (以雙引號包住)，因此掃描時累計引號數，
+    只在引號成對 (不在引號內) 的行尾切分。
+    """
+    size = os.path.getsize(csv_filepath)
+    if shards <= 1 or size == 0:
+        return [(0, size)]
+    targets = [size * i // shards for i in range(1, shards)]
+    cuts = [0]
+    quotes = 0
+    pos = 0
+    with open(csv_filepath, 'rb') as f:
+        for raw in f:
+            quotes += raw.count(b'"')
+            pos += len(raw)
+            if targets and pos >= targets[0] and quotes % 2 == 0:
+                if pos < size:
+                    cuts.append(pos)
+                while targets and targets[0] <= pos:
+                    targets.pop(0)
+            if not targets:
+                break
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def _merge_sql(table, staging, columns, merge_keys):
+    """
+    staging -> 正式表的 upsert：先刪除相同自然鍵的舊資料，再插入 (同批內重複鍵只保留一筆)。
+    鍵欄位都可能是 NULL，比對時 NULL 視為相同 (IS NOT DISTINCT FROM)，重複匯入同一檔案才不會多出資料；
+    第一個鍵欄位拆成「= 」與「IS NULL」兩段刪除，合併鍵索引 (002_access_path_indexes.sql) 仍可使用。
+    """
+    keys = ', '.join(merge_keys)
+    first = merge_keys[0]
+    same_rest = ''.join(f" AND t.{k} IS NOT DISTINCT FROM s.{k}" for k in merge_keys[1:])
+    cols = ', '.join(columns)
+    return f"""
+        DELETE FROM {table} t USING (SELECT DISTINCT {keys} FROM {staging} WHERE {first} IS NOT NULL) s
+            WHERE t.{first} = s.{first}{same_rest};
+        DELETE FROM {table} t USING (SELECT DISTINCT {keys} FROM {staging} WHERE {first} IS NULL) s
+            WHERE t.{first} IS NULL{same_rest};
+        INSERT INTO {table} ({cols}) SELECT DISTINCT ON ({keys}) {cols} FROM {staging};
+        TRUNCATE {staging};
+    """
+
+def copy_csv_to_table(csv_filepath, table, columns, row_transform=None,
+                      batch_rows=DEFAULT_BATCH_ROWS, reject_path=None, byte_range=None,
+                      merge_keys=None, batch_transform=None, on_batch_loaded=None):
+    """
+    將 CSV 以 COPY FROM STDIN 串流匯入資料表。
+
+    - 逐列讀檔、清理 (row_transform，預設為 clean_row)，每 batch_rows 筆 COPY 一次並 commit
+    - row_transform 回傳 None 代表略過該列 (例如增量匯入時早於水位線的資料)
+    - batch_transform 以整批 (list of list) 為單位處理，供欄位導向的向量化運算使用
+    - 無法解析或資料庫拒收的資料列寫到 reject 檔，不會中斷整個檔案
+    - byte_range=(start, end) 時只匯入該範圍 (分片匯入用，行號為分片內的相對行號)
+    - merge_keys 有值時改為 upsert：先 COPY 進暫存表，再依自然鍵合併，重複執行結果不變
+    - on_batch_loaded(values_list) 在每批 commit 後呼叫，只包含真正寫入的資料列 (不含 reject)
+    - 回傳統計 {"rows", "skipped", "rejected", "seconds", "rows_per_sec", "error"}；連線失敗回傳 None
+    """
+    width = len(columns)
+    if row_transform is None:
+        row_transform = lambda row: clean_row(row, width)
+    if reject_path is None:
+        reject_path = os.path.join(REJECT_DIR, os.path.basename(csv_filepath) + '.rejects.csv')
+
     conn = get_db_connection()
-    if not conn: return
+    if not conn: return None
 
-    try:
-        with open(csv_filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            data = []
-            for row in reader:
-                # 處理空字串和 (null)
-                cleaned = [None if val.strip() in ['(null)', ''] else val for val in row]
-                # 補齊至 22 欄
-                while len(cleaned) < 22: cleaned.append(None)
-                data.append(tuple(cleaned[:22]))
-
-        if data:
-            with conn.cursor() as cur:
-                query = """
-                    INSERT INTO DB_ADM_LABDATA_ER (
-                        CHAD1CASENO, CHMRNO, CHGREQNO, CHAPPDTM, CHRCPDTM, 
-                        CHLREQNO, CHORDNO, CHITEMNO, CHHEAD, CHTEAMNAM, 
-                        CHSTAT, CHSPECI, CHVAL, CHUNIT, CHCOMMT, 
-                        CHNL, CHNH, CHITEMSEQ, CHREPORTDATE, CHTEXT, 
-                        CHSIGNDTTM, CHLABAPCODE
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """
-                cur.executemany(query, data)
-            conn.commit()
-            print(f"成功匯入 {len(data)} 筆資料到 DB_ADM_LABDATA_ER")
-        else:
-            print("檔案為空")
+    target = f"stg_{table.lower()}" if merge_keys else table
+    copy_sql = f"COPY {target} ({', '.join(columns)}) FROM STDIN"
+    rejects = _RejectWriter(reject_path)
+    loaded = 0
+    skipped = 0
+    error = None
+    started = time.perf_counter()
+
+    def flush(cur, batch):
+        nonlocal loaded
+        if batch_transform:
+            values = batch_transform([v for _, _, v in batch])
+            batch = [(line_no, raw, v) for (line_no, raw, _), v in zip(batch, values)]
+        copied = _copy_batch(cur, copy_sql, batch, rejects)
+        loaded += len(copied)
+        if merge_keys:
+            _execute_lock_retry(cur, _merge_sql(table, target, columns, merge_keys))
+        conn.commit()
+        if on_batch_loaded:
+            on_batch_loaded([v for _, _, v in copied])
+        elapsed = time.perf_counter() - started
+        print(f"  ... {table}: 已匯入 {loaded} 筆 ({loaded / elapsed:,.0f} 筆/秒)")
 
+    try:
+        with conn.cursor() as cur:
+            if merge_keys:
+                cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {target} (LIKE {table} INCLUDING DEFAULTS)")
+            # 壞位元組只影響該行：原始內容 (以跳脫字元保留) 寫入 reject 檔，其餘照常匯入
+            on_decode_error = lambda line_no, raw, e: rejects.write(
+                line_no, [raw.decode('utf-8', 'backslashreplace').rstrip('\r\n')], e)
+            reader = csv.reader(_iter_lines(csv_filepath, byte_range, on_decode_error))
+            batch = []
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as e:
+                    rejects.write(reader.line_num, [], e)
+                    continue
+                line_no = reader.line_num
+                if not row: continue
+                try:
+                    values = row_transform(row)
+                except Exception as e:
+                    rejects.write(line_no, row, e)
+                    continue
+                if values is None:
+                    skipped += 1
+                    continue
+                batch.append((line_no, row, values))
+                if len(batch) >= batch_rows:
+                    flush(cur, batch)
+                    batch = []
+            if batch:
+                flush(cur, batch)
     except Exception as e:
-        print(f"匯入失敗: {e}")
+        conn.rollback()
+        error = str(e)
+        print(f"匯入失敗 (已 commit 的批次會保留): {e}")
     finally:
+        rejects.close()
         conn.close()
 
+    elapsed = time.perf_counter() - started
+    stats = {
+        "rows": loaded,
+        "skipped": skipped,
+        "rejected": rejects.count,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(loaded / elapsed, 1) if elapsed > 0 else 0.0,
+        "error": error,
+    }
+    if skipped:
+        print(f"略過 {skipped} 筆已匯入過的資料")
+    if loaded or rejects.count:
+        print(f"成功匯入 {loaded} 筆資料到 {table} ({stats['rows_per_sec']:,.0f} 筆/秒)")
+        if rejects.count:
+            print(f"⚠️  {rejects.count} 筆資料無法匯入，已寫入 {reject_path}")
+    elif not skipped:
+        print("檔案為空")
+    return stats
+
+
 # =========================================================
-# 2. 匯入急診檢驗頭檔 (DB_ADM_LABORDER_ER)
+# 1. 資料表定義 (每張表只宣告一次：檔案 / 欄位 / 欄位轉換)
 # =========================================================
-def import_lab_order_er():
-    """匯入急診檢驗頭檔 (20欄位)"""
-    csv_filename = 'DB_ADM_LABORDER_ER-急診檢驗頭檔.csv'
-    csv_filepath = os.path.join(os.path.dirname(__file__), csv_filename)
-    
-    print(f"--- [2/5] 開始匯入 {csv_filename} ---")
-    conn = get_db_connection()
-    if not conn: return
+# 每張表的設定：
+#   file       : data/ 底下的 CSV 檔名
+#   label      : 顯示用中文名稱
+#   columns    : 依 CSV 欄位順序排列的資料表欄位 (欄數即為 len(columns))
+#   blank      : 'null' (預設) 空字串與 (null) 轉 NULL；'keep' 只去除前後空白，保留原字串
+#   transforms : {欄位名稱: 轉換函數}，在清理之後逐列套用
+#   impute     : {欄位名稱: 填補規則}，整批以 NumPy 向量化填補缺值
+#   key        : 自然鍵 (增量匯入時用來 upsert，須能唯一識別一筆資料)
+#   time_column: 水位線使用的時間欄位 (增量匯入時只處理不早於上次最大值的資料)
+TABLE_SPECS = {
+    'DB_ADM_LABDATA_ER': {
+        'file': 'DB_ADM_LABDATA_ER-急診檢驗明細.csv',
+        'label': '急診檢驗明細',
+        'key': ['CHAD1CASENO', 'CHGREQNO', 'CHITEMNO'],
+        'time_column': 'CHRCPDTM',
+        'columns': [
+            'CHAD1CASENO', 'CHMRNO', 'CHGREQNO', 'CHAPPDTM', 'CHRCPDTM',
+            'CHLREQNO', 'CHORDNO', 'CHITEMNO', 'CHHEAD', 'CHTEAMNAM',
+            'CHSTAT', 'CHSPECI', 'CHVAL', 'CHUNIT', 'CHCOMMT',
+            'CHNL', 'CHNH', 'CHITEMSEQ', 'CHREPORTDATE', 'CHTEXT',
+            'CHSIGNDTTM', 'CHLABAPCODE'
+        ],
+    },
+    'DB_ADM_LABORDER_ER': {
+        'file': 'DB_ADM_LABORDER_ER-急診檢驗頭檔.csv',
+        'label': '急診檢驗頭檔',
+        'key': ['CHCASENO', 'ORDSEQ'],
+        'time_column': 'CHRCPDTM',
+        'columns': [
+            'CHCASENO', 'CHMRNO', 'CHGREQNO', 'CHAPPDTM', 'CHLREQNO', 'CHORDNO', 'CHORDNAM',
+            'CHTEAMNAM', 'CHSTAT', 'CHSPECI', 'SOURCETYPE', 'ORDSEQ', 'CHTAPPDT', 'CHRCPDTM',
+            'CHRCONNAME', 'CONCODE', 'LABMCHNO', 'LABUNIFNO', 'LABCLASS', 'ORDPROCDTTM'
+        ],
+    },
+    'v_ai_hisensnes': {
+        'file': 'v_ai_hisensnes-急診生理監測-.csv',
+        'label': '急診生理監測 (模擬正常數值填補)',
+        'key': ['TRINO', 'PROCDTTM'],
+        'time_column': 'PROCDTTM',
+        'columns': [
+            'TRINO', 'PATID', 'VISITDT', 'EWEIGHT', 'ETEMPUTER', 'ETREGION', 'EPLUSE',
+            'EBREATHE', 'EPRESSURE', 'EDIASTOLIC', 'ESAO2', 'GCS_E', 'GCS_V', 'GCS_M',
+            'PUPIL_L', 'PUPIL_R', 'ENESKIND', 'PROCDTTM'
+        ],
+        'blank': 'keep',
+        # 缺值時填入正常範圍內的模擬數值 (規則見 data/imputation.py)；
+        # 填補值由 impute_key 決定，與分片 / 批次切法無關
+        'impute': VITAL_IMPUTATION,
+        'impute_key': ['PATID', 'TRINO', 'PROCDTTM'],
+    },
+    'ENSDATA': {
+        'file': 'ENSDATA-急診護理紀錄.csv',
+        'label': '急診護理紀錄',
+        # 同一急診號 / 序號下會有多筆紀錄，需加上時間與內容才能唯一識別
+        'key': ['TRINO', 'SEQ', 'PROCDTTM', 'DIAGNOSIS'],
+        'time_column': 'PROCDTTM',
+        'columns': [
+            'TRINO', 'PATID', 'VISITDT', 'SEQ', 'SUBJECT', 'PROCDTTM',
+            'DIAGNOSIS', 'CLOSE', 'FIINISH'
+        ],
+    },
+    'DB_ADM_ORDER_ER': {
+        'file': 'DB_ADM_ORDER_ER-急診檢驗檢查主檔.csv',
+        'label': '急診檢驗檢查主檔',
+        'key': ['CHAD1CASENO', 'CHAD4GREQNO', 'CHAD4CDATE', 'CHAD4ORDNAME'],
+        'time_column': 'CHRCPDTM',
+        'columns': [
+            'CHAD1CASENO', 'CHAD1MRNO', 'CHAD4GREQNO', 'CHAD4CDATE', 'CHAD1ORDNO',
+            'CHAD4ORDNAME', 'CHTEAMNAM', 'CHAD4SPECT', 'CHAD4DCDATE', 'CHAD4STAT',
+            'CHAD4REP1', 'CHRCPDTM', 'CHREPORTDATE', 'CHTEXT', 'SOURCETYPE'
+        ],
+    },
+}
 
-    try:
-        with open(csv_filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            data = []
-            for row in reader:
-                cleaned = [None if val.strip() in ['(null)', ''] else val for val in row]
-                while len(cleaned) < 20: cleaned.append(None)
-                data.append(tuple(cleaned[:20]))
-
-        if data:
-            with conn.cursor() as cur:
-                query = """
-                    INSERT INTO DB_ADM_LABORDER_ER (
-                        CHCASENO, CHMRNO, CHGREQNO, CHAPPDTM, CHLREQNO, CHORDNO, CHORDNAM, 
-                        CHTEAMNAM, CHSTAT, CHSPECI, SOURCETYPE, ORDSEQ, CHTAPPDT, CHRCPDTM, 
-                        CHRCONNAME, CONCODE, LABMCHNO, LABUNIFNO, LABCLASS, ORDPROCDTTM
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """
-                cur.executemany(query, data)
-            conn.commit()
-            print(f"成功匯入 {len(data)} 筆資料到 DB_ADM_LABORDER_ER")
+def build_row_transform(spec):
+    """依資料表設定組出單列清理函數 (補齊欄數 -> 空值處理 -> 欄位轉換)"""
+    columns = spec['columns']
+    width = len(columns)
+    keep_blank = spec.get('blank', 'null') == 'keep'
+    transforms = [(columns.index(col), fn) for col, fn in spec.get('transforms', {}).items()]
+
+    def transform(row):
+        if keep_blank:
+            cleaned = [val.strip() for val in row]
+            if len(cleaned) != width:
+                cleaned = (cleaned + [''] * width)[:width]
         else:
-            print("檔案為空")
+            cleaned = clean_row(row, width)
+        for idx, fn in transforms:
+            cleaned[idx] = fn(cleaned[idx])
+        return cleaned
+    return transform
 
-    except Exception as e:
-        print(f"匯入失敗: {e}")
-    finally:
-        conn.close()
+def build_batch_transform(spec, seed=IMPUTE_SEED):
+    """依資料表設定組出整批處理函數 (目前只有缺值填補)；不需要時回傳 None"""
+    rules = spec.get('impute')
+    if not rules:
+        return None
+    return lambda rows: impute_columns(rows, spec['columns'], rules, seed, spec.get('impute_key'))
+
+def table_csv_path(table):
+    return os.path.join(os.path.dirname(__file__), TABLE_SPECS[table]['file'])
 
 # =========================================================
-# 3. 匯入急診生理監測 (v_ai_hisensnes) - 含數值模擬
+# 2. 匯入引擎 (各表 / 各分片使用獨立連線，可平行執行)
 # =========================================================
-def import_vital_signs():
-    """匯入急診生理監測 (18欄位) - 自動填補正常生理數值"""
-    csv_filename = 'v_ai_hisensnes-急診生理監測-.csv'
-    csv_filepath = os.path.join(os.path.dirname(__file__), csv_filename)
-    
-    print(f"--- [3/5] 開始匯入 {csv_filename} (模擬正常數值填補) ---")
-    conn = get_db_connection()
-    if not conn: return
+# 檔案超過此大小才會切分片
+SHARD_MIN_BYTES = 64 * 1024 * 1024
 
-    try:
-        with open(csv_filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            data = []
-            
-            for row in reader:
-                cleaned_row = [val.strip() for val in row]
-                while len(cleaned_row) < 18: cleaned_row.append('')
-
-                # === 開始模擬數值邏輯 ===
-                # 3: EWEIGHT (體重) 55-78
-                if cleaned_row[3] in ['', '(null)']: cleaned_row[3] = str(random.randint(55, 78))
-                # 4: ETEMPUTER (體溫) 36.2-37.0
-                if cleaned_row[4] in ['', '(null)']: cleaned_row[4] = str(round(random.uniform(36.2, 37.0), 1))
-                # 5: ETREGION (部位) 預設 '2'
-                if cleaned_row[5] in ['', '(null)']: cleaned_row[5] = '2'
-                # 6: EPLUSE (脈搏) 65-95
-                if cleaned_row[6] in ['', '(null)']: cleaned_row[6] = str(random.randint(65, 95))
-                # 7: EBREATHE (呼吸) 14-18
-                if cleaned_row[7] in ['', '(null)']: cleaned_row[7] = str(random.randint(14, 18))
-                # 8: EPRESSURE (收縮壓) 110-135
-                if cleaned_row[8] in ['', '(null)']: cleaned_row[8] = str(random.randint(110, 135))
-                # 9: EDIASTOLIC (舒張壓) 70-85
-                if cleaned_row[9] in ['', '(null)']: cleaned_row[9] = str(random.randint(70, 85))
-                # 10: ESAO2 (血氧) 97-99
-                if cleaned_row[10] in ['', '(null)']: cleaned_row[10] = str(random.randint(97, 99))
-                # 11-13: GCS 4/5/6
-                if cleaned_row[11] in ['', '(null)']: cleaned_row[11] = '4'
-                if cleaned_row[12] in ['', '(null)']: cleaned_row[12] = '5'
-                if cleaned_row[13] in ['', '(null)']: cleaned_row[13] = '6'
-                # 14-15: PUPIL 2.5/3.0
-                if cleaned_row[14] in ['', '(null)']: cleaned_row[14] = str(random.choice([2.5, 3.0]))
-                if cleaned_row[15] in ['', '(null)']: cleaned_row[15] = str(random.choice([2.5, 3.0]))
-                # 16: ENESKIND (檢傷) 預設 '3'
-                if cleaned_row[16] in ['', '(null)']: cleaned_row[16] = '3'
-                # === 結束模擬 ===
-
-                data.append(tuple(cleaned_row[:18]))
-
-        if data:
-            with conn.cursor() as cur:
-                query = """
-                    INSERT INTO v_ai_hisensnes (
-                        TRINO, PATID, VISITDT, EWEIGHT, ETEMPUTER, ETREGION, EPLUSE, 
-                        EBREATHE, EPRESSURE, EDIASTOLIC, ESAO2, GCS_E, GCS_V, GCS_M, 
-                        PUPIL_L, PUPIL_R, ENESKIND, PROCDTTM
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """
-                cur.executemany(query, data)
-            conn.commit()
-            print(f"成功匯入 {len(data)} 筆資料到 v_ai_hisensnes")
+def import_table(table, batch_rows=DEFAULT_BATCH_ROWS, byte_range=None, shard_no=None):
+    """匯入單一資料表 (或其中一個分片)，回傳 copy_csv_to_table 的統計"""
+    spec = TABLE_SPECS[table]
+    csv_filepath = table_csv_path(table)
+    reject_path = None
+    if shard_no is not None:
+        reject_path = os.path.join(REJECT_DIR, f"{spec['file']}.shard{shard_no}.rejects.csv")
+
+    shard_text = f" (分片 {shard_no})" if shard_no is not None else ""
+    print(f"--- 開始匯入 {spec['file']}{shard_text} -> {table} [{spec['label']}] ---")
+    return copy_csv_to_table(csv_filepath, table, spec['columns'],
+                             row_transform=build_row_transform(spec),
+                             batch_transform=build_batch_transform(spec),
+                             batch_rows=batch_rows, reject_path=reject_path,
+                             byte_range=byte_range)
+
+def _plan_jobs(tables, shards):
+    """產生工作清單 [(table, byte_range, shard_no)]，大檔案切成多個分片"""
+    jobs = []
+    for table in tables:
+        csv_filepath = table_csv_path(table)
+        if shards > 1 and os.path.getsize(csv_filepath) >= SHARD_MIN_BYTES:
+            for shard_no, byte_range in enumerate(shard_ranges(csv_filepath, shards)):
+                jobs.append((table, byte_range, shard_no))
         else:
-            print("檔案為空")
+            jobs.append((table, None, None))
+    return jobs
 
-    except Exception as e:
-        print(f"匯入失敗: {e}")
-    finally:
-        conn.close()
+def import_tables(tables=None, workers=None, shards=1, batch_rows=DEFAULT_BATCH_ROWS, incremental=False):
+    """
+    匯入多張資料表。互不相依的資料表 (與大檔的分片) 會在行程池中平行匯入，
+    每個工作各自建立資料庫連線。workers=1 時依序在本行程執行。
+    incremental=True 時改用 import_table_incremental (不切分片，只處理新資料)。
+
+    回傳 {table: {"rows", "rejected", "seconds", "rows_per_sec"}}
+    """
+    tables = list(tables or TABLE_SPECS)
+    for table in tables:
+        if table not in TABLE_SPECS:
+            raise ValueError(f"未定義的資料表: {table} (可用: {', '.join(TABLE_SPECS)})")
+
+    if incremental:
+        jobs = [(table, None, None) for table in tables]
+    else:
+        jobs = _plan_jobs(tables, shards)
+    started = time.perf_counter()
+    results = []
+
+    if workers == 1:
+        for table, byte_range, shard_no in jobs:
+            if incremental:
+                results.append((table, import_table_incremental(table, batch_rows)))
+            else:
+                results.append((table, import_table(table, batch_rows, byte_range, shard_no)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (table, executor.submit(import_table_incremental, table, batch_rows) if incremental
+                 else executor.submit(import_table, table, batch_rows, byte_range, shard_no))
+                for table, byte_range, shard_no in jobs
+            ]
+            for table, future in futures:
+                try:
+                    results.append((table, future.result()))
+                except Exception as e:
+                    print(f"匯入 {table} 失敗: {e}")
+                    results.append((table, None))
+
+    # 彙整各分片的統計
+    summary = {}
+    for table, stats in results:
+        total = summary.setdefault(table, {"rows": 0, "rejected": 0, "seconds": 0.0})
+        if stats:
+            total["rows"] += stats["rows"]
+            total["rejected"] += stats["rejected"]
+            total["seconds"] = max(total["seconds"], stats["seconds"])
+    for total in summary.values():
+        total["rows_per_sec"] = round(total["rows"] / total["seconds"], 1) if total["seconds"] > 0 else 0.0
+
+    elapsed = time.perf_counter() - started
+    all_rows = sum(t["rows"] for t in summary.values())
+    print(f"共匯入 {all_rows} 筆，耗時 {elapsed:.2f} 秒 ({all_rows / elapsed if elapsed else 0:,.0f} 筆/秒)")
+    return summary
 
 # =========================================================
-# 4. 匯入急診護理紀錄 (ENSDATA)
+# 3. 增量匯入 (依匯入紀錄只處理新增的部分，可重複執行)
 # =========================================================
-def import_nursing_records():
-    """匯入急診護理紀錄 (9欄位)"""
-    csv_filename = 'ENSDATA-急診護理紀錄.csv'
-    csv_filepath = os.path.join(os.path.dirname(__file__), csv_filename)
-    
-    print(f"--- [4/5] 開始匯入 {csv_filename} ---")
-    conn = get_db_connection()
-    if not conn: return
+# 每張表的匯入紀錄：檔案大小 / 已處理到的位元組位置 / 該段內容的 SHA-256 / 筆數 / 時間水位線
+MANIFEST_DDL = """
+    CREATE TABLE IF NOT EXISTS import_manifest (
+        table_name    VARCHAR(64) PRIMARY KEY,
+        file_name     TEXT NOT NULL,
+        byte_offset   BIGINT NOT NULL,
+        prefix_sha256 CHAR(64) NOT NULL,
+        row_count     BIGINT NOT NULL DEFAULT 0,
+        max_time      VARCHAR(14),
+        loaded_at     TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
 
-    try:
-        with open(csv_filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            data = []
-            for row in reader:
-                cleaned = [None if val.strip() in ['(null)', ''] else val for val in row]
-                while len(cleaned) < 9: cleaned.append(None)
-                data.append(tuple(cleaned[:9]))
-
-        if data:
-            with conn.cursor() as cur:
-                query = """
-                    INSERT INTO ENSDATA (
-                        TRINO, PATID, VISITDT, SEQ, SUBJECT, PROCDTTM, 
-                        DIAGNOSIS, CLOSE, FIINISH
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """
-                cur.executemany(query, data)
-            conn.commit()
-            print(f"成功匯入 {len(data)} 筆資料到 ENSDATA")
-        else:
-            print("檔案為空")
+def _file_digests(csv_filepath, prefix_len, total_len):
+    """讀檔一次，同時算出前 prefix_len 位元組與前 total_len 位元組的 SHA-256"""
+    digest = hashlib.sha256()
+    prefix_hex = None if prefix_len else digest.hexdigest()
+    pos = 0
+    with open(csv_filepath, 'rb') as f:
+        while pos < total_len:
+            chunk = f.read(min(1024 * 1024, total_len - pos))
+            if not chunk:
+                break
+            if prefix_hex is None and pos + len(chunk) >= prefix_len:
+                digest.update(chunk[:prefix_len - pos])
+                prefix_hex = digest.hexdigest()
+                digest.update(chunk[prefix_len - pos:])
+            else:
+                digest.update(chunk)
+            pos += len(chunk)
+    return prefix_hex, digest.hexdigest()
 
-    except Exception as e:
-        print(f"匯入失敗: {e}")
+def _complete_size(csv_filepath):
+    """檔案可能仍在寫入中，只處理到最後一個完整行 (換行字元) 為止"""
+    size = os.path.getsize(csv_filepath)
+    with open(csv_filepath, 'rb') as f:
+        f.seek(max(0, size - 64 * 1024))
+        tail = f.read()
+    last_newline = tail.rfind(b'\n')
+    if last_newline < 0:
+        return size
+    return size - len(tail) + last_newline + 1
+
+def _read_manifest(table):
+    conn = get_db_connection()
+    if not conn: return False, None
+    try:
+        with conn.cursor() as cur:
+            cur.execute(MANIFEST_DDL)
+            cur.execute("""
+                SELECT byte_offset, prefix_sha256, row_count, max_time
+                FROM import_manifest WHERE table_name = %s
+            """, (table,))
+            row = cur.fetchone()
+        conn.commit()
+        if row is None:
+            return True, None
+        return True, {"byte_offset": row[0], "prefix_sha256": row[1], "row_count": row[2], "max_time": row[3]}
+    except psycopg2.Error as e:
+        print(f"讀取匯入紀錄失敗: {e}")
+        return False, None
     finally:
         conn.close()
 
-# =========================================================
-# 5. 匯入急診檢驗檢查主檔 (DB_ADM_ORDER_ER)
-# =========================================================
-def import_adm_order_er():
-    """匯入急診檢驗檢查主檔 (15欄位)"""
-    csv_filename = 'DB_ADM_ORDER_ER-急診檢驗檢查主檔.csv'
-    csv_filepath = os.path.join(os.path.dirname(__file__), csv_filename)
-    
-    print(f"--- [5/5] 開始匯入 {csv_filename} ---")
+def _write_manifest(table, spec, byte_offset, prefix_sha256, row_count, max_time):
     conn = get_db_connection()
-    if not conn: return
-
+    if not conn: return False
     try:
-        with open(csv_filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            data = []
-            for row in reader:
-                cleaned = [None if val.strip() in ['(null)', ''] else val for val in row]
-                while len(cleaned) < 15: cleaned.append(None)
-                data.append(tuple(cleaned[:15]))
-
-        if data:
-            with conn.cursor() as cur:
-                query = """
-                    INSERT INTO DB_ADM_ORDER_ER (
-                        CHAD1CASENO, CHAD1MRNO, CHAD4GREQNO, CHAD4CDATE, CHAD1ORDNO, 
-                        CHAD4ORDNAME, CHTEAMNAM, CHAD4SPECT, CHAD4DCDATE, CHAD4STAT, 
-                        CHAD4REP1, CHRCPDTM, CHREPORTDATE, CHTEXT, SOURCETYPE
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """
-                cur.executemany(query, data)
-            conn.commit()
-            print(f"成功匯入 {len(data)} 筆資料到 DB_ADM_ORDER_ER")
-        else:
-            print("檔案為空")
-
-    except Exception as e:
-        print(f"匯入失敗: {e}")
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO import_manifest (table_name, file_name, byte_offset, prefix_sha256, row_count, max_time, loaded_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (table_name) DO UPDATE SET
+                    file_name = EXCLUDED.file_name,
+                    byte_offset = EXCLUDED.byte_offset,
+                    prefix_sha256 = EXCLUDED.prefix_sha256,
+                    row_count = EXCLUDED.row_count,
+                    max_time = EXCLUDED.max_time,
+                    loaded_at = NOW()
+            """, (table, spec['file'], byte_offset, prefix_sha256, row_count, max_time))
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        print(f"更新匯入紀錄失敗: {e}")
+        conn.rollback()
+        return False
     finally:
         conn.close()
 
+def import_table_incremental(table, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    增量匯入單一資料表，可重複執行 (idempotent)：
+
+    - 檔案只是往後附加 (前段內容的 SHA-256 與上次相同)：只讀取上次位置之後的新資料
+    - 檔案被整份重新產生：重新掃描，但略過時間早於水位線 (上次最大時間) 的資料
+    - 兩種情況都以自然鍵 upsert，中途失敗後重跑也不會產生重複資料
+    """
+    spec = TABLE_SPECS[table]
+    csv_filepath = table_csv_path(table)
+
+    ok, manifest = _read_manifest(table)
+    if not ok: return None
+
+    size = _complete_size(csv_filepath)
+    offset = manifest["byte_offset"] if manifest else 0
+    prefix_hex, full_hex = _file_digests(csv_filepath, min(offset, size), size)
+    row_transform = build_row_transform(spec)
+
+    time_idx = spec['columns'].index(spec['time_column'])
+    if manifest and offset <= size and prefix_hex == manifest["prefix_sha256"]:
+        if offset == size:
+            print(f"--- {spec['file']} 沒有新資料，略過 ---")
+            return {"rows": 0, "skipped": 0, "rejected": 0, "seconds": 0.0, "rows_per_sec": 0.0, "error": None}
+        print(f"--- 增量匯入 {spec['file']} -> {table} (自第 {offset} 位元組起的新資料) ---")
+        byte_range = (offset, size)
+        base_rows = manifest["row_count"]
+    else:
+        watermark = manifest["max_time"] if manifest else None
+        if manifest:
+            print(f"--- {spec['file']} 內容已變更，重新掃描 (水位線: {watermark}) -> {table} ---")
+        else:
+            print(f"--- 首次匯入 {spec['file']} -> {table} ---")
+        byte_range = (0, size)
+        base_rows = 0
+        if watermark:
+            clean = row_transform
+
+            def row_transform(row):
+                values = clean(row)
+                # 時間欄位為空的資料無法判斷新舊，一律交給 upsert 處理
+                if values[time_idx] and values[time_idx] < watermark:
+                    return None
+                return values
+
+    # 新水位線 = 上次水位線與這次已 commit 的資料 (不含 reject) 取較大者 (不必回頭 MAX() 掃描整張表)
+    max_time = manifest["max_time"] if manifest else None
+
+    def track_max_time(rows):
+        nonlocal max_time
+        times = [values[time_idx] for values in rows if values[time_idx]]
+        if times and (max_time is None or max(times) > max_time):
+            max_time = max(times)
+
+    stats = copy_csv_to_table(csv_filepath, table, spec['columns'],
+                              row_transform=row_transform, batch_rows=batch_rows,
+                              batch_transform=build_batch_transform(spec),
+                              byte_range=byte_range, merge_keys=spec['key'],
+                              on_batch_loaded=track_max_time)
+    if stats is None or stats["error"]:
+        print("⚠️  匯入未完成，匯入紀錄不更新 (下次執行會重新處理這一段)")
+        return stats
+
+    row_count = base_rows + stats["rows"] + stats["skipped"] + stats["rejected"]
+    _write_manifest(table, spec, size, full_hex, row_count, max_time)
+    return stats
+
 # =========================================================
 # 主程式執行入口
 # =========================================================
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="匯入急診 CSV 資料")
+    parser.add_argument('tables', nargs='*', help=f"要匯入的資料表 (預設全部: {', '.join(TABLE_SPECS)})")
+    parser.add_argument('--workers', type=int, default=None, help="平行工作數 (1 = 依序匯入，預設為 CPU 核心數)")
+    parser.add_argument('--shards', type=int, default=1, help=f"大於 {SHARD_MIN_BYTES // 1024 // 1024}MB 的檔案切成幾個分片平行匯入")
+    parser.add_argument('--incremental', action='store_true', help="增量匯入：只處理上次匯入後新增的資料並以自然鍵 upsert")
+    parser.add_argument('--batch-rows', type=int, default=int(os.getenv("IMPORT_BATCH_ROWS", DEFAULT_BATCH_ROWS)),
+                        help="每批 COPY / commit 的筆數")
+    args = parser.parse_args()
+
     print("=== 開始執行資料匯入作業 ===")
-    
-    # 執行所有匯入函數
-    import_lab_data_er()
-    import_lab_order_er()
-    import_vital_signs()
-    import_nursing_records()
-    import_adm_order_er()
-    
-    print("=== 所有匯入作業完成 ===")
\ No newline at end of file
+    summary = import_tables(args.tables or None, workers=args.workers,
+                            shards=args.shards, batch_rows=args.batch_rows,
+                            incremental=args.incremental)
+    for table, stats in summary.items():
+        print(f"  {table:<20} {stats['rows']:>10} 筆  拒收 {stats['rejected']:>6} 筆  {stats['rows_per_sec']:>12,.0f} 筆/秒")
+    print("=== 所有匯入作業完成 ===")
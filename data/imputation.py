@@ -0,0 +1,132 @@
+# /data/imputation.py
+
+# 生理監測缺值填補 (向量化版本)
+# 以「欄」為單位一次處理整批資料，用 NumPy 產生亂數，取代逐列逐格呼叫 random。
+# 每一格的亂數由 (種子, 欄位, 該列的識別鍵) 雜湊而來，與該列落在哪個分片、哪一批、前面有幾筆缺值無關：
+# 改變分片數、批次大小或增量匯入的起點，同一筆紀錄的填補值都相同。
+
+import hashlib
+from operator import itemgetter
+
+import numpy as np
+
+# 視為缺值的原始字串
+MISSING_TOKENS = ('', '(null)')
+_MISSING_SET = frozenset(MISSING_TOKENS)
+
+# ==========================================
+# 填補規則設定表
+# ==========================================
+# 欄位: (方式, 參數...)
+#   int    : 介於 [下限, 上限] 的整數
+#   float  : 介於 [下限, 上限) 的小數，四捨五入到指定位數
+#   const  : 固定值
+#   choice : 從清單中隨機挑一個
+VITAL_IMPUTATION = {
+    'EWEIGHT':    ('int', 55, 78),          # 體重
+    'ETEMPUTER':  ('float', 36.2, 37.0, 1), # 體溫
+    'ETREGION':   ('const', '2'),           # 體溫測量部位
+    'EPLUSE':     ('int', 65, 95),          # 脈搏
+    'EBREATHE':   ('int', 14, 18),          # 呼吸
+    'EPRESSURE':  ('int', 110, 135),        # 收縮壓
+    'EDIASTOLIC': ('int', 70, 85),          # 舒張壓
+    'ESAO2':      ('int', 97, 99),          # 血氧
+    'GCS_E':      ('const', '4'),
+    'GCS_V':      ('const', '5'),
+    'GCS_M':      ('const', '6'),
+    'PUPIL_L':    ('choice', ['2.5', '3.0']),
+    'PUPIL_R':    ('choice', ['2.5', '3.0']),
+    'ENESKIND':   ('const', '3'),           # 檢傷級數
+}
+
+def _hash64(text):
+    """字串 -> 64 位元雜湊值"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+# FNV-1a 64 位元參數
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+def row_keys(rows, key_idx):
+    """
+    各列識別鍵 (key_idx 各欄位值) 的 64 位元雜湊值 (FNV-1a)。
+    整欄轉成 NumPy 字串陣列後逐「字元位置」運算，不必逐列呼叫雜湊函數。
+    """
+    keys = np.full(len(rows), _FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for k in key_idx:
+            # None 轉成字串 'None'，同樣是固定的識別值
+            chars = np.array(list(map(itemgetter(k), rows)), dtype=str)
+            chars = chars.view(np.uint32).reshape(len(rows), -1)
+            for c in range(chars.shape[1]):
+                keys = (keys ^ chars[:, c]) * _FNV_PRIME
+            # 欄位分隔，("AB", "C") 與 ("A", "BC") 不同
+            keys = (keys ^ np.uint64(0x1F)) * _FNV_PRIME
+    return keys
+
+def _uniform(keys, salt):
+    """splitmix64：每個鍵 (加上欄位的 salt) 各自對應一個 [0, 1) 的亂數，整批以 NumPy 運算"""
+    with np.errstate(over='ignore'):
+        z = keys ^ np.uint64(salt)
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+def _generate(rule, u):
+    """依規則把 [0, 1) 亂數 u 轉成填補值 (字串)"""
+    kind = rule[0]
+    if kind == 'int':
+        values = (rule[1] + np.floor(u * (rule[2] - rule[1] + 1))).astype(np.int64).astype(str)
+    elif kind == 'float':
+        values = np.round(rule[1] + u * (rule[2] - rule[1]), rule[3]).astype(str)
+    elif kind == 'const':
+        return [rule[1]] * len(u)
+    elif kind == 'choice':
+        values = np.array(rule[1])[(u * len(rule[1])).astype(np.int64)]
+    else:
+        raise ValueError(f"未知的填補方式: {kind}")
+    return values.tolist()
+
+def impute_columns(rows, columns, rules, seed=None, key_columns=None):
+    """
+    對一批資料列做欄位導向的缺值填補 (直接修改並回傳 rows)。
+
+    每個欄位只做三件事：取出整欄找出缺值位置 -> 以 NumPy 一次產生所有填補值 -> 回寫，
+    只有真正缺值的格子才會被碰到，不再逐格呼叫 random。
+
+    Args:
+        rows: list of list，每列欄位順序與 columns 相同
+        columns: 欄位名稱清單
+        rules: {欄位名稱: 規則}，格式見 VITAL_IMPUTATION
+        seed: 亂數種子；相同種子下同一筆紀錄的填補值固定，None 時每次不同
+        key_columns: 識別一筆紀錄的欄位 (例如 病歷號 + 急診號 + 時間)；None 時以整列內容識別
+    """
+    if not rows:
+        return rows
+
+    if seed is None:
+        seed = int(np.random.default_rng().integers(1 << 62))
+    missing = {}
+    for col_name in rules:
+        j = columns.index(col_name)
+        # map / itemgetter / frozenset.__contains__ 都是 C 實作，整欄判斷不經過 Python 迴圈
+        missing[col_name] = np.fromiter(map(_MISSING_SET.__contains__, map(itemgetter(j), rows)),
+                                        dtype=bool, count=len(rows))
+    # 只替有缺值的列計算識別鍵 (須在回寫填補值之前，以整列內容識別時才不會受填補影響)
+    need = np.flatnonzero(np.logical_or.reduce(list(missing.values())))
+    if not len(need):
+        return rows
+    key_idx = [columns.index(c) for c in key_columns] if key_columns else range(len(columns))
+    keys = np.zeros(len(rows), dtype=np.uint64)
+    keys[need] = row_keys([rows[i] for i in need.tolist()], key_idx)
+
+    for col_name, rule in rules.items():
+        j = columns.index(col_name)
+        idx = np.flatnonzero(missing[col_name])
+        if len(idx):
+            u = _uniform(keys[idx], _hash64(f"{seed}:{col_name}"))
+            for i, value in zip(idx.tolist(), _generate(rule, u)):
+                rows[i][j] = value
+    return rows
@@ -58,6 +58,10 @@ COLUMN_MAPPING = {
     "CHITEMSEQ": "項目序號",
     "CHSIGNDTTM": "簽核時間",
     "CHLABAPCODE": "簽核人員代碼",
+    "CHVAL_NUM": "數值結果",
+    "LAB_FLAG": "異常註記",
+    "VALUE": "數值結果",
+    "FLAG": "異常註記",
 
     # ==========================================
     # 4. ENSDATA (急診護理紀錄) & v_ai_hisensnes (生理監測)
@@ -1,26 +1,39 @@
 # /db/db_connector.py
 
 import os
+import time
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 from dotenv import load_dotenv
 
 # 載入環境變數
 load_dotenv()
 
+def _connection_params():
+    """從 .env 讀取資料庫連線參數"""
+    return {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+    }
+
 def get_db_connection():
     """
     嘗試建立 PostgreSQL 資料庫連線。
     如果成功，回傳連線物件；如果失敗，回傳 None 並印出錯誤。
+
+    注意：這會建立一條「全新」的連線，呼叫端需自行 close()。
+    服務模組請改用 pooled_connection()，以重複使用連線池中的連線。
     """
     try:
         # 嘗試連線
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
-        )
+        conn = psycopg2.connect(**_connection_params())
         return conn
     except psycopg2.Error as e:
         print(f"❌ 資料庫連線失敗: {e}")
@@ -29,15 +42,244 @@ def get_db_connection():
         print(f"❌ 發生未預期的錯誤: {e}")
         return None
 
+# ==========================================
+# 連線池 (Connection Pool)
+# ==========================================
+class ConnectionPool:
+    """
+    執行緒安全的 PostgreSQL 連線池。
+
+    - 連線數量介於 minconn ~ maxconn 之間
+    - 連線用完時，借用方會等待 (最多 timeout 秒)，而不是直接報錯
+    - 借出前做健康檢查：已斷線的連線直接丟棄；閒置超過 check_idle 秒的連線先跑 SELECT 1
+    - stats() 回傳 使用中 / 等待中 / 累計建立 等數據，方便依實際急診負載調整大小
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=30.0, check_idle=30.0, **conn_params):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"連線池大小設定錯誤: min={minconn}, max={maxconn}")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._conn_params = conn_params
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, 歸還時間)]，後進先出
+        self._in_use = set()
+        self._waiting = 0
+        self._opening = 0        # 正在建立中的連線數 (已佔用名額)
+        self._closed = False
+        self._stats = {"created": 0, "discarded": 0, "checkouts": 0, "timeouts": 0}
+
+        for _ in range(minconn):
+            conn = self._connect()
+            if conn is None:
+                break
+            self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        """建立一條新連線；失敗 (含連線設定錯誤，例如 DB_PORT 不是數字) 時印出錯誤並回傳 None"""
+        try:
+            conn = psycopg2.connect(**(self._conn_params or _connection_params()))
+        except Exception as e:
+            print(f"❌ 資料庫連線失敗: {e}")
+            return None
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        """檢查連線是否可用：已關閉或交易狀態異常就丟棄，閒置太久則實際 ping 一次"""
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reserve(self):
+        """
+        在鎖內保留一個名額：回傳 (閒置連線, 閒置起始時間) 或 (None, None) 代表可新建連線。
+        連線池已滿時等待，逾時則丟出 TimeoutError。
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("連線池已關閉")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        self._in_use.add(conn)
+                        return conn, idle_since
+                    if len(self._in_use) + self._opening < self.maxconn:
+                        self._opening += 1
+                        return None, None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise TimeoutError
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def getconn(self):
+        """借出一條連線；等待逾時或無法建立連線時回傳 None"""
+        while True:
+            try:
+                conn, idle_since = self._reserve()
+            except TimeoutError:
+                print(f"❌ 取得資料庫連線逾時 ({self.timeout} 秒)，連線池已滿 ({self.maxconn})")
+                return None
+
+            if conn is not None:
+                # 健康檢查在鎖外進行，避免 ping 時擋住其他執行緒
+                if self._is_healthy(conn, idle_since):
+                    with self._cond:
+                        self._stats["checkouts"] += 1
+                    return conn
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+
+            # 建立新連線同樣在鎖外進行 (TCP + 認證交握可能很慢)；
+            # 不論成功與否都要釋放保留的名額，否則連線池會逐漸被佔滿
+            conn = None
+            try:
+                conn = self._connect()
+            finally:
+                with self._cond:
+                    self._opening -= 1
+                    if conn is None:
+                        self._cond.notify()
+                    else:
+                        self._in_use.add(conn)
+                        self._stats["checkouts"] += 1
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """歸還連線；discard=True 或連線已壞時直接關閉"""
+        with self._cond:
+            self._in_use.discard(conn)
+            if discard or self._closed or conn.closed:
+                self._discard(conn)
+            else:
+                # 歸還前確保沒有殘留的交易
+                try:
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    self._idle.append((conn, time.monotonic()))
+                except psycopg2.Error:
+                    self._discard(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        以 with 區塊借用連線，離開區塊時自動歸還。
+        區塊內發生例外會先 rollback；取不到連線時 yield None。
+        """
+        conn = self.getconn()
+        if conn is None:
+            yield None
+            return
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self):
+        """回傳連線池目前狀態"""
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": len(self._in_use) + self._opening,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                **self._stats,
+            }
+
+    def closeall(self):
+        """關閉所有閒置連線，之後不再借出"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+# 全域連線池 (同一個 Streamlit 行程內所有 session 共用)
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """取得全域連線池 (第一次呼叫時依 .env 設定建立)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                    check_idle=float(os.getenv("DB_POOL_CHECK_IDLE", "30")),
+                )
+    return _pool
+
+@contextmanager
+def pooled_connection():
+    """
+    從全域連線池借用連線的捷徑。
+
+    用法：
+        with pooled_connection() as conn:
+            if not conn: return None
+            ...
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
+def get_pool_stats():
+    """回傳全域連線池狀態 (尚未建立時回傳 None)"""
+    return _pool.stats() if _pool is not None else None
+
 if __name__ == '__main__':
     print("--- 正在測試 Railway 資料庫連線 ---")
-    
+
     # 呼叫連線函數
     conn = get_db_connection()
-    
+
     if conn:
         print("✅ 連線成功！ (Connection Successful)")
-        
+
         # 進一步測試：嘗試查詢資料庫版本，確保不只是連上，還能執行指令
         try:
             with conn.cursor() as cur:
@@ -49,10 +291,17 @@ if __name__ == '__main__':
         finally:
             conn.close()
             print("--- 連線測試結束，連線已關閉 ---")
+
+        # 測試連線池：借出 / 歸還後應重複使用同一條連線
+        with pooled_connection() as c1:
+            first_id = id(c1)
+        with pooled_connection() as c2:
+            print(f"ℹ️  連線池重複使用連線: {id(c2) == first_id}")
+        print(f"ℹ️  連線池狀態: {get_pool_stats()}")
     else:
         print("❌ 連線失敗。")
         print("請檢查您的 .env 檔案內容：")
         print(f"Host: {os.getenv('DB_HOST')}")
         print(f"Port: {os.getenv('DB_PORT')}")
         print(f"User: {os.getenv('DB_USER')}")
-        print("Password: (已隱藏)")
\ No newline at end of file
+        print("Password: (已隱藏)")
@@ -0,0 +1,202 @@
+# /db/migrations.py
+#
+# 資料庫結構版本管理 + 查詢計畫檢查。
+#
+# 用法：
+#   python -m db.migrations migrate     # 套用 sql/migrations/ 下尚未套用的版本
+#   python -m db.migrations status      # 顯示各版本套用狀態
+#   python -m db.migrations check       # EXPLAIN 熱門查詢，確認仍走預期的索引
+
+import sys
+import os
+import re
+import psycopg2
+
+# 路徑修正區塊
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from db.db_connector import get_db_connection
+from db.patient_service import HISTORY_SOURCES, LATEST_ENCOUNTER, _build_history_sql
+
+MIGRATIONS_DIR = os.path.join(parent_dir, 'sql', 'migrations')
+
+# ==========================================
+# 1. 版本管理
+# ==========================================
+def load_migrations():
+    """讀取 sql/migrations/NNN_名稱.sql，依版本號排序回傳 [(version, name, sql)]"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r'^(\d+)_(.+)\.sql$', filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), 'r', encoding='utf-8') as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+    return migrations
+
+def _ensure_version_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+
+def get_applied_versions(conn):
+    with conn.cursor() as cur:
+        _ensure_version_table(cur)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+def migrate(target_version=None):
+    """
+    依序套用尚未套用的 migration，每個版本各自一個交易 (失敗時該版本整個 rollback 並停止)。
+    回傳這次套用的版本清單；連線失敗回傳 None。
+    """
+    conn = get_db_connection()
+    if not conn: return None
+
+    applied_now = []
+    try:
+        applied = get_applied_versions(conn)
+        for version, name, sql in load_migrations():
+            if version in applied:
+                continue
+            if target_version is not None and version > target_version:
+                break
+            print(f"--- 套用 migration {version:03d}_{name} ---")
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                                (version, name))
+                conn.commit()
+                applied_now.append(version)
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"❌ migration {version:03d}_{name} 失敗: {e}")
+                break
+        if not applied_now:
+            print("資料庫結構已是最新版本。")
+        return applied_now
+    finally:
+        conn.close()
+
+def print_status():
+    conn = get_db_connection()
+    if not conn: return
+    try:
+        applied = get_applied_versions(conn)
+        for version, name, _ in load_migrations():
+            mark = "✅" if version in applied else "⏳"
+            print(f"{mark} {version:03d}_{name}")
+    finally:
+        conn.close()
+
+# ==========================================
+# 2. 查詢計畫檢查 (EXPLAIN)
+# ==========================================
+# 每個病史來源預期使用的索引
+EXPECTED_INDEXES = {
+    "nursing": "ix_ensdata_patid_procdttm",
+    "vitals": "ix_vitals_patid_procdttm",
+    "labs": "ix_labdata_chmrno_chrcpdtm",
+}
+
+# 依就診撈取 (app 預設為最近一次就診) 預期使用的索引 (009_encounter_indexes.sql)；
+# 多個索引都算通過時寫成 tuple：生命徵象的合併鍵索引 (TRINO, PROCDTTM) 同樣以急診號開頭、依時間排序，
+# 資料量小時規劃器會選用這個較窄的索引
+ENCOUNTER_EXPECTED_INDEXES = {
+    "nursing": "ix_ensdata_patid_trino_procdttm",
+    "vitals": ("ix_vitals_patid_trino_procdttm", "ix_vitals_merge_key"),
+    "labs": "ix_labdata_chmrno_caseno_chrcpdtm",
+}
+
+INDEX_NODE_TYPES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+def _walk_plan(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk_plan(child)
+
+def _find_scans(plan, table):
+    """找出計畫中讀取 table 的節點 (Bitmap Heap Scan 底下的 Bitmap Index Scan 也算)"""
+    table = table.lower()
+    scans = []
+    for node in _walk_plan(plan):
+        if node.get("Relation Name", "").lower() == table:
+            scans.append(node)
+            # Bitmap Heap Scan 的索引資訊在子節點
+            scans.extend(n for n in _walk_plan(node) if n.get("Node Type") == "Bitmap Index Scan")
+    return scans
+
+def check_query_plans(patient_id='0002452972', start_time='20250101000000', end_time=None, strict=False):
+    """
+    對 patient_service 的熱門查詢執行 EXPLAIN，確認每個來源都走預期的索引。
+    除了「病患 + 時間範圍」，也檢查依就診撈取的兩種形狀：最近一次就診 (LATEST_ENCOUNTER 子查詢)
+    與指定急診號 (取該病患最近一次就診的急診號代入)。
+
+    資料量很小時 (例如只匯入樣本檔)，規劃器會合理地選擇循序掃描；
+    因此預設 (strict=False) 先關閉 enable_seqscan，檢查的是「查詢形狀仍能使用該索引」。
+    在正式資料量的環境可用 strict=True，直接檢查實際會選用的計畫。
+
+    回傳失敗清單 [(來源[@急診號], 說明)]；全部通過回傳空清單，連線失敗回傳 None。
+    """
+    conn = get_db_connection()
+    if not conn: return None
+
+    failures = []
+    try:
+        with conn.cursor() as cur:
+            if not strict:
+                cur.execute("SET LOCAL enable_seqscan = off")
+            checks = [(source, None, index) for source, index in EXPECTED_INDEXES.items()]
+            checks += [(source, LATEST_ENCOUNTER, index) for source, index in ENCOUNTER_EXPECTED_INDEXES.items()]
+            cur.execute("SELECT latest_trino FROM patient_overview WHERE PATID = %s", (patient_id,))
+            row = cur.fetchone()
+            if row and row[0]:
+                checks += [(source, row[0], index) for source, index in ENCOUNTER_EXPECTED_INDEXES.items()]
+            else:
+                print(f"⚠️  patient_overview 查無病患 {patient_id} 的就診，略過指定急診號的檢查")
+
+            for source, encounter_id, expected in checks:
+                expected = (expected,) if isinstance(expected, str) else expected
+                table = HISTORY_SOURCES[source][0]
+                label = f"{source}@{encounter_id}" if encounter_id else source
+                sql, params = _build_history_sql(source, patient_id, start_time, end_time, encounter_id=encounter_id)
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, tuple(params))
+                plan = cur.fetchone()[0][0]["Plan"]
+                scans = _find_scans(plan, table)
+                used = [n.get("Index Name") for n in scans if n.get("Node Type") in INDEX_NODE_TYPES]
+                matched = [index for index in expected if index in used]
+                if matched:
+                    node_types = sorted({n["Node Type"] for n in scans})
+                    print(f"✅ {label:<20} {table:<20} -> {matched[0]} ({', '.join(node_types)})")
+                else:
+                    expected_text = " / ".join(expected)
+                    node_types = sorted({n.get("Node Type") for n in scans})
+                    failures.append((label, f"預期使用 {expected_text}，實際為 {', '.join(node_types) or '無'} {used}"))
+                    print(f"❌ {label:<20} {table:<20} 未使用 {expected_text}: {node_types} {used}")
+        conn.rollback()
+        return failures
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command == 'migrate':
+        migrate()
+    elif command == 'status':
+        print_status()
+    elif command == 'check':
+        failures = check_query_plans(strict='--strict' in sys.argv)
+        if failures is None or failures:
+            sys.exit(1)
+    else:
+        print(f"未知的指令: {command} (可用: migrate / status / check)")
+        sys.exit(2)
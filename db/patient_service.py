@@ -2,17 +2,190 @@
 
 import sys
 import os
+import json
+import hashlib
 import psycopg2
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # 路徑修正區塊
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from db.db_connector import get_db_connection
+from db.db_connector import pooled_connection
 from data.metadata import get_chinese_name
 
-def get_patient_full_history(patient_id, start_time=None, end_time=None):
+# ==========================================
+# 查詢定義：三個資料來源的欄位 / 篩選欄位 / 轉換方式
+# ==========================================
+# 每個來源： (資料表, 病歷號欄位, 時間欄位, SELECT 欄位)
+HISTORY_SOURCES = {
+    "nursing": ("ENSDATA", "PATID", "PROCDTTM",
+                ["PROCDTTM", "SUBJECT", "DIAGNOSIS"]),
+    "vitals": ("v_ai_hisensnes", "PATID", "PROCDTTM",
+               ["PROCDTTM", "ETEMPUTER", "EPLUSE", "EBREATHE", "EPRESSURE", "EDIASTOLIC", "ESAO2",
+                "GCS_E", "GCS_V", "GCS_M"]),
+    "labs": ("DB_ADM_LABDATA_ER", "CHMRNO", "CHRCPDTM",
+             ["CHRCPDTM", "CHHEAD", "CHVAL", "CHUNIT", "CHNL", "CHNH", "CHVAL_NUM", "LAB_FLAG"]),
+}
+
+# 每個來源的急診號 (就診) 欄位；檢驗的 CHAD1CASENO 與 TRINO 相同
+ENCOUNTER_COLUMNS = {"nursing": "TRINO", "vitals": "TRINO", "labs": "CHAD1CASENO"}
+# encounter_id 傳入此值時，取病患最近一次就診 (patient_overview.latest_trino)
+LATEST_ENCOUNTER = "latest"
+
+# 支援的撈取模式
+#   sequential : 舊版行為，一條連線依序執行三個查詢 (3 次往返)
+#   single     : 三個結果集合併成一個 SQL，一次往返取回 (以 json_agg 打包)
+#   concurrent : 從連線池借三條連線，三個查詢同時執行
+#   stream     : 伺服器端游標分段讀取，每次往返 HISTORY_ITERSIZE 筆，不會先 fetchall 整批列再轉 dict
+FETCH_MODES = ("sequential", "single", "concurrent", "stream")
+
+# 伺服器端游標 (named cursor) 每次往返取回的筆數
+HISTORY_ITERSIZE = int(os.getenv("HISTORY_ITERSIZE", "2000"))
+
+# 檢驗資料的範圍 (在資料庫端篩選，只把需要的列傳回來)
+#   all          : 全部檢驗
+#   abnormal     : 只取異常 (H / L / HH / LL / A；LAB_FLAG 見 sql/migrations/006_lab_flags.sql)
+#   latest       : 每個檢驗項目只取最新一筆
+#   first_latest : 每個檢驗項目取第一筆與最新一筆 (只驗一次的項目只有一筆)
+#   changed      : 只取數值有變化的項目，且只留與前一次不同的那幾筆 (含第一筆)
+LAB_MODES = ("all", "abnormal", "latest", "first_latest", "changed")
+
+# 各模式的子查詢；{base} 為時間範圍內的檢驗列 (含 CHMRNO、CHITEMNO 與 HISTORY_SOURCES 的欄位)
+# 以 (CHMRNO, CHITEMNO) 分組，單一病患與批次撈取共用
+LAB_MODE_QUERIES = {
+    "all": None,
+    "abnormal": "SELECT * FROM ({base}) b WHERE LAB_FLAG <> 'N'",
+    # 排序方向與 ix_labdata_chmrno_item_time 相反，直接反向掃描索引，每組第一筆就是最新的一筆
+    "latest": """
+        SELECT DISTINCT ON (CHMRNO, CHITEMNO) * FROM ({base}) b
+        ORDER BY CHMRNO DESC, CHITEMNO DESC, CHRCPDTM DESC""",
+    "first_latest": """
+        SELECT * FROM (
+            SELECT b.*,
+                   row_number() OVER (PARTITION BY CHMRNO, CHITEMNO ORDER BY CHRCPDTM ASC) AS rn_first,
+                   row_number() OVER (PARTITION BY CHMRNO, CHITEMNO ORDER BY CHRCPDTM DESC) AS rn_last
+            FROM ({base}) b
+        ) x WHERE rn_first = 1 OR rn_last = 1""",
+    # 數值以 CHVAL_NUM 比較 (1.0 與 1.00 視為相同)，非數值結果比對字串
+    "changed": """
+        SELECT * FROM (
+            SELECT b.*,
+                   v IS DISTINCT FROM lag(v) OVER w AS value_changed,
+                   min(v) OVER p IS DISTINCT FROM max(v) OVER p AS item_changed
+            FROM (SELECT b0.*, COALESCE(trim_scale(CHVAL_NUM)::text, btrim(CHVAL)) AS v FROM ({base}) b0) b
+            WINDOW p AS (PARTITION BY CHMRNO, CHITEMNO), w AS (p ORDER BY CHRCPDTM)
+        ) x WHERE item_changed AND value_changed""",
+}
+
+def _nursing_row(row):
+    return {
+        "PROCDTTM": row[0],
+        "SUBJECT": row[1],
+        "DIAGNOSIS": row[2]
+    }
+
+def _vitals_row(row):
+    return {
+        "PROCDTTM": row[0],
+        "ETEMPUTER": row[1],
+        "EPLUSE": row[2],
+        "EBREATHE": row[3],
+        "EPRESSURE": row[4],
+        "EDIASTOLIC": row[5],
+        "ESAO2": row[6],
+        "GCS": f"E{row[7]}V{row[8]}M{row[9]}"
+    }
+
+def _labs_row(row):
+    return {
+        "CHRCPDTM": row[0],
+        "CHHEAD": row[1],
+        "CHVAL": row[2],
+        "CHUNIT": row[3],
+        "REF_RANGE": f"{row[4]}~{row[5]}",
+        "VALUE": float(row[6]) if row[6] is not None else None,
+        "FLAG": row[7]
+    }
+
+ROW_BUILDERS = {
+    "nursing": _nursing_row,
+    "vitals": _vitals_row,
+    "labs": _labs_row,
+}
+
+def _build_where(id_col, time_col, patient_id, start_time=None, end_time=None, after=None,
+                 encounter_col=None, encounter_id=None):
+    """
+    組出 WHERE 條件與參數 (動態加入就診與時間篩選；after 為含端點的下限，增量撈取用)。
+    encounter_id 為 LATEST_ENCOUNTER 時以子查詢取最近一次就診，不必多一次往返。
+    """
+    where = f"{id_col} = %s"
+    params = [patient_id]
+    if encounter_id == LATEST_ENCOUNTER:
+        where += f" AND {encounter_col} = (SELECT latest_trino FROM patient_overview WHERE PATID = %s)"
+        params.append(patient_id)
+    elif encounter_id:
+        where += f" AND {encounter_col} = %s"
+        params.append(encounter_id)
+    if start_time:
+        where += f" AND {time_col} >= %s"
+        params.append(start_time)
+    if after:
+        # 含端點：與水位同一時間、較晚才寫入的紀錄也要撈到，已涵蓋的由 row_fingerprint 排除
+        where += f" AND {time_col} >= %s"
+        params.append(after)
+    if end_time:
+        where += f" AND {time_col} <= %s"
+        params.append(end_time)
+    return where, params
+
+def _source_relation(source, where, lab_mode="all", prefix=""):
+    """
+    FROM 後面的資料來源：一般為「資料表 WHERE 條件」；檢驗在 all 以外的模式包成 LAB_MODE_QUERIES 的子查詢。
+    prefix 為資料表別名 (批次查詢用 "t."，其 JOIN 寫在 where 中)。
+    """
+    table, id_col, _, columns = HISTORY_SOURCES[source]
+    template = LAB_MODE_QUERIES[lab_mode] if source == "labs" else None
+    if not template:
+        return f"{table} {where}"
+    select_cols = ", ".join(f"{prefix}{c}" for c in [id_col, "CHITEMNO"] + columns)
+    base = f"SELECT {select_cols} FROM {table} {where}"
+    return f"({template.format(base=base)}) AS labs"
+
+def _build_history_sql(source, patient_id, start_time=None, end_time=None, lab_mode="all", encounter_id=None):
+    """單一來源的 SELECT ... ORDER BY 時間 查詢"""
+    table, id_col, time_col, columns = HISTORY_SOURCES[source]
+    where, params = _build_where(id_col, time_col, patient_id, start_time, end_time,
+                                 encounter_col=ENCOUNTER_COLUMNS[source], encounter_id=encounter_id)
+    relation = _source_relation(source, f"WHERE {where}", lab_mode)
+    sql = f"SELECT {', '.join(columns)} FROM {relation} ORDER BY {time_col} ASC"
+    return sql, params
+
+def _build_combined_history_sql(patient_id, start_time=None, end_time=None, lab_mode="all", after=None,
+                                encounter_id=None):
+    """
+    把三個來源合併為一個 SQL：每個來源用 json_agg 打包成一個 JSON 陣列，
+    一次往返就拿到全部結果。每列以 json_build_array 保留欄位順序，可直接沿用 ROW_BUILDERS。
+    after: (選用) {來源: 時間}，只取該時間 (含) 之後的紀錄
+    """
+    parts = []
+    params = []
+    after = after or {}
+    for source, (table, id_col, time_col, columns) in HISTORY_SOURCES.items():
+        where, p = _build_where(id_col, time_col, patient_id, start_time, end_time, after.get(source),
+                                ENCOUNTER_COLUMNS[source], encounter_id)
+        parts.append(f"""
+            (SELECT COALESCE(json_agg(json_build_array({', '.join(columns)}) ORDER BY {time_col} ASC), '[]'::json)
+             FROM {_source_relation(source, f"WHERE {where}", lab_mode)}) AS {source}""")
+        params.extend(p)
+    return "SELECT " + ",".join(parts), params
+
+def get_patient_full_history(patient_id, start_time=None, end_time=None, fetch_mode="single", lab_mode="all",
+                             encounter_id=None):
     """
     根據病歷號及時間範圍，從資料庫撈取病患的所有急診相關數據。
     回傳的字典 Key 統一使用英文欄位名稱，以配合 ai_summarizer 使用。
@@ -21,122 +194,331 @@ def get_patient_full_history(patient_id, start_time=None, end_time=None):
         patient_id (str): 病歷號
         start_time (str, optional): 篩選起始時間 (YYYYMMDDHHMMSS)
         end_time (str, optional): 篩選結束時間
+        fetch_mode (str): 撈取模式，見 FETCH_MODES (預設 single：一次往返取回三個結果集)
+        lab_mode (str): 檢驗資料範圍，見 LAB_MODES (預設 all)
+        encounter_id (str, optional): 只取這次就診 (急診號 TRINO / CHAD1CASENO) 的資料；
+            LATEST_ENCOUNTER 為最近一次就診，None 為所有就診 (見 list_patient_encounters)
     """
-    conn = get_db_connection()
-    if not conn:
-        print("無法建立連線，無法查詢病患資料。")
-        return None
+    if fetch_mode not in FETCH_MODES:
+        raise ValueError(f"不支援的撈取模式: {fetch_mode} (可用: {', '.join(FETCH_MODES)})")
+    if lab_mode not in LAB_MODES:
+        raise ValueError(f"不支援的檢驗模式: {lab_mode} (可用: {', '.join(LAB_MODES)})")
 
-    patient_data = {
-        "nursing": [],
-        "vitals": [],
-        "labs": []
-    }
+    print(f"正在查詢病患 {patient_id} 的急診資料 (模式: {fetch_mode})...")
+
+    if fetch_mode == "concurrent":
+        patient_data = _fetch_patient_history_concurrent(patient_id, start_time, end_time, lab_mode, encounter_id)
+    else:
+        with pooled_connection() as conn:
+            if not conn:
+                print("無法建立連線，無法查詢病患資料。")
+                return None
+            if fetch_mode == "single":
+                patient_data = _fetch_patient_history_single(conn, patient_id, start_time, end_time, lab_mode,
+                                                             encounter_id=encounter_id)
+            elif fetch_mode == "stream":
+                patient_data = _fetch_patient_history_stream(conn, patient_id, start_time, end_time, lab_mode,
+                                                             encounter_id)
+            else:
+                patient_data = _fetch_patient_history(conn, patient_id, start_time, end_time, lab_mode,
+                                                      encounter_id)
+
+    if patient_data is not None:
+        print(f"查詢完成 (就診: {encounter_id or '全部'} | 時間範圍: {start_time if start_time else '不限'} ~ "
+              f"{end_time if end_time else '不限'})")
+    return patient_data
 
+def row_fingerprint(row):
+    """紀錄內容的指紋 (來源資料沒有流水號；同一時間的紀錄以內容區分)"""
+    payload = json.dumps(row, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+def get_patient_history_since(patient_id, high_water, start_time=None, end_time=None, lab_mode="all",
+                              encounter_id=None, seen=None):
+    """
+    增量撈取：只取各來源時間不早於 high_water 的紀錄 (走 病歷號 + 時間 索引的範圍掃描)，一次往返；
+    與水位同一時間的紀錄扣掉 seen 中已涵蓋的，晚到的同分鐘紀錄不會漏掉。
+
+    Args:
+        high_water (dict): {"nursing": 時間, "vitals": 時間, "labs": 時間}；某來源為 None 時取該來源全部
+        seen (dict, optional): {來源: [row_fingerprint, ...]}，水位時間上已涵蓋的紀錄 (可重複，依筆數扣除)
+        其餘參數同 get_patient_full_history
+    Returns:
+        與 get_patient_full_history 相同格式 (只含新紀錄)；查詢失敗時回傳 None
+    """
+    if lab_mode not in LAB_MODES:
+        raise ValueError(f"不支援的檢驗模式: {lab_mode} (可用: {', '.join(LAB_MODES)})")
+
+    with pooled_connection() as conn:
+        if not conn:
+            print("無法建立連線，無法查詢病患資料。")
+            return None
+        patient_data = _fetch_patient_history_single(conn, patient_id, start_time, end_time, lab_mode, high_water,
+                                                     encounter_id)
+
+    if patient_data is not None:
+        seen = seen or {}
+        for source, rows in patient_data.items():
+            time_col = HISTORY_SOURCES[source][2]
+            covered = Counter(seen.get(source) or [])
+            kept = []
+            for row in rows:
+                if row[time_col] == high_water.get(source):
+                    fingerprint = row_fingerprint(row)
+                    if covered[fingerprint] > 0:
+                        covered[fingerprint] -= 1
+                        continue
+                kept.append(row)
+            patient_data[source] = kept
+        print(f"增量查詢病患 {patient_id}：新增 " + "、".join(f"{s} {len(rows)}" for s, rows in patient_data.items()) + " 筆")
+    return patient_data
+
+def _fetch_patient_history(conn, patient_id, start_time=None, end_time=None, lab_mode="all", encounter_id=None):
+    """sequential 模式：使用已借出的連線，依序執行三個查詢 (護理 / 生理 / 檢驗)"""
+    patient_data = {source: [] for source in HISTORY_SOURCES}
     try:
         with conn.cursor() as cur:
-            # ==========================================
-            # 1. 護理紀錄 (時間欄位: PROCDTTM)
-            # ==========================================
-            print(f"正在查詢病患 {patient_id} 的護理紀錄...")
-            
-            # 基礎 SQL
-            sql_nursing = "SELECT PROCDTTM, SUBJECT, DIAGNOSIS FROM ENSDATA WHERE PATID = %s"
-            params_nursing = [patient_id]
-
-            # 動態加入時間篩選
-            if start_time:
-                sql_nursing += " AND PROCDTTM >= %s"
-                params_nursing.append(start_time)
-            if end_time:
-                sql_nursing += " AND PROCDTTM <= %s"
-                params_nursing.append(end_time)
-            
-            sql_nursing += " ORDER BY PROCDTTM ASC"
-
-            cur.execute(sql_nursing, tuple(params_nursing))
-            rows = cur.fetchall()
-            for row in rows:
-                patient_data["nursing"].append({
-                    "PROCDTTM": row[0],
-                    "SUBJECT": row[1],
-                    "DIAGNOSIS": row[2]
-                })
-
-            # ==========================================
-            # 2. 生理監測 (時間欄位: PROCDTTM)
-            # ==========================================
-            print(f"正在查詢病患 {patient_id} 的生理監測數據...")
-            
-            sql_vitals = """
-                SELECT PROCDTTM, ETEMPUTER, EPLUSE, EBREATHE, EPRESSURE, EDIASTOLIC, ESAO2, 
-                       GCS_E, GCS_V, GCS_M
-                FROM v_ai_hisensnes WHERE PATID = %s
-            """
-            params_vitals = [patient_id]
-
-            if start_time:
-                sql_vitals += " AND PROCDTTM >= %s"
-                params_vitals.append(start_time)
-            if end_time:
-                sql_vitals += " AND PROCDTTM <= %s"
-                params_vitals.append(end_time)
-            
-            sql_vitals += " ORDER BY PROCDTTM ASC"
-
-            cur.execute(sql_vitals, tuple(params_vitals))
-            rows = cur.fetchall()
-            for row in rows:
-                patient_data["vitals"].append({
-                    "PROCDTTM": row[0],
-                    "ETEMPUTER": row[1],
-                    "EPLUSE": row[2],
-                    "EBREATHE": row[3],
-                    "EPRESSURE": row[4],
-                    "EDIASTOLIC": row[5],
-                    "ESAO2": row[6],
-                    "GCS": f"E{row[7]}V{row[8]}M{row[9]}"
-                })
-
-            # ==========================================
-            # 3. 檢驗結果 (時間欄位: CHRCPDTM)
-            # ==========================================
-            print(f"正在查詢病患 {patient_id} 的檢驗報告...")
-            
-            sql_labs = """
-                SELECT CHRCPDTM, CHHEAD, CHVAL, CHUNIT, CHNL, CHNH
-                FROM DB_ADM_LABDATA_ER WHERE CHMRNO = %s
-            """
-            params_labs = [patient_id]
-
-            if start_time:
-                sql_labs += " AND CHRCPDTM >= %s"
-                params_labs.append(start_time)
-            if end_time:
-                sql_labs += " AND CHRCPDTM <= %s"
-                params_labs.append(end_time)
-            
-            sql_labs += " ORDER BY CHRCPDTM ASC"
-
-            cur.execute(sql_labs, tuple(params_labs))
-            rows = cur.fetchall()
-            for row in rows:
-                patient_data["labs"].append({
-                    "CHRCPDTM": row[0],
-                    "CHHEAD": row[1],
-                    "CHVAL": row[2],
-                    "CHUNIT": row[3],
-                    "REF_RANGE": f"{row[4]}~{row[5]}"
-                })
-
-        print(f"查詢完成 (時間範圍: {start_time if start_time else '不限'} ~ {end_time if end_time else '不限'})")
+            for source, build_row in ROW_BUILDERS.items():
+                sql, params = _build_history_sql(source, patient_id, start_time, end_time, lab_mode, encounter_id)
+                cur.execute(sql, tuple(params))
+                patient_data[source] = [build_row(row) for row in cur.fetchall()]
         return patient_data
 
     except psycopg2.Error as e:
         print(f"資料庫查詢失敗: {e}")
         return None
-    finally:
-        conn.close()
+
+def _fetch_patient_history_single(conn, patient_id, start_time=None, end_time=None, lab_mode="all", after=None,
+                                  encounter_id=None):
+    """single 模式：三個結果集在同一個 SQL 內以 JSON 陣列回傳，只需一次往返"""
+    sql, params = _build_combined_history_sql(patient_id, start_time, end_time, lab_mode, after, encounter_id)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, tuple(params))
+            row = cur.fetchone()
+        # psycopg2 會自動把 json 欄位轉成 Python list
+        return {
+            source: [build_row(r) for r in (row[i] or [])]
+            for i, (source, build_row) in enumerate(ROW_BUILDERS.items())
+        }
+
+    except psycopg2.Error as e:
+        print(f"資料庫查詢失敗: {e}")
+        return None
+
+def _iter_source(conn, source, patient_id, start_time=None, end_time=None, lab_mode="all", encounter_id=None,
+                 itersize=HISTORY_ITERSIZE):
+    """以伺服器端游標逐筆產出單一來源的紀錄 (每次往返 itersize 筆)，讀完或中途關閉時釋放游標"""
+    sql, params = _build_history_sql(source, patient_id, start_time, end_time, lab_mode, encounter_id)
+    build_row = ROW_BUILDERS[source]
+    with conn.cursor(name=f"history_{source}") as cur:
+        cur.itersize = itersize
+        cur.execute(sql, tuple(params))
+        for row in cur:
+            yield build_row(row)
+
+def _fetch_patient_history_stream(conn, patient_id, start_time=None, end_time=None, lab_mode="all",
+                                  encounter_id=None):
+    """stream 模式：三個來源依序以伺服器端游標讀取，每批轉成 dict 後即丟棄原始列"""
+    try:
+        return {
+            source: list(_iter_source(conn, source, patient_id, start_time, end_time, lab_mode, encounter_id))
+            for source in HISTORY_SOURCES
+        }
+    except psycopg2.Error as e:
+        print(f"資料庫查詢失敗: {e}")
+        return None
+
+@contextmanager
+def stream_patient_history(patient_id, start_time=None, end_time=None, lab_mode="all", encounter_id=None,
+                           itersize=HISTORY_ITERSIZE):
+    """
+    串流撈取單一病患的急診資料：產出 {"nursing", "vitals", "labs"}，每個值都是依時間排序的 generator。
+    三個來源各開一個伺服器端游標，消費多少才從資料庫讀多少 (每次往返 itersize 筆)，
+    記憶體用量與監測筆數無關；可交給 ai/timeline.iter_timeline 合併、ai/vitals_trend 計算趨勢。
+
+    用法：
+        with stream_patient_history(patient_id) as streams:
+            if not streams: return None
+            for item in streams["vitals"]: ...
+
+    各 generator 只能在 with 區塊內讀取，且只能讀一次；離開 with 時關閉游標並歸還連線。
+    讀取中途查詢失敗時會拋出 psycopg2.Error (不會默默回傳不完整的資料)。參數同 get_patient_full_history。
+    """
+    if lab_mode not in LAB_MODES:
+        raise ValueError(f"不支援的檢驗模式: {lab_mode} (可用: {', '.join(LAB_MODES)})")
+
+    with pooled_connection() as conn:
+        if not conn:
+            print("無法建立連線，無法查詢病患資料。")
+            yield None
+            return
+        streams = {
+            source: _iter_source(conn, source, patient_id, start_time, end_time, lab_mode, encounter_id, itersize)
+            for source in HISTORY_SOURCES
+        }
+        try:
+            yield streams
+        finally:
+            # 尚未讀完的 generator 先關閉 (連帶關閉游標)，再歸還連線
+            for stream in streams.values():
+                stream.close()
+
+def _fetch_one_source(source, patient_id, start_time=None, end_time=None, lab_mode="all", encounter_id=None):
+    """concurrent 模式的工作單元：自行借一條連線查詢單一來源"""
+    with pooled_connection() as conn:
+        if not conn:
+            return None
+        sql, params = _build_history_sql(source, patient_id, start_time, end_time, lab_mode, encounter_id)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, tuple(params))
+                build_row = ROW_BUILDERS[source]
+                return [build_row(row) for row in cur.fetchall()]
+        except psycopg2.Error as e:
+            print(f"資料庫查詢失敗 ({source}): {e}")
+            return None
+
+def _fetch_patient_history_concurrent(patient_id, start_time=None, end_time=None, lab_mode="all",
+                                      encounter_id=None):
+    """concurrent 模式：三個查詢分別在不同連線上同時執行，總延遲約等於最慢的那一個"""
+    with ThreadPoolExecutor(max_workers=len(HISTORY_SOURCES)) as executor:
+        futures = {
+            source: executor.submit(_fetch_one_source, source, patient_id, start_time, end_time, lab_mode,
+                                    encounter_id)
+            for source in HISTORY_SOURCES
+        }
+        patient_data = {source: future.result() for source, future in futures.items()}
+
+    if any(rows is None for rows in patient_data.values()):
+        print("無法建立連線或查詢失敗，無法查詢病患資料。")
+        return None
+    return patient_data
+
+# ==========================================
+# 多病患批次撈取 (交班時一次載入整個病區)
+# ==========================================
+def _build_batch_history_sql(source, lab_mode="all"):
+    """
+    單一來源的批次查詢：以 unnest 展開 (病歷號, 起, 迄) 陣列後 JOIN，
+    每位病患可有各自的時間範圍與就診 (急診號為 NULL 表示所有就診)，而查詢數量固定為 1，不隨病患人數增加。
+    結果依病歷號 (COLLATE "C"，與 Python 字串排序一致) + 時間排序，方便逐位病患串流。
+    """
+    table, id_col, time_col, columns = HISTORY_SOURCES[source]
+    where = f"""t
+        JOIN unnest(%s::text[], %s::text[], %s::text[], %s::text[]) AS w(pid, start_time, end_time, encounter)
+          ON t.{id_col} = w.pid
+        WHERE (w.encounter IS NULL OR t.{ENCOUNTER_COLUMNS[source]} = w.encounter)
+          AND (w.start_time IS NULL OR t.{time_col} >= w.start_time)
+          AND (w.end_time IS NULL OR t.{time_col} <= w.end_time)"""
+    relation = _source_relation(source, where, lab_mode, prefix="t.")
+    alias = "labs" if relation.endswith("AS labs") else "t"
+    select_cols = ", ".join(f"{alias}.{c}" for c in [id_col] + columns)
+    return f"""
+        SELECT {select_cols}
+        FROM {relation}
+        ORDER BY {alias}.{id_col} COLLATE "C" ASC, {alias}.{time_col} ASC
+    """
+
+def _group_by_patient(cur, build_row):
+    """把依病歷號排序的游標結果，逐位病患切成 (病歷號, [資料列]) 產生器"""
+    current_id = None
+    rows = []
+    for row in cur:
+        if row[0] != current_id:
+            if current_id is not None:
+                yield current_id, rows
+            current_id = row[0]
+            rows = []
+        rows.append(build_row(row[1:]))
+    if current_id is not None:
+        yield current_id, rows
+
+def _latest_encounters(cur, patient_ids):
+    """{病歷號: 最近一次就診的急診號} (來自 patient_overview)"""
+    cur.execute("SELECT PATID, latest_trino FROM patient_overview WHERE PATID = ANY(%s)", (list(patient_ids),))
+    return dict(cur.fetchall())
+
+def iter_patients_full_history(patient_ids, start_time=None, end_time=None, windows=None, itersize=HISTORY_ITERSIZE,
+                               lab_mode="all", encounters=None):
+    """
+    批次撈取多位病患的急診資料，逐位病患產出 (病歷號, {"nursing", "vitals", "labs"})。
+
+    三個來源各只執行一次查詢 (PATID = ANY 的形式)，並使用伺服器端游標分段讀取，
+    某位病患的資料到齊就立刻產出，不必等全部病患載入完畢，記憶體用量也只跟單一病患有關。
+
+    Args:
+        patient_ids (list[str]): 病歷號清單
+        start_time / end_time (str, optional): 共用的時間範圍
+        windows (dict, optional): 個別病患的時間範圍 {病歷號: (start_time, end_time)}，優先於共用範圍
+        itersize (int): 伺服器端游標每次往返取回的筆數
+        lab_mode (str): 檢驗資料範圍，見 LAB_MODES
+        encounters: 每位病患要撈的就診；LATEST_ENCOUNTER 為各自最近一次就診，
+            dict {病歷號: 急診號} 指定個別就診 (未列出的病患取所有就診)，None 為所有就診
+    """
+    if lab_mode not in LAB_MODES:
+        raise ValueError(f"不支援的檢驗模式: {lab_mode} (可用: {', '.join(LAB_MODES)})")
+    windows = windows or {}
+    ids = sorted(set(patient_ids))
+    if not ids:
+        return
+
+    starts = [windows.get(pid, (start_time, end_time))[0] for pid in ids]
+    ends = [windows.get(pid, (start_time, end_time))[1] for pid in ids]
+
+    with pooled_connection() as conn:
+        if not conn:
+            print("無法建立連線，無法批次查詢病患資料。")
+            return
+
+        print(f"正在批次查詢 {len(ids)} 位病患的急診資料...")
+        cursors = []
+        try:
+            if encounters == LATEST_ENCOUNTER:
+                with conn.cursor() as cur:
+                    encounters = _latest_encounters(cur, ids)
+                # 沒有總覽資料的病患不會有任何紀錄，以不存在的急診號佔位，避免退回成「所有就診」
+                encounter_ids = [encounters.get(pid) or "" for pid in ids]
+            else:
+                encounter_ids = [(encounters or {}).get(pid) for pid in ids]
+            streams = {}
+            for source, build_row in ROW_BUILDERS.items():
+                cur = conn.cursor(name=f"batch_{source}")
+                cur.itersize = itersize
+                cur.execute(_build_batch_history_sql(source, lab_mode), (ids, starts, ends, encounter_ids))
+                cursors.append(cur)
+                streams[source] = _group_by_patient(cur, build_row)
+
+            # 三個來源都依病歷號排序，依序對齊即可逐位病患產出
+            heads = {source: next(stream, None) for source, stream in streams.items()}
+            for pid in ids:
+                patient_data = {}
+                for source, stream in streams.items():
+                    head = heads[source]
+                    if head is not None and head[0] == pid:
+                        patient_data[source] = head[1]
+                        heads[source] = next(stream, None)
+                    else:
+                        patient_data[source] = []
+                yield pid, patient_data
+
+        except psycopg2.Error as e:
+            print(f"批次查詢失敗: {e}")
+        finally:
+            for cur in cursors:
+                try:
+                    cur.close()
+                except psycopg2.Error:
+                    pass  # 交易已中斷時 CLOSE 會失敗，歸還連線時會一併 rollback
+
+def get_patients_full_history(patient_ids, start_time=None, end_time=None, windows=None, lab_mode="all",
+                              encounters=None):
+    """
+    iter_patients_full_history 的非串流版本：回傳 {病歷號: {"nursing", "vitals", "labs"}}。
+    查詢失敗時，已取得的病患仍會回傳，其餘病患不會出現在結果中。
+    """
+    return dict(iter_patients_full_history(patient_ids, start_time, end_time, windows, lab_mode=lab_mode,
+                                           encounters=encounters))
 
 # ==========================================
 # 輔助函數：僅用於顯示時將 Key 轉為中文
@@ -157,46 +539,156 @@ def translate_to_chinese_view(data_list):
         view_list.append(new_item)
     return view_list
 
+# 病患清單每頁筆數
+OVERVIEW_PAGE_SIZE = 50
+
+# patient_overview 的最新生命徵象欄位 -> 對外 Key
+OVERVIEW_VITAL_COLUMNS = [
+    ("latest_vitals_time", "PROCDTTM"),
+    ("latest_temp", "ETEMPUTER"),
+    ("latest_pulse", "EPLUSE"),
+    ("latest_resp", "EBREATHE"),
+    ("latest_sbp", "EPRESSURE"),
+    ("latest_dbp", "EDIASTOLIC"),
+    ("latest_spo2", "ESAO2"),
+    ("latest_gcs", "GCS"),
+]
+
 def get_all_patients_overview():
     """
-    掃描資料庫 (以 ENSDATA 為主)，列出所有病患清單及其就診時間範圍。
+    列出最近的一頁病患清單 (相容舊介面，等同 get_patients_overview_page() 的第一頁)。
+    要瀏覽更多病患、搜尋病歷號或依日期篩選，請改用 get_patients_overview_page。
+    """
+    page = get_patients_overview_page()
+    return page["patients"] if page else []
+
+def get_patients_overview_page(page_size=OVERVIEW_PAGE_SIZE, after=None,
+                               patient_prefix=None, start_time=None, end_time=None):
+    """
+    以 keyset 分頁列出病患清單 (依最早紀錄新到舊，同時間再依病歷號)。
     用於前端顯示「病患儀表板」。
+
+    資料來自預先彙總的 patient_overview (見 sql/migrations/003_patient_overview.sql)，
+    每一頁都是從 (start_time, PATID) 索引的游標位置往後讀 page_size 筆，
+    翻到第幾頁成本都相同，不像 OFFSET 越後面越慢。
+
+    Args:
+        page_size: 每頁筆數
+        after: 上一頁回傳的 next_cursor；None 表示第一頁
+        patient_prefix: 病歷號前綴搜尋 (走 ix_patient_overview_patid_pattern)
+        start_time / end_time: 只列出就診期間與此區間重疊的病患 (YYYYMMDDHHMMSS)
+
+    Returns:
+        {"patients": [...], "next_cursor": (start_time, PATID) 或 None (已是最後一頁)}
+        連線或查詢失敗時回傳 None。
+    """
+    with pooled_connection() as conn:
+        if not conn: return None
+        return _fetch_patients_overview(conn, page_size, after, patient_prefix, start_time, end_time)
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _build_overview_page_sql(page_size, after, patient_prefix, start_time, end_time):
+    """組出 keyset 分頁 SQL；多取一筆用來判斷是否還有下一頁"""
+    vital_cols = ", ".join(col for col, _ in OVERVIEW_VITAL_COLUMNS)
+    # start_time 為 NULL 的列無法當作游標，不列入清單 (只有來源資料時間全空時才會發生)
+    conditions = ["start_time IS NOT NULL"]
+    params = []
+    if patient_prefix:
+        conditions.append("PATID LIKE %s")
+        params.append(_escape_like(patient_prefix) + '%')
+    if start_time:
+        conditions.append("end_time >= %s")
+        params.append(start_time)
+    if end_time:
+        conditions.append("start_time <= %s")
+        params.append(end_time)
+    if after:
+        conditions.append("(start_time, PATID) < (%s, %s)")
+        params.extend(after)
+    sql = f"""
+        SELECT PATID, start_time, end_time, encounter_count, latest_trino,
+               nursing_count, vitals_count, labs_count, {vital_cols}
+        FROM patient_overview
+        WHERE {" AND ".join(conditions)}
+        ORDER BY start_time DESC, PATID DESC
+        LIMIT %s
     """
-    conn = get_db_connection()
-    if not conn: return []
+    params.append(page_size + 1)
+    return sql, params
+
+def _overview_row(row):
+    latest_vitals = None
+    if row[8] is not None:
+        latest_vitals = {key: val for (_, key), val in zip(OVERVIEW_VITAL_COLUMNS, row[8:])}
+    return {
+        "病歷號": row[0],
+        "最早紀錄": row[1],
+        "最晚紀錄": row[2],
+        "資料筆數": row[5] + row[6] + row[7],
+        "就診次數": row[3],
+        "最近急診號": row[4],
+        "護理筆數": row[5],
+        "生理筆數": row[6],
+        "檢驗筆數": row[7],
+        "最新生命徵象": latest_vitals,
+    }
 
-    overview_list = []
+def _fetch_patients_overview(conn, page_size=OVERVIEW_PAGE_SIZE, after=None,
+                             patient_prefix=None, start_time=None, end_time=None):
     try:
         with conn.cursor() as cur:
-            # 我們從護理紀錄 (ENSDATA) 撈取，因為它通常代表一次完整的就診
-            # 統計每個病人的：最早紀錄時間、最晚紀錄時間、紀錄總筆數
-            query = """
-                SELECT PATID, 
-                       MIN(PROCDTTM) as start_time, 
-                       MAX(PROCDTTM) as end_time, 
-                       COUNT(*) as record_count
-                FROM ENSDATA
-                GROUP BY PATID
-                ORDER BY start_time DESC
-                LIMIT 50; -- 限制顯示最近的 50 位病人，避免資料太多跑不動
-            """
-            cur.execute(query)
+            sql, params = _build_overview_page_sql(page_size, after, patient_prefix, start_time, end_time)
+            cur.execute(sql, tuple(params))
             rows = cur.fetchall()
-            
-            for row in rows:
-                overview_list.append({
-                    "病歷號": row[0],
-                    "最早紀錄": row[1],
-                    "最晚紀錄": row[2],
-                    "資料筆數": row[3]
-                })
-        return overview_list
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1][1], rows[-1][0])
+        return {"patients": [_overview_row(row) for row in rows], "next_cursor": next_cursor}
 
     except psycopg2.Error as e:
         print(f"查詢病患清單失敗: {e}")
-        return []
-    finally:
-        conn.close()
+        return None
+
+# ==========================================
+# 就診清單 (同一位病患的每次急診)
+# ==========================================
+def list_patient_encounters(patient_id):
+    """
+    列出病患的每次就診，依最後一筆紀錄新到舊排序 (第一筆即最近一次就診)。
+    資料來自預先彙總的 encounter_overview (見 sql/migrations/003_patient_overview.sql)，走主鍵索引。
+
+    Returns:
+        [{"急診號", "最早紀錄", "最晚紀錄", "資料筆數", "護理筆數", "生理筆數", "檢驗筆數"}, ...]；
+        連線或查詢失敗時回傳 None
+    """
+    with pooled_connection() as conn:
+        if not conn: return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT TRINO, start_time, end_time, nursing_count, vitals_count, labs_count
+                    FROM encounter_overview
+                    WHERE PATID = %s
+                    ORDER BY end_time DESC NULLS LAST, TRINO DESC
+                """, (patient_id,))
+                rows = cur.fetchall()
+        except psycopg2.Error as e:
+            print(f"查詢就診清單失敗: {e}")
+            return None
+
+    return [{
+        "急診號": row[0],
+        "最早紀錄": row[1],
+        "最晚紀錄": row[2],
+        "資料筆數": row[3] + row[4] + row[5],
+        "護理筆數": row[3],
+        "生理筆數": row[4],
+        "檢驗筆數": row[5],
+    } for row in rows]
 
 # ==========================================
 # 測試區塊
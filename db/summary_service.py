@@ -0,0 +1,88 @@
+# /db/summary_service.py
+
+# 已生成摘要的保存與讀取 (增量更新用，見 sql/migrations/008_patient_summaries.sql 與 ai/summary_refresh.py)
+
+from psycopg2.extras import Json
+
+from db.db_connector import pooled_connection
+
+HWM_SOURCES = ("nursing", "vitals", "labs")
+
+def get_saved_summary(patient_id, summary_key):
+    """
+    讀取已保存的摘要。
+
+    Returns:
+        {"summary", "template_name", "high_water": {來源: 時間}, "seen": {來源: [水位時間上已涵蓋紀錄的指紋]},
+         "refresh_count", "updated_at"}；
+        沒有保存過或查詢失敗時回傳 None
+    """
+    with pooled_connection() as conn:
+        if not conn: return None
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT summary, template_name, nursing_hwm, vitals_hwm, labs_hwm, refresh_count, updated_at,
+                           hwm_seen
+                    FROM patient_summaries
+                    WHERE CHMRNO = %s AND summary_key = %s
+                """, (patient_id, summary_key))
+                row = cur.fetchone()
+            conn.rollback()
+        except Exception as e:
+            print(f"讀取已保存摘要失敗: {e}")
+            conn.rollback()
+            return None
+
+    if row is None:
+        return None
+    return {
+        "summary": row[0],
+        "template_name": row[1],
+        "high_water": dict(zip(HWM_SOURCES, row[2:5])),
+        "refresh_count": row[5],
+        "updated_at": row[6],
+        "seen": row[7] or {},
+    }
+
+def save_summary(patient_id, summary_key, template_name, summary, high_water, refresh_count=0, seen=None):
+    """保存 (或覆蓋) 一份摘要與它涵蓋到的高水位 (seen 為水位時間上已涵蓋紀錄的指紋)；成功回傳 True"""
+    with pooled_connection() as conn:
+        if not conn: return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO patient_summaries
+                        (CHMRNO, summary_key, template_name, summary, nursing_hwm, vitals_hwm, labs_hwm, refresh_count,
+                         hwm_seen)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (CHMRNO, summary_key) DO UPDATE SET
+                        template_name = EXCLUDED.template_name, summary = EXCLUDED.summary,
+                        nursing_hwm = EXCLUDED.nursing_hwm, vitals_hwm = EXCLUDED.vitals_hwm,
+                        labs_hwm = EXCLUDED.labs_hwm, refresh_count = EXCLUDED.refresh_count,
+                        hwm_seen = EXCLUDED.hwm_seen, updated_at = NOW()
+                """, (patient_id, summary_key, template_name, summary,
+                      *(high_water.get(source) for source in HWM_SOURCES), refresh_count, Json(seen or {})))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"保存摘要失敗: {e}")
+            conn.rollback()
+            return False
+
+def delete_saved_summaries(patient_id):
+    """刪除某位病患所有已保存的摘要 (下次一律完整重新生成)"""
+    with pooled_connection() as conn:
+        if not conn: return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM patient_summaries WHERE CHMRNO = %s", (patient_id,))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"刪除已保存摘要失敗: {e}")
+            conn.rollback()
+            return False
@@ -1,62 +1,224 @@
+import os
+import select
+import threading
+import time
+
 import psycopg2
-from db.db_connector import get_db_connection
+from db.db_connector import pooled_connection, get_db_connection
+
+# ==========================================
+# 模板快取
+# ==========================================
+# 模板很少變動，卻在每次 Streamlit 重新執行、每次生成摘要時都被讀取。
+# 快取整份 {name: content}，並以 (模板數, MAX(updated_at)) 作為版本水位：
+#   - create_template / update_template 成功後立即失效
+#   - 有啟動 LISTEN 時，其他行程的異動透過 NOTIFY 通知 (見 sql/migrations/005_template_notify.sql)
+#   - 沒有 LISTEN 時，每 TEMPLATE_CACHE_TTL 秒才回資料庫比對一次水位，水位沒變就沿用
+TEMPLATE_CHANNEL = "prompt_templates_changed"
+TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", "30"))
+
+_cache_lock = threading.Lock()
+_cache = {
+    "templates": None,    # {name: content}；None 表示需要重新載入
+    "watermark": None,    # (模板數, MAX(updated_at))
+    "version": 0,         # 每次實際重新載入 +1
+    "checked_at": 0.0,    # 上次與資料庫確認水位的時間 (monotonic)
+    "generation": 0,      # 每次失效 +1；載入期間若有失效，結果不寫回快取
+}
+_cache_stats = {"hits": 0, "reloads": 0, "revalidations": 0, "invalidations": 0, "notifications": 0}
+_listener = None
+# LISTEN 連線確實可用時才為 True (執行緒還活著不代表連線正常：可能正在等待重連)
+_listener_connected = False
+# 上次確認 LISTEN 連線可用的時間 (monotonic)；半開連線收不到任何東西，超過 2 倍 TTL 未確認就視為中斷
+_listener_confirmed_at = 0.0
+
+def invalidate_template_cache():
+    """讓下一次讀取重新從資料庫載入模板"""
+    with _cache_lock:
+        _cache["templates"] = None
+        _cache["generation"] += 1
+        _cache_stats["invalidations"] += 1
+
+def _load_templates(cur):
+    cur.execute("SELECT template_name, template_content FROM prompt_templates ORDER BY id ASC")
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+def _read_watermark(cur):
+    cur.execute("SELECT COUNT(*), MAX(updated_at) FROM prompt_templates")
+    return tuple(cur.fetchone())
+
+def _is_listening(now=None):
+    """LISTEN 連線已建立且最近確認過可用"""
+    now = time.monotonic() if now is None else now
+    return _listener_connected and now - _listener_confirmed_at < 2 * TEMPLATE_CACHE_TTL
+
+def _cached_templates():
+    """
+    取得快取中的模板字典 (內部共用，呼叫端不可修改)。
+    快取有效時完全不碰資料庫；資料庫連線失敗時沿用舊快取 (沒有快取則回傳 {})。
+    """
+    now = time.monotonic()
+    listening = _is_listening(now)
+    with _cache_lock:
+        templates = _cache["templates"]
+        if templates is not None and (listening or now - _cache["checked_at"] < TEMPLATE_CACHE_TTL):
+            _cache_stats["hits"] += 1
+            return templates
+        stale = _cache["templates"] is not None
+        watermark = _cache["watermark"]
+        generation = _cache["generation"]
+
+    with pooled_connection() as conn:
+        if not conn: return templates or {}
+        try:
+            with conn.cursor() as cur:
+                current = _read_watermark(cur)
+                if stale and current == watermark:
+                    # 水位沒變：只更新確認時間，不重新讀取內容
+                    with _cache_lock:
+                        if _cache["generation"] == generation:
+                            _cache["checked_at"] = now
+                        _cache_stats["revalidations"] += 1
+                    return templates
+                templates = _load_templates(cur)
+            conn.rollback()
+        except Exception as e:
+            print(f"查詢模板失敗: {e}")
+            return templates or {}
+
+    with _cache_lock:
+        _cache_stats["reloads"] += 1
+        if _cache["generation"] == generation:
+            _cache["templates"] = templates
+            _cache["watermark"] = current
+            _cache["checked_at"] = now
+            _cache["version"] += 1
+    return templates
 
 def get_all_templates():
     """取得所有模板的名稱與內容，回傳為字典格式 {name: content}"""
-    conn = get_db_connection()
-    if not conn: return {}
-
-    templates = {}
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT template_name, template_content FROM prompt_templates ORDER BY id ASC")
-            rows = cur.fetchall()
-            for row in rows:
-                templates[row[0]] = row[1]
-        return templates
-    except Exception as e:
-        print(f"查詢模板失敗: {e}")
-        return {}
-    finally:
-        conn.close()
+    # 回傳副本，呼叫端修改不會影響快取
+    return dict(_cached_templates())
+
+def get_template(name):
+    """取得單一模板內容；找不到回傳 None"""
+    return _cached_templates().get(name)
+
+def get_template_cache_stats():
+    """回傳模板快取的版本與命中統計"""
+    with _cache_lock:
+        return {
+            "version": _cache["version"],
+            "cached": _cache["templates"] is not None,
+            "listening": _is_listening(),
+            **_cache_stats,
+        }
+
+# ==========================================
+# LISTEN / NOTIFY：多個 app 行程之間同步失效
+# ==========================================
+def _listen_loop(stop_event, retry_seconds):
+    global _listener_connected, _listener_confirmed_at
+    # 沒有通知時，每隔這麼久以 SELECT 1 確認連線仍然可用 (半開連線會卡住，確認時間隨之過期)
+    ping_seconds = max(TEMPLATE_CACHE_TTL / 2, 1.0)
+    while not stop_event.is_set():
+        conn = get_db_connection()
+        if not conn:
+            stop_event.wait(retry_seconds)
+            continue
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {TEMPLATE_CHANNEL}")
+                _listener_confirmed_at = time.monotonic()
+                _listener_connected = True
+                # 連線 (重新) 建立期間可能錯過通知，保守起見先失效一次
+                invalidate_template_cache()
+                while not stop_event.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                    elif time.monotonic() - _listener_confirmed_at >= ping_seconds:
+                        cur.execute("SELECT 1")
+                    else:
+                        continue
+                    _listener_confirmed_at = time.monotonic()
+                    # poll 與 SELECT 1 都會收下等待中的通知
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        with _cache_lock:
+                            _cache_stats["notifications"] += 1
+                        invalidate_template_cache()
+        except (psycopg2.Error, OSError) as e:
+            _listener_connected = False
+            print(f"⚠️ 模板異動通知中斷，{retry_seconds} 秒後重新連線: {e}")
+            stop_event.wait(retry_seconds)
+        finally:
+            _listener_connected = False
+            conn.close()
 
+def start_template_listener(retry_seconds=5.0):
+    """
+    啟動背景執行緒 LISTEN 模板異動通知 (重複呼叫不會重複啟動)。
+    監聽期間快取不再定期回資料庫比對水位；連線中斷 (或超過 2 倍 TTL 未能確認連線可用) 時
+    自動退回 TTL 模式，並在背景重試。
+    """
+    global _listener
+    with _cache_lock:
+        if _listener is not None and _listener.is_alive():
+            return _listener
+        stop_event = threading.Event()
+        _listener = threading.Thread(target=_listen_loop, args=(stop_event, retry_seconds),
+                                     name="template-listener", daemon=True)
+        _listener.stop_event = stop_event
+        _listener.start()
+        return _listener
+
+def stop_template_listener():
+    global _listener
+    with _cache_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop_event.set()
+        listener.join(timeout=5)
+
+# ==========================================
+# 新增 / 更新
+# ==========================================
 def create_template(name, content, description=""):
     """新增一個模板"""
-    conn = get_db_connection()
-    if not conn: return False
-
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO prompt_templates (template_name, template_content, description)
-                VALUES (%s, %s, %s)
-            """, (name, content, description))
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"新增模板失敗: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+    with pooled_connection() as conn:
+        if not conn: return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO prompt_templates (template_name, template_content, description)
+                    VALUES (%s, %s, %s)
+                """, (name, content, description))
+            conn.commit()
+            invalidate_template_cache()
+            return True
+        except Exception as e:
+            print(f"新增模板失敗: {e}")
+            conn.rollback()
+            return False
 
 def update_template(old_name, new_content):
     """更新現有模板的內容"""
-    conn = get_db_connection()
-    if not conn: return False
-
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE prompt_templates 
-                SET template_content = %s, updated_at = NOW()
-                WHERE template_name = %s
-            """, (new_content, old_name))
-        conn.commit()
-        return True
-    except Exception as e:
-        print(f"更新模板失敗: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
\ No newline at end of file
+    with pooled_connection() as conn:
+        if not conn: return False
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE prompt_templates
+                    SET template_content = %s, updated_at = NOW()
+                    WHERE template_name = %s
+                """, (new_content, old_name))
+            conn.commit()
+            invalidate_template_cache()
+            return True
+        except Exception as e:
+            print(f"更新模板失敗: {e}")
+            conn.rollback()
+            return False
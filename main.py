@@ -9,6 +9,9 @@ from ai.ai_summarizer import generate_nursing_summary
 # 設定病歷號
 TEST_PATIENT_ID = '0002452972' 
 
+# 使用的摘要模板 (對應資料庫 prompt_templates.template_name)
+TEMPLATE_NAME = '交班報告'
+
 # === 【新增】 時間篩選設定 ===
 # 格式：YYYYMMDDHHMMSS (例如：2025年11月15日 15點00分00秒)
 # 如果設為 None，代表不限制
@@ -19,6 +22,7 @@ def main():
     print(f"=== 啟動 AI 護理摘要系統 ===")
     print(f"目標: {TEST_PATIENT_ID}")
     print(f"區間: {FILTER_START_TIME} ~ {FILTER_END_TIME}")
+    print(f"模板: {TEMPLATE_NAME}  (多位病患請改用: python -m ai.batch_summarizer --help)")
 
     load_dotenv()
     
@@ -53,7 +57,7 @@ def main():
     # 2. 呼叫 AI
     if os.getenv("GROQ_API_KEY"):
         print("\n2. 正在呼叫 Groq AI 生成摘要...")
-        summary = generate_nursing_summary(TEST_PATIENT_ID, patient_data)
+        summary = generate_nursing_summary(TEST_PATIENT_ID, patient_data, TEMPLATE_NAME)
         
         print("\n" + "="*40)
         print("       急診病程摘要 (AI Generated)")
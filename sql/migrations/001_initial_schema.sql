@@ -0,0 +1,143 @@
+-- 001_initial_schema.sql
+-- 急診資料表 + 模板表 + 匯入紀錄表
+-- 全部使用 IF NOT EXISTS，可安全套用在已手動建好資料表的既有資料庫上。
+-- 時間欄位沿用來源系統的字串格式：PROCDTTM 為 14 碼 (YYYYMMDDHHMMSS)，CHRCPDTM 等為 12 碼 (YYYYMMDDHHMM)。
+
+-- ==========================================
+-- 1. 急診護理紀錄
+-- ==========================================
+CREATE TABLE IF NOT EXISTS ENSDATA (
+    TRINO       VARCHAR(20),
+    PATID       VARCHAR(20),
+    VISITDT     VARCHAR(8),
+    SEQ         VARCHAR(10),
+    SUBJECT     TEXT,
+    PROCDTTM    VARCHAR(14),
+    DIAGNOSIS   TEXT,
+    CLOSE       VARCHAR(1),
+    FIINISH     VARCHAR(1)
+);
+
+-- ==========================================
+-- 2. 急診生理監測
+-- ==========================================
+CREATE TABLE IF NOT EXISTS v_ai_hisensnes (
+    TRINO       VARCHAR(20),
+    PATID       VARCHAR(20),
+    VISITDT     VARCHAR(8),
+    EWEIGHT     VARCHAR(10),
+    ETEMPUTER   VARCHAR(10),
+    ETREGION    VARCHAR(10),
+    EPLUSE      VARCHAR(10),
+    EBREATHE    VARCHAR(10),
+    EPRESSURE   VARCHAR(10),
+    EDIASTOLIC  VARCHAR(10),
+    ESAO2       VARCHAR(10),
+    GCS_E       VARCHAR(5),
+    GCS_V       VARCHAR(5),
+    GCS_M       VARCHAR(5),
+    PUPIL_L     VARCHAR(10),
+    PUPIL_R     VARCHAR(10),
+    ENESKIND    VARCHAR(10),
+    PROCDTTM    VARCHAR(14)
+);
+
+-- ==========================================
+-- 3. 急診檢驗明細
+-- ==========================================
+CREATE TABLE IF NOT EXISTS DB_ADM_LABDATA_ER (
+    CHAD1CASENO  VARCHAR(20),
+    CHMRNO       VARCHAR(20),
+    CHGREQNO     VARCHAR(20),
+    CHAPPDTM     VARCHAR(14),
+    CHRCPDTM     VARCHAR(14),
+    CHLREQNO     VARCHAR(20),
+    CHORDNO      VARCHAR(20),
+    CHITEMNO     VARCHAR(20),
+    CHHEAD       TEXT,
+    CHTEAMNAM    VARCHAR(20),
+    CHSTAT       VARCHAR(10),
+    CHSPECI      VARCHAR(50),
+    CHVAL        TEXT,
+    CHUNIT       VARCHAR(50),
+    CHCOMMT      TEXT,
+    CHNL         VARCHAR(50),
+    CHNH         VARCHAR(50),
+    CHITEMSEQ    VARCHAR(10),
+    CHREPORTDATE VARCHAR(14),
+    CHTEXT       TEXT,
+    CHSIGNDTTM   VARCHAR(14),
+    CHLABAPCODE  VARCHAR(20)
+);
+
+-- ==========================================
+-- 4. 急診檢驗頭檔
+-- ==========================================
+CREATE TABLE IF NOT EXISTS DB_ADM_LABORDER_ER (
+    CHCASENO    VARCHAR(20),
+    CHMRNO      VARCHAR(20),
+    CHGREQNO    VARCHAR(20),
+    CHAPPDTM    VARCHAR(14),
+    CHLREQNO    VARCHAR(20),
+    CHORDNO     VARCHAR(20),
+    CHORDNAM    TEXT,
+    CHTEAMNAM   VARCHAR(20),
+    CHSTAT      VARCHAR(10),
+    CHSPECI     VARCHAR(50),
+    SOURCETYPE  VARCHAR(5),
+    ORDSEQ      VARCHAR(40),
+    CHTAPPDT    VARCHAR(8),
+    CHRCPDTM    VARCHAR(14),
+    CHRCONNAME  VARCHAR(50),
+    CONCODE     VARCHAR(10),
+    LABMCHNO    VARCHAR(20),
+    LABUNIFNO   VARCHAR(20),
+    LABCLASS    VARCHAR(10),
+    ORDPROCDTTM VARCHAR(14)
+);
+
+-- ==========================================
+-- 5. 急診檢驗檢查主檔
+-- ==========================================
+CREATE TABLE IF NOT EXISTS DB_ADM_ORDER_ER (
+    CHAD1CASENO  VARCHAR(20),
+    CHAD1MRNO    VARCHAR(20),
+    CHAD4GREQNO  VARCHAR(20),
+    CHAD4CDATE   VARCHAR(14),
+    CHAD1ORDNO   VARCHAR(20),
+    CHAD4ORDNAME TEXT,
+    CHTEAMNAM    VARCHAR(20),
+    CHAD4SPECT   VARCHAR(50),
+    CHAD4DCDATE  VARCHAR(14),
+    CHAD4STAT    VARCHAR(10),
+    CHAD4REP1    VARCHAR(10),
+    CHRCPDTM     VARCHAR(14),
+    CHREPORTDATE VARCHAR(14),
+    CHTEXT       TEXT,
+    SOURCETYPE   VARCHAR(5)
+);
+
+-- ==========================================
+-- 6. AI 摘要模板
+-- ==========================================
+CREATE TABLE IF NOT EXISTS prompt_templates (
+    id               SERIAL PRIMARY KEY,
+    template_name    VARCHAR(100) NOT NULL UNIQUE,
+    template_content TEXT NOT NULL,
+    description      TEXT DEFAULT '',
+    created_at       TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at       TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- ==========================================
+-- 7. 匯入紀錄 (data_processor 增量匯入用)
+-- ==========================================
+CREATE TABLE IF NOT EXISTS import_manifest (
+    table_name    VARCHAR(64) PRIMARY KEY,
+    file_name     TEXT NOT NULL,
+    byte_offset   BIGINT NOT NULL,
+    prefix_sha256 CHAR(64) NOT NULL,
+    row_count     BIGINT NOT NULL DEFAULT 0,
+    max_time      VARCHAR(14),
+    loaded_at     TIMESTAMP NOT NULL DEFAULT NOW()
+);
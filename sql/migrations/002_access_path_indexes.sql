@@ -0,0 +1,40 @@
+-- 002_access_path_indexes.sql
+-- 對應 db/patient_service.py 的查詢形狀建立索引：
+--   WHERE PATID = ? AND PROCDTTM BETWEEN ... ORDER BY PROCDTTM
+--   WHERE CHMRNO = ? AND CHRCPDTM BETWEEN ... ORDER BY CHRCPDTM
+-- 生理監測與檢驗以 INCLUDE 帶上 SELECT 的欄位，讓病史查詢可以 Index Only Scan。
+-- 護理紀錄的 SUBJECT / DIAGNOSIS 可能很長 (超過 B-tree 單筆上限約 2.7KB)，因此不放進索引。
+
+-- 病史查詢 (時間範圍 + 排序)
+CREATE INDEX IF NOT EXISTS ix_ensdata_patid_procdttm
+    ON ENSDATA (PATID, PROCDTTM);
+
+CREATE INDEX IF NOT EXISTS ix_vitals_patid_procdttm
+    ON v_ai_hisensnes (PATID, PROCDTTM)
+    INCLUDE (ETEMPUTER, EPLUSE, EBREATHE, EPRESSURE, EDIASTOLIC, ESAO2, GCS_E, GCS_V, GCS_M);
+
+CREATE INDEX IF NOT EXISTS ix_labdata_chmrno_chrcpdtm
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHRCPDTM)
+    INCLUDE (CHHEAD, CHVAL, CHUNIT, CHNL, CHNH);
+
+CREATE INDEX IF NOT EXISTS ix_laborder_chmrno_chrcpdtm
+    ON DB_ADM_LABORDER_ER (CHMRNO, CHRCPDTM);
+
+CREATE INDEX IF NOT EXISTS ix_order_chad1mrno_chrcpdtm
+    ON DB_ADM_ORDER_ER (CHAD1MRNO, CHRCPDTM);
+
+-- 增量匯入依自然鍵合併 (data_processor.TABLE_SPECS 的 key)
+CREATE INDEX IF NOT EXISTS ix_ensdata_merge_key
+    ON ENSDATA (TRINO, SEQ, PROCDTTM);
+
+CREATE INDEX IF NOT EXISTS ix_vitals_merge_key
+    ON v_ai_hisensnes (TRINO, PROCDTTM);
+
+CREATE INDEX IF NOT EXISTS ix_labdata_merge_key
+    ON DB_ADM_LABDATA_ER (CHAD1CASENO, CHGREQNO, CHITEMNO);
+
+CREATE INDEX IF NOT EXISTS ix_laborder_merge_key
+    ON DB_ADM_LABORDER_ER (CHCASENO, ORDSEQ);
+
+CREATE INDEX IF NOT EXISTS ix_order_merge_key
+    ON DB_ADM_ORDER_ER (CHAD1CASENO, CHAD4GREQNO, CHAD4CDATE);
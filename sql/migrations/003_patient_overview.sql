@@ -0,0 +1,360 @@
+-- 003_patient_overview.sql
+-- 預先彙總的病患 / 就診總覽，取代每次對整張 ENSDATA 做 GROUP BY。
+--
+--   encounter_overview : 每次就診 (PATID + 急診號) 一列，三個來源的筆數、時間範圍、最新一筆生命徵象
+--   patient_overview   : 每位病患一列，由 encounter_overview 彙總
+--
+-- 維護方式 (觸發程序)：
+--   INSERT (含 COPY)  -> 以 transition table 彙總新增的資料，直接累加到 encounter_overview
+--   DELETE / UPDATE   -> 受影響的就診重新計算 (走 PATID 索引，只讀該病患的資料)
+--   encounter_overview 異動 -> 重新彙總該病患的 patient_overview
+-- 檢驗的急診號為 CHAD1CASENO (與 TRINO 相同)，收件時間 CHRCPDTM 為 12 碼，補 '00' 成 14 碼後再比較。
+
+-- ==========================================
+-- 1. 資料表
+-- ==========================================
+CREATE TABLE IF NOT EXISTS encounter_overview (
+    PATID              VARCHAR(20) NOT NULL,
+    TRINO              VARCHAR(20) NOT NULL,
+    start_time         VARCHAR(14),
+    end_time           VARCHAR(14),
+    nursing_count      INTEGER NOT NULL DEFAULT 0,
+    vitals_count       INTEGER NOT NULL DEFAULT 0,
+    labs_count         INTEGER NOT NULL DEFAULT 0,
+    latest_vitals_time VARCHAR(14),
+    latest_temp        VARCHAR(10),
+    latest_pulse       VARCHAR(10),
+    latest_resp        VARCHAR(10),
+    latest_sbp         VARCHAR(10),
+    latest_dbp         VARCHAR(10),
+    latest_spo2        VARCHAR(10),
+    latest_gcs         VARCHAR(20),
+    updated_at         TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (PATID, TRINO)
+);
+
+CREATE TABLE IF NOT EXISTS patient_overview (
+    PATID              VARCHAR(20) PRIMARY KEY,
+    start_time         VARCHAR(14),
+    end_time           VARCHAR(14),
+    encounter_count    INTEGER NOT NULL DEFAULT 0,
+    latest_trino       VARCHAR(20),
+    nursing_count      INTEGER NOT NULL DEFAULT 0,
+    vitals_count       INTEGER NOT NULL DEFAULT 0,
+    labs_count         INTEGER NOT NULL DEFAULT 0,
+    latest_vitals_time VARCHAR(14),
+    latest_temp        VARCHAR(10),
+    latest_pulse       VARCHAR(10),
+    latest_resp        VARCHAR(10),
+    latest_sbp         VARCHAR(10),
+    latest_dbp         VARCHAR(10),
+    latest_spo2        VARCHAR(10),
+    latest_gcs         VARCHAR(20),
+    updated_at         TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- 病患清單依「最早紀錄」新到舊排序
+CREATE INDEX IF NOT EXISTS ix_patient_overview_start_time
+    ON patient_overview (start_time DESC, PATID DESC);
+
+-- ==========================================
+-- 2. 重新計算單一就診 / 單一病患
+-- ==========================================
+CREATE OR REPLACE FUNCTION refresh_encounter_overview(p_patid TEXT, p_trino TEXT) RETURNS VOID AS $$
+DECLARE
+    n_cnt INTEGER; n_min TEXT; n_max TEXT;
+    v_cnt INTEGER; v_min TEXT; v_max TEXT;
+    l_cnt INTEGER; l_min TEXT; l_max TEXT;
+BEGIN
+    SELECT COUNT(*), MIN(PROCDTTM), MAX(PROCDTTM) INTO n_cnt, n_min, n_max
+    FROM ENSDATA WHERE PATID = p_patid AND TRINO = p_trino;
+
+    SELECT COUNT(*), MIN(PROCDTTM), MAX(PROCDTTM) INTO v_cnt, v_min, v_max
+    FROM v_ai_hisensnes WHERE PATID = p_patid AND TRINO = p_trino;
+
+    SELECT COUNT(*), MIN(rpad(CHRCPDTM, 14, '0')), MAX(rpad(CHRCPDTM, 14, '0')) INTO l_cnt, l_min, l_max
+    FROM DB_ADM_LABDATA_ER WHERE CHMRNO = p_patid AND CHAD1CASENO = p_trino;
+
+    IF n_cnt + v_cnt + l_cnt = 0 THEN
+        DELETE FROM encounter_overview WHERE PATID = p_patid AND TRINO = p_trino;
+        RETURN;
+    END IF;
+
+    INSERT INTO encounter_overview AS eo (
+        PATID, TRINO, start_time, end_time, nursing_count, vitals_count, labs_count,
+        latest_vitals_time, latest_temp, latest_pulse, latest_resp, latest_sbp, latest_dbp, latest_spo2, latest_gcs,
+        updated_at
+    )
+    SELECT p_patid, p_trino, LEAST(n_min, v_min, l_min), GREATEST(n_max, v_max, l_max), n_cnt, v_cnt, l_cnt,
+           lv.PROCDTTM, lv.ETEMPUTER, lv.EPLUSE, lv.EBREATHE, lv.EPRESSURE, lv.EDIASTOLIC, lv.ESAO2,
+           CASE WHEN lv.PROCDTTM IS NULL THEN NULL ELSE 'E' || COALESCE(lv.GCS_E, '') || 'V' || COALESCE(lv.GCS_V, '') || 'M' || COALESCE(lv.GCS_M, '') END,
+           NOW()
+    FROM (SELECT 1) one
+    LEFT JOIN LATERAL (
+        SELECT * FROM v_ai_hisensnes v
+        WHERE v.PATID = p_patid AND v.TRINO = p_trino
+        ORDER BY v.PROCDTTM DESC LIMIT 1
+    ) lv ON TRUE
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = EXCLUDED.start_time,
+        end_time = EXCLUDED.end_time,
+        nursing_count = EXCLUDED.nursing_count,
+        vitals_count = EXCLUDED.vitals_count,
+        labs_count = EXCLUDED.labs_count,
+        latest_vitals_time = EXCLUDED.latest_vitals_time,
+        latest_temp = EXCLUDED.latest_temp,
+        latest_pulse = EXCLUDED.latest_pulse,
+        latest_resp = EXCLUDED.latest_resp,
+        latest_sbp = EXCLUDED.latest_sbp,
+        latest_dbp = EXCLUDED.latest_dbp,
+        latest_spo2 = EXCLUDED.latest_spo2,
+        latest_gcs = EXCLUDED.latest_gcs,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_patient_overview(p_patid TEXT) RETURNS VOID AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM encounter_overview WHERE PATID = p_patid) THEN
+        DELETE FROM patient_overview WHERE PATID = p_patid;
+        RETURN;
+    END IF;
+
+    INSERT INTO patient_overview AS po (
+        PATID, start_time, end_time, encounter_count, latest_trino, nursing_count, vitals_count, labs_count,
+        latest_vitals_time, latest_temp, latest_pulse, latest_resp, latest_sbp, latest_dbp, latest_spo2, latest_gcs,
+        updated_at
+    )
+    SELECT agg.PATID, agg.start_time, agg.end_time, agg.encounter_count, agg.latest_trino,
+           agg.nursing_count, agg.vitals_count, agg.labs_count,
+           lv.latest_vitals_time, lv.latest_temp, lv.latest_pulse, lv.latest_resp,
+           lv.latest_sbp, lv.latest_dbp, lv.latest_spo2, lv.latest_gcs,
+           NOW()
+    FROM (
+        SELECT PATID, MIN(start_time) AS start_time, MAX(end_time) AS end_time, COUNT(*) AS encounter_count,
+               (array_agg(TRINO ORDER BY end_time DESC NULLS LAST))[1] AS latest_trino,
+               SUM(nursing_count) AS nursing_count, SUM(vitals_count) AS vitals_count, SUM(labs_count) AS labs_count
+        FROM encounter_overview WHERE PATID = p_patid GROUP BY PATID
+    ) agg
+    LEFT JOIN LATERAL (
+        SELECT * FROM encounter_overview e
+        WHERE e.PATID = p_patid AND e.latest_vitals_time IS NOT NULL
+        ORDER BY e.latest_vitals_time DESC LIMIT 1
+    ) lv ON TRUE
+    ON CONFLICT (PATID) DO UPDATE SET
+        start_time = EXCLUDED.start_time,
+        end_time = EXCLUDED.end_time,
+        encounter_count = EXCLUDED.encounter_count,
+        latest_trino = EXCLUDED.latest_trino,
+        nursing_count = EXCLUDED.nursing_count,
+        vitals_count = EXCLUDED.vitals_count,
+        labs_count = EXCLUDED.labs_count,
+        latest_vitals_time = EXCLUDED.latest_vitals_time,
+        latest_temp = EXCLUDED.latest_temp,
+        latest_pulse = EXCLUDED.latest_pulse,
+        latest_resp = EXCLUDED.latest_resp,
+        latest_sbp = EXCLUDED.latest_sbp,
+        latest_dbp = EXCLUDED.latest_dbp,
+        latest_spo2 = EXCLUDED.latest_spo2,
+        latest_gcs = EXCLUDED.latest_gcs,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==========================================
+-- 3. INSERT：彙總新增資料後直接累加 (不回頭讀舊資料)
+-- ==========================================
+CREATE OR REPLACE FUNCTION trg_ensdata_overview_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO encounter_overview AS eo (PATID, TRINO, start_time, end_time, nursing_count)
+    SELECT PATID, TRINO, MIN(PROCDTTM), MAX(PROCDTTM), COUNT(*)
+    FROM new_rows WHERE PATID IS NOT NULL AND TRINO IS NOT NULL
+    GROUP BY PATID, TRINO
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = LEAST(eo.start_time, EXCLUDED.start_time),
+        end_time = GREATEST(eo.end_time, EXCLUDED.end_time),
+        nursing_count = eo.nursing_count + EXCLUDED.nursing_count,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_vitals_overview_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO encounter_overview AS eo (PATID, TRINO, start_time, end_time, vitals_count)
+    SELECT PATID, TRINO, MIN(PROCDTTM), MAX(PROCDTTM), COUNT(*)
+    FROM new_rows WHERE PATID IS NOT NULL AND TRINO IS NOT NULL
+    GROUP BY PATID, TRINO
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = LEAST(eo.start_time, EXCLUDED.start_time),
+        end_time = GREATEST(eo.end_time, EXCLUDED.end_time),
+        vitals_count = eo.vitals_count + EXCLUDED.vitals_count,
+        updated_at = NOW();
+
+    -- 新資料比目前快照更新時，才覆蓋最新生命徵象
+    UPDATE encounter_overview eo SET
+        latest_vitals_time = lv.PROCDTTM,
+        latest_temp = lv.ETEMPUTER,
+        latest_pulse = lv.EPLUSE,
+        latest_resp = lv.EBREATHE,
+        latest_sbp = lv.EPRESSURE,
+        latest_dbp = lv.EDIASTOLIC,
+        latest_spo2 = lv.ESAO2,
+        latest_gcs = 'E' || COALESCE(lv.GCS_E, '') || 'V' || COALESCE(lv.GCS_V, '') || 'M' || COALESCE(lv.GCS_M, '')
+    FROM (
+        SELECT DISTINCT ON (PATID, TRINO) *
+        FROM new_rows WHERE PATID IS NOT NULL AND TRINO IS NOT NULL AND PROCDTTM IS NOT NULL
+        ORDER BY PATID, TRINO, PROCDTTM DESC
+    ) lv
+    WHERE eo.PATID = lv.PATID AND eo.TRINO = lv.TRINO
+      AND (eo.latest_vitals_time IS NULL OR lv.PROCDTTM >= eo.latest_vitals_time);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_labs_overview_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO encounter_overview AS eo (PATID, TRINO, start_time, end_time, labs_count)
+    SELECT CHMRNO, CHAD1CASENO, MIN(rpad(CHRCPDTM, 14, '0')), MAX(rpad(CHRCPDTM, 14, '0')), COUNT(*)
+    FROM new_rows WHERE CHMRNO IS NOT NULL AND CHAD1CASENO IS NOT NULL
+    GROUP BY CHMRNO, CHAD1CASENO
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = LEAST(eo.start_time, EXCLUDED.start_time),
+        end_time = GREATEST(eo.end_time, EXCLUDED.end_time),
+        labs_count = eo.labs_count + EXCLUDED.labs_count,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==========================================
+-- 4. DELETE / UPDATE：受影響的就診重新計算
+-- ==========================================
+CREATE OR REPLACE FUNCTION trg_encounter_overview_recompute() RETURNS TRIGGER AS $$
+DECLARE
+    k RECORD;
+BEGIN
+    -- TG_ARGV[0] / [1] 為該資料表的病歷號與急診號欄位名稱
+    IF TG_OP = 'UPDATE' THEN
+        FOR k IN EXECUTE format(
+            'SELECT %1$I AS patid, %2$I AS trino FROM old_rows UNION SELECT %1$I, %2$I FROM new_rows',
+            TG_ARGV[0], TG_ARGV[1])
+        LOOP
+            IF k.patid IS NOT NULL AND k.trino IS NOT NULL THEN
+                PERFORM refresh_encounter_overview(k.patid, k.trino);
+            END IF;
+        END LOOP;
+    ELSE
+        FOR k IN EXECUTE format('SELECT DISTINCT %1$I AS patid, %2$I AS trino FROM old_rows', TG_ARGV[0], TG_ARGV[1])
+        LOOP
+            IF k.patid IS NOT NULL AND k.trino IS NOT NULL THEN
+                PERFORM refresh_encounter_overview(k.patid, k.trino);
+            END IF;
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==========================================
+-- 5. encounter_overview 異動 -> 更新 patient_overview
+-- ==========================================
+CREATE OR REPLACE FUNCTION trg_patient_overview_refresh() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_patient_overview(OLD.PATID);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.PATID <> OLD.PATID) THEN
+        PERFORM refresh_patient_overview(NEW.PATID);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==========================================
+-- 6. 以現有資料回填
+-- ==========================================
+INSERT INTO encounter_overview (PATID, TRINO, start_time, end_time, nursing_count, vitals_count, labs_count)
+SELECT PATID, TRINO, MIN(start_time), MAX(end_time), SUM(n), SUM(v), SUM(l)
+FROM (
+    SELECT PATID, TRINO, MIN(PROCDTTM) AS start_time, MAX(PROCDTTM) AS end_time, COUNT(*) AS n, 0 AS v, 0 AS l
+    FROM ENSDATA WHERE PATID IS NOT NULL AND TRINO IS NOT NULL GROUP BY PATID, TRINO
+    UNION ALL
+    SELECT PATID, TRINO, MIN(PROCDTTM), MAX(PROCDTTM), 0, COUNT(*), 0
+    FROM v_ai_hisensnes WHERE PATID IS NOT NULL AND TRINO IS NOT NULL GROUP BY PATID, TRINO
+    UNION ALL
+    SELECT CHMRNO, CHAD1CASENO, MIN(rpad(CHRCPDTM, 14, '0')), MAX(rpad(CHRCPDTM, 14, '0')), 0, 0, COUNT(*)
+    FROM DB_ADM_LABDATA_ER WHERE CHMRNO IS NOT NULL AND CHAD1CASENO IS NOT NULL GROUP BY CHMRNO, CHAD1CASENO
+) src
+GROUP BY PATID, TRINO
+ON CONFLICT (PATID, TRINO) DO NOTHING;
+
+UPDATE encounter_overview eo SET
+    latest_vitals_time = lv.PROCDTTM,
+    latest_temp = lv.ETEMPUTER,
+    latest_pulse = lv.EPLUSE,
+    latest_resp = lv.EBREATHE,
+    latest_sbp = lv.EPRESSURE,
+    latest_dbp = lv.EDIASTOLIC,
+    latest_spo2 = lv.ESAO2,
+    latest_gcs = 'E' || COALESCE(lv.GCS_E, '') || 'V' || COALESCE(lv.GCS_V, '') || 'M' || COALESCE(lv.GCS_M, '')
+FROM (
+    SELECT DISTINCT ON (PATID, TRINO) *
+    FROM v_ai_hisensnes WHERE PATID IS NOT NULL AND TRINO IS NOT NULL AND PROCDTTM IS NOT NULL
+    ORDER BY PATID, TRINO, PROCDTTM DESC
+) lv
+WHERE eo.PATID = lv.PATID AND eo.TRINO = lv.TRINO;
+
+SELECT refresh_patient_overview(PATID) FROM (SELECT DISTINCT PATID FROM encounter_overview) p;
+
+-- ==========================================
+-- 7. 掛上觸發程序 (回填完成後才建立，避免回填時重複計算)
+-- ==========================================
+DROP TRIGGER IF EXISTS ensdata_overview_insert ON ENSDATA;
+CREATE TRIGGER ensdata_overview_insert AFTER INSERT ON ENSDATA
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_ensdata_overview_insert();
+
+DROP TRIGGER IF EXISTS ensdata_overview_delete ON ENSDATA;
+CREATE TRIGGER ensdata_overview_delete AFTER DELETE ON ENSDATA
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_encounter_overview_recompute('patid', 'trino');
+
+DROP TRIGGER IF EXISTS ensdata_overview_update ON ENSDATA;
+CREATE TRIGGER ensdata_overview_update AFTER UPDATE ON ENSDATA
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_encounter_overview_recompute('patid', 'trino');
+
+DROP TRIGGER IF EXISTS vitals_overview_insert ON v_ai_hisensnes;
+CREATE TRIGGER vitals_overview_insert AFTER INSERT ON v_ai_hisensnes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_vitals_overview_insert();
+
+DROP TRIGGER IF EXISTS vitals_overview_delete ON v_ai_hisensnes;
+CREATE TRIGGER vitals_overview_delete AFTER DELETE ON v_ai_hisensnes
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_encounter_overview_recompute('patid', 'trino');
+
+DROP TRIGGER IF EXISTS vitals_overview_update ON v_ai_hisensnes;
+CREATE TRIGGER vitals_overview_update AFTER UPDATE ON v_ai_hisensnes
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_encounter_overview_recompute('patid', 'trino');
+
+DROP TRIGGER IF EXISTS labs_overview_insert ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labs_overview_insert AFTER INSERT ON DB_ADM_LABDATA_ER
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_labs_overview_insert();
+
+DROP TRIGGER IF EXISTS labs_overview_delete ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labs_overview_delete AFTER DELETE ON DB_ADM_LABDATA_ER
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_encounter_overview_recompute('chmrno', 'chad1caseno');
+
+DROP TRIGGER IF EXISTS labs_overview_update ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labs_overview_update AFTER UPDATE ON DB_ADM_LABDATA_ER
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_encounter_overview_recompute('chmrno', 'chad1caseno');
+
+DROP TRIGGER IF EXISTS encounter_overview_to_patient ON encounter_overview;
+CREATE TRIGGER encounter_overview_to_patient AFTER INSERT OR UPDATE OR DELETE ON encounter_overview
+    FOR EACH ROW EXECUTE FUNCTION trg_patient_overview_refresh();
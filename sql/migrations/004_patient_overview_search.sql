@@ -0,0 +1,5 @@
+-- 004_patient_overview_search.sql
+-- 病患清單的病歷號前綴搜尋 (PATID LIKE '00024%')。
+-- 主鍵索引使用資料庫預設定序，非 C 定序時無法用於 LIKE 前綴比對，因此另建 pattern_ops 索引。
+CREATE INDEX IF NOT EXISTS ix_patient_overview_patid_pattern
+    ON patient_overview (PATID varchar_pattern_ops);
@@ -0,0 +1,14 @@
+-- 005_template_notify.sql
+-- prompt_templates 有任何異動時發出 NOTIFY，讓各 app 行程的模板快取失效
+-- (db/template_service.py 的 start_template_listener)。
+-- 以觸發程序發送，連直接用 psql 修改模板也會通知；NOTIFY 在交易 commit 後才送出。
+CREATE OR REPLACE FUNCTION trg_prompt_templates_notify() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('prompt_templates_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS prompt_templates_notify ON prompt_templates;
+CREATE TRIGGER prompt_templates_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON prompt_templates
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_prompt_templates_notify();
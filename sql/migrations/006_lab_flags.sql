@@ -0,0 +1,141 @@
+-- 006_lab_flags.sql
+-- 檢驗異常判讀在寫入時算好一次，不再每次查詢 / 每次送模型都重新解析字串：
+--   CHVAL_NUM : CHVAL 解析出的數值 (非數值結果為 NULL；"<5" 之類取 5)
+--   LAB_FLAG  : N 正常、H / L 高低、HH / LL 危急值、A 定性異常 (Positive 等)、NULL 無法判斷
+-- 參考範圍以該筆的 CHNL / CHNH 為準；該筆沒有時，改用 lab_reference (每個 CHITEMNO 一筆) 的資料。
+-- lab_reference 同時記錄危急值上下限 (critical_low / critical_high)，可直接以 SQL 維護。
+
+-- ==========================================
+-- 1. 每個檢驗項目的參考資料
+-- ==========================================
+CREATE TABLE IF NOT EXISTS lab_reference (
+    CHITEMNO      VARCHAR(20) PRIMARY KEY,
+    CHHEAD        TEXT,
+    CHUNIT        VARCHAR(50),
+    ref_low       NUMERIC,
+    ref_high      NUMERIC,
+    critical_low  NUMERIC,
+    critical_high NUMERIC,
+    updated_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE DB_ADM_LABDATA_ER ADD COLUMN IF NOT EXISTS CHVAL_NUM NUMERIC;
+ALTER TABLE DB_ADM_LABDATA_ER ADD COLUMN IF NOT EXISTS LAB_FLAG VARCHAR(2);
+
+-- ==========================================
+-- 2. 解析與判讀函數 (IMMUTABLE，可用於索引或查詢)
+-- ==========================================
+CREATE OR REPLACE FUNCTION lab_parse_numeric(val TEXT) RETURNS NUMERIC AS $$
+    SELECT substring(val FROM '^\s*[<>=≦≧]*\s*(-?[0-9]+(?:\.[0-9]+)?)\s*$')::NUMERIC
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION lab_compute_flag(val TEXT, num NUMERIC, low NUMERIC, high NUMERIC,
+                                            critical_low NUMERIC, critical_high NUMERIC) RETURNS VARCHAR AS $$
+    SELECT CASE
+        WHEN num IS NOT NULL AND num < critical_low THEN 'LL'
+        WHEN num IS NOT NULL AND num > critical_high THEN 'HH'
+        WHEN num IS NOT NULL AND num < low THEN 'L'
+        WHEN num IS NOT NULL AND num > high THEN 'H'
+        WHEN num IS NOT NULL AND (low IS NOT NULL OR high IS NOT NULL) THEN 'N'
+        WHEN lower(btrim(val)) IN ('positive', '陽性', 'reactive', '1+', '2+', '3+', '4+') THEN 'A'
+        WHEN lower(btrim(val)) IN ('negative', '陰性', 'non-reactive', 'nonreactive', 'not found', 'normal') THEN 'N'
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- ==========================================
+-- 3. 回填 lab_reference：每個項目取最常出現的參考範圍
+-- ==========================================
+INSERT INTO lab_reference (CHITEMNO, CHHEAD, CHUNIT, ref_low, ref_high)
+SELECT DISTINCT ON (CHITEMNO) CHITEMNO, CHHEAD, CHUNIT, lab_parse_numeric(CHNL), lab_parse_numeric(CHNH)
+FROM DB_ADM_LABDATA_ER
+WHERE CHITEMNO IS NOT NULL
+  AND (lab_parse_numeric(CHNL) IS NOT NULL OR lab_parse_numeric(CHNH) IS NOT NULL)
+GROUP BY CHITEMNO, CHHEAD, CHUNIT, CHNL, CHNH
+ORDER BY CHITEMNO, count(*) DESC
+ON CONFLICT (CHITEMNO) DO NOTHING;
+
+-- 常見危急值 (依本院檢驗項目代碼；其他項目可再以 UPDATE lab_reference 補上)
+INSERT INTO lab_reference (CHITEMNO, CHHEAD, critical_low, critical_high)
+VALUES
+    ('E09022C3', 'K(Blood)', 2.5, 6.5),
+    ('09041B11', 'K(Gas)', 2.5, 6.5),
+    ('09041V11', 'K+', 2.5, 6.5),
+    ('E09021C2', 'Na(Blood)', 120, 160),
+    ('09041B10', 'Na(Gas)', 120, 160),
+    ('09041V10', 'Na+', 120, 160),
+    ('E09005C1', '血糖(隨機)', 40, 500),
+    ('08011C3', 'Hb', 7.0, NULL),
+    ('08011C8', 'Platelet', 20, 1000),
+    ('08011C1', 'WBC', 2.0, 30.0),
+    ('09041B1', 'PH', 7.20, 7.60),
+    ('09041V1', 'pH', 7.20, 7.60),
+    ('08026CB2', 'INR', NULL, 5.0)
+ON CONFLICT (CHITEMNO) DO UPDATE
+    SET critical_low = EXCLUDED.critical_low, critical_high = EXCLUDED.critical_high, updated_at = now();
+
+-- 單筆判讀：參考範圍以該筆為準，沒有時查 lab_reference
+CREATE OR REPLACE FUNCTION lab_flag_for(item TEXT, val TEXT, chnl TEXT, chnh TEXT) RETURNS VARCHAR AS $$
+    SELECT lab_compute_flag(
+        val, lab_parse_numeric(val),
+        CASE WHEN own.low IS NULL AND own.high IS NULL THEN r.ref_low ELSE own.low END,
+        CASE WHEN own.low IS NULL AND own.high IS NULL THEN r.ref_high ELSE own.high END,
+        r.critical_low, r.critical_high)
+    FROM (SELECT lab_parse_numeric(chnl) AS low, lab_parse_numeric(chnh) AS high) own
+    LEFT JOIN lab_reference r ON r.CHITEMNO = item
+$$ LANGUAGE sql STABLE;
+
+-- ==========================================
+-- 4. 寫入時計算 (COPY / INSERT / 修改數值都會觸發)
+-- ==========================================
+CREATE OR REPLACE FUNCTION trg_labdata_flag() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.CHVAL_NUM := lab_parse_numeric(NEW.CHVAL);
+    NEW.LAB_FLAG := lab_flag_for(NEW.CHITEMNO, NEW.CHVAL, NEW.CHNL, NEW.CHNH);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 新項目第一次出現時記下它的參考範圍 (已存在的項目不覆蓋)
+CREATE OR REPLACE FUNCTION trg_lab_reference_learn() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO lab_reference (CHITEMNO, CHHEAD, CHUNIT, ref_low, ref_high)
+    SELECT DISTINCT ON (CHITEMNO) CHITEMNO, CHHEAD, CHUNIT, lab_parse_numeric(CHNL), lab_parse_numeric(CHNH)
+    FROM new_rows
+    WHERE CHITEMNO IS NOT NULL
+      AND (lab_parse_numeric(CHNL) IS NOT NULL OR lab_parse_numeric(CHNH) IS NOT NULL)
+    ORDER BY CHITEMNO, CHRCPDTM DESC
+    ON CONFLICT (CHITEMNO) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 回填既有資料 (數值欄位改變不影響病患總覽，暫停總覽的 UPDATE 觸發程序避免整批重算)
+ALTER TABLE DB_ADM_LABDATA_ER DISABLE TRIGGER labs_overview_update;
+UPDATE DB_ADM_LABDATA_ER
+SET CHVAL_NUM = lab_parse_numeric(CHVAL),
+    LAB_FLAG = lab_flag_for(CHITEMNO, CHVAL, CHNL, CHNH);
+ALTER TABLE DB_ADM_LABDATA_ER ENABLE TRIGGER labs_overview_update;
+
+DROP TRIGGER IF EXISTS labdata_flag ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labdata_flag BEFORE INSERT OR UPDATE OF CHVAL, CHNL, CHNH, CHITEMNO ON DB_ADM_LABDATA_ER
+    FOR EACH ROW EXECUTE FUNCTION trg_labdata_flag();
+
+DROP TRIGGER IF EXISTS labdata_reference_learn ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labdata_reference_learn AFTER INSERT ON DB_ADM_LABDATA_ER
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_lab_reference_learn();
+
+-- ==========================================
+-- 5. 索引
+-- ==========================================
+-- 病史查詢帶出新欄位，重建 INCLUDE 欄位以維持 Index Only Scan
+DROP INDEX IF EXISTS ix_labdata_chmrno_chrcpdtm;
+CREATE INDEX ix_labdata_chmrno_chrcpdtm
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHRCPDTM)
+    INCLUDE (CHHEAD, CHVAL, CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG);
+
+-- 「只看異常檢驗」直接走部分索引
+CREATE INDEX IF NOT EXISTS ix_labdata_abnormal
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHRCPDTM)
+    INCLUDE (CHHEAD, CHVAL, CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG)
+    WHERE LAB_FLAG <> 'N';
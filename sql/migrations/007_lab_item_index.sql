@@ -0,0 +1,8 @@
+-- 007_lab_item_index.sql
+-- 依檢驗項目取「最新一筆」、「第一筆與最新一筆」、「有變化的值」(db/patient_service.py 的 LAB_MODE_QUERIES)
+-- 都以 (CHMRNO, CHITEMNO) 分組、組內依 CHRCPDTM 排序；有這個索引時 DISTINCT ON 與 window function
+-- 直接依索引順序讀取，不必先把病患全部檢驗撈出來排序。INCLUDE 病史查詢用到的欄位以維持 Index Only Scan。
+
+CREATE INDEX IF NOT EXISTS ix_labdata_chmrno_item_time
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHITEMNO, CHRCPDTM)
+    INCLUDE (CHHEAD, CHVAL, CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG);
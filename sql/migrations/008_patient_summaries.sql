@@ -0,0 +1,21 @@
+-- 008_patient_summaries.sql
+-- 已生成的摘要連同它涵蓋到的資料時間 (高水位) 一起保存，之後「增量更新」只撈比水位新的紀錄，
+-- 再請模型以新紀錄修訂上一版摘要 (見 ai/summary_refresh.py)。
+-- 同一位病患可有多份摘要：summary_key 為 System Prompt (模板 / 風格 / 關注項目)、資料起始時間、
+-- 檢驗模式與模型的 SHA-256，任一項不同就是另一份摘要，不會拿別的模板的摘要來修訂。
+
+CREATE TABLE IF NOT EXISTS patient_summaries (
+    CHMRNO        VARCHAR(20) NOT NULL,
+    summary_key   CHAR(64) NOT NULL,
+    template_name VARCHAR(100),
+    summary       TEXT NOT NULL,
+    -- 各來源已涵蓋到的最晚時間 (與來源欄位同格式；NULL 表示該來源當時沒有資料)
+    nursing_hwm   VARCHAR(14),
+    vitals_hwm    VARCHAR(14),
+    labs_hwm      VARCHAR(14),
+    -- 自上次完整生成以來的增量更新次數 (超過上限時改為完整重新生成)
+    refresh_count INTEGER NOT NULL DEFAULT 0,
+    created_at    TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at    TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (CHMRNO, summary_key)
+);
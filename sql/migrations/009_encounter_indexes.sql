@@ -0,0 +1,17 @@
+-- 009_encounter_indexes.sql
+-- 依就診撈取病史 (db/patient_service.py 的 encounter_id / encounters)：
+--   WHERE PATID = ? AND TRINO = ? [AND PROCDTTM BETWEEN ...] ORDER BY PROCDTTM
+--   WHERE CHMRNO = ? AND CHAD1CASENO = ? [AND CHRCPDTM BETWEEN ...] ORDER BY CHRCPDTM
+-- 常回診的病患只讀這一次就診的索引範圍，不必把歷次就診全部讀出再過濾。
+-- INCLUDE 欄位同 002 / 006 的病史索引，維持 Index Only Scan；檢驗另帶 CHITEMNO 供 LAB_MODE_QUERIES 分組。
+
+CREATE INDEX IF NOT EXISTS ix_ensdata_patid_trino_procdttm
+    ON ENSDATA (PATID, TRINO, PROCDTTM);
+
+CREATE INDEX IF NOT EXISTS ix_vitals_patid_trino_procdttm
+    ON v_ai_hisensnes (PATID, TRINO, PROCDTTM)
+    INCLUDE (ETEMPUTER, EPLUSE, EBREATHE, EPRESSURE, EDIASTOLIC, ESAO2, GCS_E, GCS_V, GCS_M);
+
+CREATE INDEX IF NOT EXISTS ix_labdata_chmrno_caseno_chrcpdtm
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHAD1CASENO, CHRCPDTM)
+    INCLUDE (CHITEMNO, CHHEAD, CHVAL, CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG);
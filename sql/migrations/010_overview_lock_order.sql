@@ -0,0 +1,102 @@
+-- 010_overview_lock_order.sql
+-- 總覽維護的鎖定順序 (修正 003_patient_overview.sql)。
+--
+-- 護理紀錄、生命徵象、檢驗三張表平行匯入時 (data/data_processor.py 的 import_tables)，
+-- 三個 INSERT 觸發程序會同時 upsert 同一批 encounter_overview 列；原本 GROUP BY 後不排序，
+-- 各交易鎖定 (PATID, TRINO) 的順序不同就可能互相等待而 deadlock。
+-- 這裡一律依 (PATID, TRINO) 排序後再寫入；encounter_overview 的列觸發程序依寫入順序
+-- 更新 patient_overview，因此病患總覽也依 PATID 由小到大鎖定。
+
+CREATE OR REPLACE FUNCTION trg_ensdata_overview_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO encounter_overview AS eo (PATID, TRINO, start_time, end_time, nursing_count)
+    SELECT PATID, TRINO, MIN(PROCDTTM), MAX(PROCDTTM), COUNT(*)
+    FROM new_rows WHERE PATID IS NOT NULL AND TRINO IS NOT NULL
+    GROUP BY PATID, TRINO
+    ORDER BY PATID, TRINO
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = LEAST(eo.start_time, EXCLUDED.start_time),
+        end_time = GREATEST(eo.end_time, EXCLUDED.end_time),
+        nursing_count = eo.nursing_count + EXCLUDED.nursing_count,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_vitals_overview_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO encounter_overview AS eo (PATID, TRINO, start_time, end_time, vitals_count)
+    SELECT PATID, TRINO, MIN(PROCDTTM), MAX(PROCDTTM), COUNT(*)
+    FROM new_rows WHERE PATID IS NOT NULL AND TRINO IS NOT NULL
+    GROUP BY PATID, TRINO
+    ORDER BY PATID, TRINO
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = LEAST(eo.start_time, EXCLUDED.start_time),
+        end_time = GREATEST(eo.end_time, EXCLUDED.end_time),
+        vitals_count = eo.vitals_count + EXCLUDED.vitals_count,
+        updated_at = NOW();
+
+    -- 新資料比目前快照更新時，才覆蓋最新生命徵象 (這些列上面已經鎖定，不會再等待其他交易)
+    UPDATE encounter_overview eo SET
+        latest_vitals_time = lv.PROCDTTM,
+        latest_temp = lv.ETEMPUTER,
+        latest_pulse = lv.EPLUSE,
+        latest_resp = lv.EBREATHE,
+        latest_sbp = lv.EPRESSURE,
+        latest_dbp = lv.EDIASTOLIC,
+        latest_spo2 = lv.ESAO2,
+        latest_gcs = 'E' || COALESCE(lv.GCS_E, '') || 'V' || COALESCE(lv.GCS_V, '') || 'M' || COALESCE(lv.GCS_M, '')
+    FROM (
+        SELECT DISTINCT ON (PATID, TRINO) *
+        FROM new_rows WHERE PATID IS NOT NULL AND TRINO IS NOT NULL AND PROCDTTM IS NOT NULL
+        ORDER BY PATID, TRINO, PROCDTTM DESC
+    ) lv
+    WHERE eo.PATID = lv.PATID AND eo.TRINO = lv.TRINO
+      AND (eo.latest_vitals_time IS NULL OR lv.PROCDTTM >= eo.latest_vitals_time);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_labs_overview_insert() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO encounter_overview AS eo (PATID, TRINO, start_time, end_time, labs_count)
+    SELECT CHMRNO, CHAD1CASENO, MIN(rpad(CHRCPDTM, 14, '0')), MAX(rpad(CHRCPDTM, 14, '0')), COUNT(*)
+    FROM new_rows WHERE CHMRNO IS NOT NULL AND CHAD1CASENO IS NOT NULL
+    GROUP BY CHMRNO, CHAD1CASENO
+    ORDER BY CHMRNO, CHAD1CASENO
+    ON CONFLICT (PATID, TRINO) DO UPDATE SET
+        start_time = LEAST(eo.start_time, EXCLUDED.start_time),
+        end_time = GREATEST(eo.end_time, EXCLUDED.end_time),
+        labs_count = eo.labs_count + EXCLUDED.labs_count,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- DELETE / UPDATE 重新計算的就診同樣依 (PATID, TRINO) 順序處理
+CREATE OR REPLACE FUNCTION trg_encounter_overview_recompute() RETURNS TRIGGER AS $$
+DECLARE
+    k RECORD;
+BEGIN
+    -- TG_ARGV[0] / [1] 為該資料表的病歷號與急診號欄位名稱
+    IF TG_OP = 'UPDATE' THEN
+        FOR k IN EXECUTE format(
+            'SELECT %1$I AS patid, %2$I AS trino FROM old_rows UNION SELECT %1$I, %2$I FROM new_rows ORDER BY 1, 2',
+            TG_ARGV[0], TG_ARGV[1])
+        LOOP
+            IF k.patid IS NOT NULL AND k.trino IS NOT NULL THEN
+                PERFORM refresh_encounter_overview(k.patid, k.trino);
+            END IF;
+        END LOOP;
+    ELSE
+        FOR k IN EXECUTE format('SELECT DISTINCT %1$I AS patid, %2$I AS trino FROM old_rows ORDER BY 1, 2',
+                                TG_ARGV[0], TG_ARGV[1])
+        LOOP
+            IF k.patid IS NOT NULL AND k.trino IS NOT NULL THEN
+                PERFORM refresh_encounter_overview(k.patid, k.trino);
+            END IF;
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
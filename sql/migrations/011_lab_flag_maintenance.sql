@@ -0,0 +1,146 @@
+-- 011_lab_flag_maintenance.sql
+-- 檢驗判讀 (006_lab_flags.sql) 的維護方式：
+--
+--   1. 寫入時不再逐筆查 lab_reference：列觸發程序只用該筆自己的 CHNL / CHNH 判讀，
+--      敘述層級的觸發程序再以 transition table 與 lab_reference 一次 JOIN，只改寫判讀結果不同的列
+--      (需要參考資料的通常只有少數：沒有自帶參考範圍、或超出危急值的結果)。
+--   2. lab_reference 新增 / 修改 / 刪除 (含匯入時自動學到的新項目) 後，重新判讀該項目的既有資料，
+--      LAB_FLAG 不會停留在參考資料異動前的結果。
+--   3. 只改判讀欄位的 UPDATE 不影響病患總覽，以交易內設定 overview.skip_recompute 略過整批重算。
+
+-- ==========================================
+-- 1. 判讀函數：參考範圍以該筆為準，沒有時用傳入的參考資料
+-- ==========================================
+CREATE OR REPLACE FUNCTION lab_flag_with(val TEXT, num NUMERIC, chnl TEXT, chnh TEXT,
+                                         ref_low NUMERIC, ref_high NUMERIC,
+                                         critical_low NUMERIC, critical_high NUMERIC) RETURNS VARCHAR AS $$
+    SELECT lab_compute_flag(
+        val, num,
+        CASE WHEN own.low IS NULL AND own.high IS NULL THEN ref_low ELSE own.low END,
+        CASE WHEN own.low IS NULL AND own.high IS NULL THEN ref_high ELSE own.high END,
+        critical_low, critical_high)
+    FROM (SELECT lab_parse_numeric(chnl) AS low, lab_parse_numeric(chnh) AS high) own
+$$ LANGUAGE sql IMMUTABLE;
+
+-- 單筆判讀 (手動修改單筆資料、臨時查詢用)：查 lab_reference 後交給 lab_flag_with
+CREATE OR REPLACE FUNCTION lab_flag_for(item TEXT, val TEXT, chnl TEXT, chnh TEXT) RETURNS VARCHAR AS $$
+    SELECT lab_flag_with(val, lab_parse_numeric(val), chnl, chnh,
+                         r.ref_low, r.ref_high, r.critical_low, r.critical_high)
+    FROM (SELECT 1) one
+    LEFT JOIN lab_reference r ON r.CHITEMNO = item
+$$ LANGUAGE sql STABLE;
+
+-- ==========================================
+-- 2. 寫入時判讀
+-- ==========================================
+-- INSERT (含 COPY)：只用該筆自己的參考範圍，不查 lab_reference；UPDATE 為零星修改，直接查
+CREATE OR REPLACE FUNCTION trg_labdata_flag() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.CHVAL_NUM := lab_parse_numeric(NEW.CHVAL);
+    IF TG_OP = 'INSERT' THEN
+        NEW.LAB_FLAG := lab_flag_with(NEW.CHVAL, NEW.CHVAL_NUM, NEW.CHNL, NEW.CHNH, NULL, NULL, NULL, NULL);
+    ELSE
+        NEW.LAB_FLAG := lab_flag_for(NEW.CHITEMNO, NEW.CHVAL, NEW.CHNL, NEW.CHNH);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- INSERT 後：新增的資料與 lab_reference 一次 JOIN，補上需要參考資料 (項目參考範圍 / 危急值) 的判讀。
+-- 判讀只取決於 (項目, 結果, 參考範圍)，因此以病歷號 + 項目 + 時間 + 這些欄位找回資料列即可；
+-- 沒有病歷號的資料不會出現在任何病史查詢中，維持自帶範圍的判讀。
+CREATE OR REPLACE FUNCTION trg_labdata_flag_resolve() RETURNS TRIGGER AS $$
+DECLARE
+    previous TEXT := current_setting('overview.skip_recompute', true);
+BEGIN
+    PERFORM set_config('overview.skip_recompute', 'on', true);
+    UPDATE DB_ADM_LABDATA_ER t SET LAB_FLAG = f.flag
+    FROM (
+        SELECT DISTINCT n.CHMRNO, n.CHITEMNO, n.CHRCPDTM, n.CHVAL, n.CHNL, n.CHNH, n.LAB_FLAG AS own_flag,
+               lab_flag_with(n.CHVAL, n.CHVAL_NUM, n.CHNL, n.CHNH,
+                             r.ref_low, r.ref_high, r.critical_low, r.critical_high) AS flag
+        FROM new_rows n
+        JOIN lab_reference r ON r.CHITEMNO = n.CHITEMNO
+        WHERE n.CHMRNO IS NOT NULL
+    ) f
+    WHERE f.flag IS DISTINCT FROM f.own_flag
+      AND t.CHMRNO = f.CHMRNO AND t.CHITEMNO = f.CHITEMNO
+      AND t.CHRCPDTM IS NOT DISTINCT FROM f.CHRCPDTM
+      AND t.CHVAL IS NOT DISTINCT FROM f.CHVAL
+      AND t.CHNL IS NOT DISTINCT FROM f.CHNL
+      AND t.CHNH IS NOT DISTINCT FROM f.CHNH
+      AND t.LAB_FLAG IS DISTINCT FROM f.flag;
+    PERFORM set_config('overview.skip_recompute', COALESCE(previous, ''), true);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS labdata_flag_resolve ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labdata_flag_resolve AFTER INSERT ON DB_ADM_LABDATA_ER
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_labdata_flag_resolve();
+
+-- ==========================================
+-- 3. lab_reference 異動 -> 重新判讀該項目的既有資料
+-- ==========================================
+CREATE INDEX IF NOT EXISTS ix_labdata_chitemno ON DB_ADM_LABDATA_ER (CHITEMNO);
+
+CREATE OR REPLACE FUNCTION trg_lab_reference_reflag() RETURNS TRIGGER AS $$
+DECLARE
+    previous TEXT := current_setting('overview.skip_recompute', true);
+BEGIN
+    PERFORM set_config('overview.skip_recompute', 'on', true);
+    IF TG_OP = 'DELETE' THEN
+        -- 參考資料刪除後只剩該筆自帶的參考範圍
+        UPDATE DB_ADM_LABDATA_ER t
+        SET LAB_FLAG = lab_flag_with(t.CHVAL, t.CHVAL_NUM, t.CHNL, t.CHNH, NULL, NULL, NULL, NULL)
+        FROM (SELECT DISTINCT CHITEMNO FROM changed_refs) r
+        WHERE t.CHITEMNO = r.CHITEMNO
+          AND t.LAB_FLAG IS DISTINCT FROM lab_flag_with(t.CHVAL, t.CHVAL_NUM, t.CHNL, t.CHNH, NULL, NULL, NULL, NULL);
+    ELSE
+        UPDATE DB_ADM_LABDATA_ER t
+        SET LAB_FLAG = lab_flag_with(t.CHVAL, t.CHVAL_NUM, t.CHNL, t.CHNH,
+                                     r.ref_low, r.ref_high, r.critical_low, r.critical_high)
+        FROM changed_refs r
+        WHERE t.CHITEMNO = r.CHITEMNO
+          AND t.LAB_FLAG IS DISTINCT FROM lab_flag_with(t.CHVAL, t.CHVAL_NUM, t.CHNL, t.CHNH,
+                                                        r.ref_low, r.ref_high, r.critical_low, r.critical_high);
+    END IF;
+    PERFORM set_config('overview.skip_recompute', COALESCE(previous, ''), true);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS lab_reference_reflag_insert ON lab_reference;
+CREATE TRIGGER lab_reference_reflag_insert AFTER INSERT ON lab_reference
+    REFERENCING NEW TABLE AS changed_refs
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_lab_reference_reflag();
+
+DROP TRIGGER IF EXISTS lab_reference_reflag_update ON lab_reference;
+CREATE TRIGGER lab_reference_reflag_update AFTER UPDATE ON lab_reference
+    REFERENCING NEW TABLE AS changed_refs
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_lab_reference_reflag();
+
+DROP TRIGGER IF EXISTS lab_reference_reflag_delete ON lab_reference;
+CREATE TRIGGER lab_reference_reflag_delete AFTER DELETE ON lab_reference
+    REFERENCING OLD TABLE AS changed_refs
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_lab_reference_reflag();
+
+-- ==========================================
+-- 4. 只改判讀欄位時不重算病患總覽
+-- ==========================================
+DROP TRIGGER IF EXISTS labs_overview_update ON DB_ADM_LABDATA_ER;
+CREATE TRIGGER labs_overview_update AFTER UPDATE ON DB_ADM_LABDATA_ER
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    WHEN (current_setting('overview.skip_recompute', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION trg_encounter_overview_recompute('chmrno', 'chad1caseno');
+
+-- ==========================================
+-- 5. 修正既有資料中已經過時的判讀
+-- ==========================================
+SELECT set_config('overview.skip_recompute', 'on', true);
+UPDATE DB_ADM_LABDATA_ER
+SET LAB_FLAG = lab_flag_for(CHITEMNO, CHVAL, CHNL, CHNH)
+WHERE LAB_FLAG IS DISTINCT FROM lab_flag_for(CHITEMNO, CHVAL, CHNL, CHNH);
+SELECT set_config('overview.skip_recompute', '', true);
@@ -0,0 +1,10 @@
+-- 012_summary_hwm_rows.sql
+-- 增量更新的水位改為「時間 + 該時間上已涵蓋的紀錄」(修正 008_patient_summaries.sql)。
+--
+-- 原本只記最晚時間、下次撈「晚於」水位的紀錄；紀錄時間只到分鐘，同一分鐘稍後才寫入的紀錄
+-- 時間等於水位，會被永久漏掉。現在改撈「不早於」水位的紀錄，再以 hwm_seen 中的紀錄指紋
+-- (db/patient_service.row_fingerprint) 扣掉上一版已涵蓋的那幾筆。
+
+ALTER TABLE patient_summaries
+    -- {來源: [水位時間上已涵蓋紀錄的指紋, ...]}；NULL 表示舊資料 (水位時間上的紀錄會再送一次，不會漏)
+    ADD COLUMN IF NOT EXISTS hwm_seen JSONB;
@@ -0,0 +1,28 @@
+-- 013_lab_index_text_columns.sql
+-- 檢驗病史索引不再 INCLUDE 長度不受限的 TEXT 欄位 (修正 002 / 006 / 007 / 009 的檢驗索引)。
+--
+-- CHVAL (檢驗結果) 與 CHHEAD (項目名稱) 為 TEXT：文字報告型的結果可能很長，超過 B-tree 單筆上限
+-- (約 2.7KB) 時整筆 INSERT / COPY 會以 "index row size exceeds maximum" 失敗。比照護理紀錄的
+-- SUBJECT / DIAGNOSIS 不放進索引，改由 heap 取回；其餘欄位長度有上限，仍留在 INCLUDE 中。
+-- 索引鍵與排序不變，查詢仍走同一個索引範圍 (Index Scan)，只是這兩欄多一次 heap 讀取。
+
+DROP INDEX IF EXISTS ix_labdata_chmrno_chrcpdtm;
+CREATE INDEX ix_labdata_chmrno_chrcpdtm
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHRCPDTM)
+    INCLUDE (CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG);
+
+DROP INDEX IF EXISTS ix_labdata_abnormal;
+CREATE INDEX ix_labdata_abnormal
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHRCPDTM)
+    INCLUDE (CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG)
+    WHERE LAB_FLAG <> 'N';
+
+DROP INDEX IF EXISTS ix_labdata_chmrno_item_time;
+CREATE INDEX ix_labdata_chmrno_item_time
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHITEMNO, CHRCPDTM)
+    INCLUDE (CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG);
+
+DROP INDEX IF EXISTS ix_labdata_chmrno_caseno_chrcpdtm;
+CREATE INDEX ix_labdata_chmrno_caseno_chrcpdtm
+    ON DB_ADM_LABDATA_ER (CHMRNO, CHAD1CASENO, CHRCPDTM)
+    INCLUDE (CHITEMNO, CHUNIT, CHNL, CHNH, CHVAL_NUM, LAB_FLAG);
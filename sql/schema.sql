@@ -0,0 +1,2 @@
+-- 資料表結構改由 sql/migrations/ 依版本管理，請執行：
+--   python -m db.migrations migrate